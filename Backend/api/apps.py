@@ -1,6 +1,16 @@
 from django.apps import AppConfig
+from django.db.models.signals import post_migrate
+
+
+def _restore_search_triggers(sender, using, **kwargs):
+    from .search import ensure_search_triggers
+
+    ensure_search_triggers(using)
 
 
 class ApiConfig(AppConfig):
     default_auto_field = "django.db.models.BigAutoField"
     name = "api"
+
+    def ready(self):
+        post_migrate.connect(_restore_search_triggers, sender=self)
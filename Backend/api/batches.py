@@ -0,0 +1,143 @@
+"""
+Bulk video generation from a manifest.
+
+A manifest is a CSV file (header row required) or a JSON array of objects,
+one entry per video. Recognised columns:
+
+* name: video name (defaults to "<batch name> #<row>")
+* script: the text to speak; may be left out when the batch has a
+  script_template, which is filled in from the row's columns instead
+  ("Hi {first_name}, ..." with a first_name column)
+* voice_provider, voice_id, voice_language: override the batch defaults
+
+All other columns are only used as template variables. The avatar is shared
+by the whole batch and uploaded to GCP once; every row becomes its own
+VideoGeneration and GenerationJob, dispatched by the scheduler.
+"""
+import csv
+import io
+import json
+import re
+
+from django.db.models import Count, Q
+
+from .video_status import TERMINAL_STATUSES
+
+ROW_FIELDS = ('name', 'script', 'voice_provider', 'voice_id', 'voice_language')
+
+TEMPLATE_FIELD = re.compile(r'\{(\w+)\}')
+
+# Errors listed in a 400 response; a broken manifest tends to break every row
+MAX_REPORTED_ERRORS = 20
+
+
+class ManifestError(ValueError):
+    """The manifest can't be read, or some of its rows are invalid."""
+
+    def __init__(self, message, errors=None):
+        super().__init__(message)
+        self.message = message
+        self.errors = errors or []
+
+
+def _normalize_row(row):
+    normalized = {}
+    for key, value in row.items():
+        if key is None:
+            # csv.DictReader puts extra cells of a row under None
+            continue
+        key = str(key).strip().lower()
+        normalized[key] = '' if value is None else str(value).strip()
+    # Same name as the single-video endpoint
+    if 'script_input' in normalized and not normalized.get('script'):
+        normalized['script'] = normalized.pop('script_input')
+    return normalized
+
+
+def read_manifest(manifest_file=None, items=None, max_items=None):
+    """
+    Rows of a manifest as dicts with lower-cased keys and string values.
+
+    Args:
+        manifest_file: Uploaded .csv or .json file
+        items: Already parsed rows (a JSON request body's "items")
+        max_items: Reject manifests with more rows than this
+
+    Raises:
+        ManifestError
+    """
+    if manifest_file is not None:
+        raw = manifest_file.read()
+        try:
+            text = raw.decode('utf-8-sig')
+        except UnicodeDecodeError:
+            raise ManifestError('Manifest must be UTF-8 encoded')
+        if manifest_file.name.lower().endswith('.json') or text.lstrip().startswith('['):
+            try:
+                items = json.loads(text)
+            except ValueError as e:
+                raise ManifestError(f'Invalid JSON manifest: {e}')
+        else:
+            reader = csv.DictReader(io.StringIO(text))
+            if not reader.fieldnames:
+                raise ManifestError('CSV manifest needs a header row')
+            items = list(reader)
+
+    if not isinstance(items, list) or not items:
+        raise ManifestError('Manifest must contain at least one row')
+    if max_items is not None and len(items) > max_items:
+        raise ManifestError(f'At most {max_items} rows per batch')
+    if not all(isinstance(item, dict) for item in items):
+        raise ManifestError('Every manifest row must be an object')
+    return [_normalize_row(item) for item in items]
+
+
+def render_template(template, row):
+    """Fill {column} placeholders from the row; unknown ones are an error."""
+    missing = [name for name in TEMPLATE_FIELD.findall(template) if name not in row]
+    if missing:
+        raise KeyError(', '.join(sorted(set(missing))))
+    return TEMPLATE_FIELD.sub(lambda match: row[match.group(1)], template)
+
+
+def expand_rows(rows, batch_name, script_template='', defaults=None):
+    """
+    Turn manifest rows into one video spec each.
+
+    Returns:
+        List of dicts with name, script, voice_provider, voice_id, voice_language
+
+    Raises:
+        ManifestError: listing every invalid row (1-based, header excluded)
+    """
+    defaults = defaults or {}
+    specs, errors = [], []
+    for number, row in enumerate(rows, start=1):
+        script = row.get('script', '')
+        if not script and script_template:
+            try:
+                script = render_template(script_template, row)
+            except KeyError as e:
+                errors.append({'row': number, 'error': f'Missing template column(s): {e.args[0]}'})
+                continue
+        if not script.strip():
+            errors.append({'row': number, 'error': 'script is required'})
+            continue
+        spec = {field: row.get(field) or defaults.get(field) or '' for field in ROW_FIELDS}
+        spec['name'] = (row.get('name') or f'{batch_name} #{number}')[:255]
+        spec['script'] = script
+        specs.append(spec)
+
+    if errors:
+        raise ManifestError(f'{len(errors)} invalid manifest row(s)', errors[:MAX_REPORTED_ERRORS])
+    return specs
+
+
+def with_progress(batches):
+    """Annotate a GenerationBatch queryset with per-status video counts (one query)."""
+    return batches.annotate(
+        video_count=Count('videos'),
+        queued_count=Count('videos', filter=Q(videos__status='queued')),
+        done_count=Count('videos', filter=Q(videos__status='done')),
+        failed_count=Count('videos', filter=Q(videos__status__in=TERMINAL_STATUSES - {'done'})),
+    )
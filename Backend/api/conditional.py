@@ -0,0 +1,57 @@
+import hashlib
+
+from django.utils.cache import patch_cache_control
+from django.utils.http import http_date, parse_etags, parse_http_date_safe
+from rest_framework import status
+from rest_framework.response import Response
+
+
+def make_etag(*parts):
+    """
+    Build a strong ETag from the values that determine a response.
+
+    Args:
+        parts: Anything with a stable str() (ids, timestamps, versions, query params)
+
+    Returns:
+        Quoted ETag string
+    """
+    digest = hashlib.sha1('|'.join(str(part) for part in parts).encode()).hexdigest()
+    return f'"{digest}"'
+
+
+def is_not_modified(request, etag=None, last_modified=None):
+    """
+    Check the request's conditional headers against the current validators.
+
+    If-None-Match takes precedence over If-Modified-Since (RFC 9110 13.2.2).
+    """
+    if_none_match = request.META.get('HTTP_IF_NONE_MATCH')
+    if if_none_match is not None:
+        if etag is None:
+            return False
+        tags = parse_etags(if_none_match)
+        return '*' in tags or etag in tags
+
+    if_modified_since = request.META.get('HTTP_IF_MODIFIED_SINCE')
+    if if_modified_since and last_modified is not None:
+        since = parse_http_date_safe(if_modified_since)
+        return since is not None and int(last_modified.timestamp()) <= since
+
+    return False
+
+
+def set_validators(response, etag=None, last_modified=None):
+    """Attach ETag/Last-Modified and make clients revalidate before reusing the response."""
+    if etag:
+        response['ETag'] = etag
+    if last_modified is not None:
+        response['Last-Modified'] = http_date(last_modified.timestamp())
+    # Per-user data: browsers may keep it, shared caches may not
+    patch_cache_control(response, private=True, no_cache=True)
+    return response
+
+
+def not_modified(etag=None, last_modified=None):
+    """Empty 304 response carrying the same validators."""
+    return set_validators(Response(status=status.HTTP_304_NOT_MODIFIED), etag, last_modified)
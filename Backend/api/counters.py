@@ -0,0 +1,131 @@
+import atexit
+import logging
+import threading
+import time
+from collections import defaultdict
+
+from django.conf import settings
+from django.db import connections
+from django.db.models import F
+
+logger = logging.getLogger(__name__)
+
+
+class ViewCountBuffer:
+    """
+    Write-behind buffer for VideoGeneration.views_count.
+
+    New views are counted in memory and periodically flushed as one
+    `views_count = views_count + delta` UPDATE per video, so a popular video
+    takes one row write per flush interval instead of one per view. While
+    views are pending, a timer thread flushes them every `flush_seconds` even
+    if no further views arrive. The VideoView rows remain the source of truth;
+    counts lost with a killed process are repaired by `reconcile_counts --views`.
+    """
+
+    def __init__(self, flush_seconds, flush_threshold):
+        self.flush_seconds = flush_seconds
+        self.flush_threshold = flush_threshold
+        self._lock = threading.Lock()
+        self._pending = defaultdict(int)
+        self._pending_total = 0
+        self._last_flush = time.monotonic()
+        self._flushing = False
+        self._timer_running = False
+
+    def record(self, video_id, count=1):
+        """Buffer `count` new views for a video, flushing in the background when due."""
+        with self._lock:
+            self._pending[video_id] += count
+            self._pending_total += count
+            due = (
+                self._pending_total >= self.flush_threshold
+                or time.monotonic() - self._last_flush >= self.flush_seconds
+            )
+            if due and not self._flushing:
+                self._flushing = True
+            else:
+                due = False
+            start_timer = not self._timer_running
+            self._timer_running = True
+
+        if due:
+            threading.Thread(target=self._flush_in_background, daemon=True).start()
+        if start_timer:
+            threading.Thread(target=self._flush_periodically, daemon=True).start()
+
+    def pending(self, video_id):
+        """Views recorded by this process that have not been flushed yet."""
+        with self._lock:
+            return self._pending.get(video_id, 0)
+
+    def flush(self):
+        """
+        Apply all buffered deltas to the database.
+
+        Returns:
+            Number of videos whose counts were updated
+        """
+        from .feed_cache import invalidate_feed
+        from .models import VideoGeneration
+
+        with self._lock:
+            pending, self._pending = self._pending, defaultdict(int)
+            self._pending_total = 0
+            self._last_flush = time.monotonic()
+
+        flushed = 0
+        for video_id, delta in pending.items():
+            try:
+                VideoGeneration.objects.filter(pk=video_id).update(views_count=F('views_count') + delta)
+                flushed += 1
+            except Exception as e:
+                logger.exception('Failed to flush %s views for video %s: %s', delta, video_id, e)
+                # Keep the delta for the next flush rather than dropping it
+                self.record(video_id, delta)
+
+        if flushed:
+            # View counts are part of the cached feed pages
+            invalidate_feed(counts_only=True)
+        return flushed
+
+    def _flush_in_background(self):
+        try:
+            self.flush()
+        finally:
+            with self._lock:
+                self._flushing = False
+            # Connections are per-thread; don't leak this one
+            connections.close_all()
+
+    def _flush_periodically(self):
+        """Flush every flush_seconds while views are pending; exits once the buffer is empty."""
+        while True:
+            time.sleep(self.flush_seconds)
+            with self._lock:
+                if not self._pending_total:
+                    self._timer_running = False
+                    return
+                if self._flushing or time.monotonic() - self._last_flush < self.flush_seconds:
+                    # A threshold flush ran or is running; check again next interval
+                    continue
+                self._flushing = True
+            try:
+                self._flush_in_background()
+            except Exception as e:
+                # Whatever is still pending is retried next interval
+                logger.exception('Periodic view count flush failed: %s', e)
+
+
+view_counts = ViewCountBuffer(
+    flush_seconds=settings.VIEW_COUNT_FLUSH_SECONDS,
+    flush_threshold=settings.VIEW_COUNT_FLUSH_THRESHOLD,
+)
+
+
+@atexit.register
+def _flush_on_exit():
+    try:
+        view_counts.flush()
+    except Exception as e:
+        logger.warning('Could not flush buffered view counts on exit: %s', e)
@@ -0,0 +1,96 @@
+import logging
+import time
+
+from django.conf import settings
+from django.core.cache import cache
+
+logger = logging.getLogger(__name__)
+
+FEED_VERSION_KEY = 'social_feed:version'
+
+# Held for SOCIAL_FEED_CACHE_FRESH_SECONDS after a bump for changed counts
+COUNTS_BUMP_KEY = 'social_feed:counts_bumped'
+
+
+def get_feed_version():
+    """
+    Return the current social feed version.
+
+    Every cached feed page is keyed by this version, so bumping it invalidates
+    all pages at once without having to know which keys exist.
+    """
+    version = cache.get(FEED_VERSION_KEY)
+    if version is None:
+        # Seed from the clock so a version lost to eviction never reuses old keys
+        cache.add(FEED_VERSION_KEY, int(time.time() * 1000), None)
+        version = cache.get(FEED_VERSION_KEY)
+    return version
+
+
+def invalidate_feed(counts_only=False):
+    """
+    Invalidate all cached social feed pages.
+
+    Args:
+        counts_only: Only view/like counts changed. Those changes arrive
+            continuously, and every bump leaves all pages cold, so they bump
+            at most once per SOCIAL_FEED_CACHE_FRESH_SECONDS; a page cached
+            in between goes stale within that time anyway.
+    """
+    if counts_only and not cache.add(COUNTS_BUMP_KEY, 1, settings.SOCIAL_FEED_CACHE_FRESH_SECONDS):
+        return
+    try:
+        cache.incr(FEED_VERSION_KEY)
+    except ValueError:
+        # Key missing (never set or evicted): the next read seeds a fresh version
+        get_feed_version()
+
+
+def get_feed_page(key_parts, build):
+    """
+    Return the shared (user-independent) payload of a feed page from cache.
+
+    Entries carry a soft expiry: once it passes, a single request rebuilds the
+    page while everyone else keeps being served the stale copy. On a cold miss,
+    concurrent requests wait briefly for the one holding the rebuild lock
+    instead of all hitting the database at once.
+
+    Args:
+        key_parts: Values identifying the page (sort, cursor, page size...)
+        build: Callable returning the payload to cache
+
+    Returns:
+        The cached or freshly built payload
+    """
+    version = get_feed_version()
+    key = 'social_feed:page:{}:{}'.format(version, ':'.join(str(part) for part in key_parts))
+    lock_key = f'{key}:lock'
+
+    entry = cache.get(key)
+    if entry and time.time() < entry['fresh_until']:
+        return entry['data']
+
+    if cache.add(lock_key, 1, settings.SOCIAL_FEED_CACHE_LOCK_SECONDS):
+        try:
+            data = build()
+            cache.set(key, {
+                'data': data,
+                'fresh_until': time.time() + settings.SOCIAL_FEED_CACHE_FRESH_SECONDS,
+            }, settings.SOCIAL_FEED_CACHE_SECONDS)
+            return data
+        finally:
+            cache.delete(lock_key)
+
+    if entry:
+        # Someone else is already refreshing this page
+        return entry['data']
+
+    deadline = time.time() + settings.SOCIAL_FEED_CACHE_LOCK_SECONDS
+    while time.time() < deadline:
+        time.sleep(0.05)
+        entry = cache.get(key)
+        if entry:
+            return entry['data']
+
+    logger.warning('Timed out waiting for feed page %s to be built, building it directly', key)
+    return build()
@@ -1,12 +1,25 @@
 from google.cloud import storage
 from google.api_core.exceptions import NotFound
 from django.conf import settings
+import logging
 import os
+import time
 import uuid
+from concurrent.futures import ThreadPoolExecutor, as_completed
 from datetime import datetime
 from google.cloud import storage
 from google.api_core.exceptions import NotFound
 from django.conf import settings
+from django.core.files import File
+import requests
+
+logger = logging.getLogger(__name__)
+
+# Provider downloads (connect and per-read timeout, not the whole transfer)
+TRANSFER_TIMEOUT = 60
+TRANSFER_READ_SIZE = 1024 * 1024
+# GCS limit on the number of source objects in one compose request
+MAX_COMPOSE_SOURCES = 32
 
 def init_gcp_client():
     """Initialize GCP Storage client using service account JSON file."""
@@ -70,6 +83,30 @@ def ensure_bucket_exists():
     return bucket
 
 
+def gcp_public_url(blob_name):
+    """Public URL of an object in the bucket."""
+    return f"https://storage.googleapis.com/{settings.GCP_BUCKET_NAME}/{blob_name}"
+
+
+def blob_name_from_url(public_url):
+    """Object name of one of our public URLs (the inverse of gcp_public_url)."""
+    prefix = gcp_public_url('')
+    if not public_url.startswith(prefix):
+        raise ValueError(f'{public_url} is not in bucket {settings.GCP_BUCKET_NAME}')
+    return public_url[len(prefix):]
+
+
+def open_gcp_object(blob_name, name=None, size=None):
+    """An object as a sized file that streams from GCS (e.g. as a provider upload body)."""
+    blob = init_gcp_client().bucket(settings.GCP_BUCKET_NAME).blob(blob_name)
+    if size is None:
+        blob.reload()
+        size = blob.size
+    stream = File(blob.open('rb', chunk_size=settings.GCP_UPLOAD_CHUNK_SIZE), name=name or os.path.basename(blob_name))
+    stream.size = size
+    return stream
+
+
 def upload_file_to_gcp(file_path, destination_blob_name):
     """
     Upload a file to GCP bucket and return public URL
@@ -115,34 +152,180 @@ def upload_file_object_to_gcp(file_object, destination_blob_name):
     public_url = f"https://storage.googleapis.com/{settings.GCP_BUCKET_NAME}/{destination_blob_name}"
     return public_url
 
-def download_and_upload_to_gcp(source_url, destination_blob_name):
+def download_and_upload_to_gcp(source_url, destination_blob_name, content_type=None):
     """
     Download a file from URL and upload to GCP bucket
     
+    Files of at least GCP_PARALLEL_TRANSFER_THRESHOLD bytes from servers that
+    support range requests are copied in parallel parts (see
+    parallel_download_and_upload_to_gcp); anything else is streamed through
+    in one pass, never held in memory as a whole.
+    
     Args:
         source_url: URL of the file to download
         destination_blob_name: Path in the bucket where file will be stored
+        content_type: Content type to store (default: the source's)
     
     Returns:
         Public URL of the uploaded file
     """
-    import requests
-    
-    # Download file
-    response = requests.get(source_url, stream=True)
+    # A one-byte range probe reveals both the size and range support
+    response = requests.get(source_url, headers={'Range': 'bytes=0-0'}, stream=True, timeout=TRANSFER_TIMEOUT)
     response.raise_for_status()
+    content_type = content_type or response.headers.get('Content-Type')
+    size = _range_total(response)
+    if size and size >= settings.GCP_PARALLEL_TRANSFER_THRESHOLD:
+        response.close()
+        try:
+            return parallel_download_and_upload_to_gcp(source_url, destination_blob_name, size, content_type)
+        except RangeNotSupported:
+            logger.warning('%s stopped honouring range requests, copying it in one stream', source_url)
     
-    client = init_gcp_client()
-    bucket = client.get_bucket(settings.GCP_BUCKET_NAME)
+    if response.status_code == 206:
+        # Small file (or parallel copy impossible): fetch it whole
+        response.close()
+        response = requests.get(source_url, stream=True, timeout=TRANSFER_TIMEOUT)
+        response.raise_for_status()
     
-    blob = bucket.blob(destination_blob_name)
+    bucket = init_gcp_client().bucket(settings.GCP_BUCKET_NAME)
+    with response:
+        _stream_to_blob(response, bucket.blob(destination_blob_name), content_type)
+    return gcp_public_url(destination_blob_name)
+
+
+def parallel_download_and_upload_to_gcp(source_url, destination_blob_name, size, content_type=None):
+    """
+    Copy a large file to GCP as parallel ranged downloads and part uploads.
     
-    # Upload from downloaded content
-    blob.upload_from_string(response.content)
+    The file is split into GCP_PARALLEL_PART_SIZE parts. Up to
+    GCP_PARALLEL_TRANSFER_WORKERS of them are downloaded (HTTP Range) and
+    uploaded to temporary objects at once, each retried on its own up to
+    GCP_PARALLEL_PART_RETRIES times. The parts are then stitched together
+    with compose, so the copy runs at the aggregate bandwidth rather than
+    one stream's.
     
-    # Construct public URL
-    public_url = f"https://storage.googleapis.com/{settings.GCP_BUCKET_NAME}/{destination_blob_name}"
-    return public_url
+    Args:
+        source_url: URL of the file; the server must honour Range requests
+        destination_blob_name: Path in the bucket where file will be stored
+        size: Total size of the file in bytes
+        content_type: Content type of the final object
+    
+    Returns:
+        Public URL of the uploaded file
+    """
+    part_size = settings.GCP_PARALLEL_PART_SIZE
+    ranges = [(start, min(start + part_size, size) - 1) for start in range(0, size, part_size)]
+    part_names = [f"{destination_blob_name}.parts/{index:05d}" for index in range(len(ranges))]
+    bucket = init_gcp_client().bucket(settings.GCP_BUCKET_NAME)
+    temporaries = list(part_names)
+    
+    try:
+        pool = ThreadPoolExecutor(max_workers=min(settings.GCP_PARALLEL_TRANSFER_WORKERS, len(ranges)))
+        try:
+            futures = [
+                pool.submit(_transfer_part, source_url, part_name, start, end)
+                for part_name, (start, end) in zip(part_names, ranges)
+            ]
+            for future in as_completed(futures):
+                future.result()
+        except BaseException:
+            # One part failed for good: don't start the rest
+            pool.shutdown(wait=True, cancel_futures=True)
+            raise
+        pool.shutdown(wait=True)
+        
+        destination = bucket.blob(destination_blob_name)
+        destination.content_type = content_type
+        _compose(bucket, part_names, destination, temporaries)
+        destination.reload()
+        if destination.size != size:
+            raise IOError(f"Composed {destination.size} bytes of {size} for {destination_blob_name}")
+    finally:
+        bucket.delete_blobs([bucket.blob(name) for name in temporaries], on_error=lambda blob: None)
+    
+    logger.info('Copied %s bytes to %s in %s parallel parts', size, destination_blob_name, len(ranges))
+    return gcp_public_url(destination_blob_name)
+
+
+class RangeNotSupported(Exception):
+    """The source answered a range request with the whole file."""
+
+
+def _range_total(response):
+    """Total size from a 206 response's Content-Range ("bytes 0-0/12345"), or None."""
+    if response.status_code != 206:
+        return None
+    total = response.headers.get('Content-Range', '').rpartition('/')[2]
+    return int(total) if total.isdigit() else None
+
+
+def _stream_to_blob(response, blob, content_type=None, expected_size=None):
+    """Write a streamed HTTP response into a blob with bounded memory."""
+    writer = blob.open(
+        'wb', chunk_size=settings.GCP_UPLOAD_CHUNK_SIZE, ignore_flush=True,
+        content_type=content_type or 'application/octet-stream'
+    )
+    received = 0
+    for chunk in response.iter_content(chunk_size=TRANSFER_READ_SIZE):
+        writer.write(chunk)
+        received += len(chunk)
+    if expected_size is not None and received != expected_size:
+        # Not closing the writer leaves the upload unfinalized: no object is created
+        raise IOError(f"Received {received} of {expected_size} bytes")
+    writer.close()
+
+
+def _transfer_part(source_url, part_name, start, end):
+    """Copy bytes start..end (inclusive) of the source into their own object, with retries."""
+    retries = settings.GCP_PARALLEL_PART_RETRIES
+    for attempt in range(1, retries + 1):
+        try:
+            # A client per thread: the storage client isn't meant to be shared across threads
+            bucket = init_gcp_client().bucket(settings.GCP_BUCKET_NAME)
+            with requests.get(
+                source_url, headers={'Range': f'bytes={start}-{end}'}, stream=True, timeout=TRANSFER_TIMEOUT
+            ) as response:
+                response.raise_for_status()
+                if response.status_code != 206:
+                    raise RangeNotSupported(source_url)
+                _stream_to_blob(response, bucket.blob(part_name), expected_size=end - start + 1)
+            return
+        except RangeNotSupported:
+            raise
+        except Exception as e:
+            if attempt == retries:
+                raise
+            logger.warning('Part %s (bytes %s-%s) failed, attempt %s/%s: %s', part_name, start, end, attempt, retries, e)
+            time.sleep(min(2 ** attempt, 30))
+
+
+def _compose(bucket, names, destination, intermediates):
+    """
+    Compose objects into destination, in order.
+    
+    A compose request takes at most MAX_COMPOSE_SOURCES objects, so longer
+    lists are composed in a tree of intermediate objects.
+    
+    Args:
+        intermediates: List the names of intermediate objects are appended
+            to before they are created, so the caller can delete them even
+            if a later compose fails
+    """
+    level = 0
+    while len(names) > MAX_COMPOSE_SOURCES:
+        grouped = []
+        for index in range(0, len(names), MAX_COMPOSE_SOURCES):
+            group = names[index:index + MAX_COMPOSE_SOURCES]
+            if len(group) == 1:
+                grouped.append(group[0])
+                continue
+            name = f"{destination.name}.compose/{level}-{index // MAX_COMPOSE_SOURCES:05d}"
+            intermediates.append(name)
+            bucket.blob(name).compose([bucket.blob(source) for source in group])
+            grouped.append(name)
+        names = grouped
+        level += 1
+    destination.compose([bucket.blob(source) for source in names])
 
 def generate_unique_blob_name(folder, filename):
     """
@@ -0,0 +1,151 @@
+"""
+Idempotency-Key support for endpoints that start paid work.
+
+A client sends the same Idempotency-Key header on every retry of one logical
+request. The first request claims the key with a row in IdempotencyKey and
+runs the view. Its response is stored, and retries get that response back
+without the view running again. A retry that arrives while the first request
+is still running waits for it to finish.
+
+Server errors (5xx) and exceptions release the key so the request can be
+retried for real. Keys expire after IDEMPOTENCY_KEY_TTL_HOURS, and
+purge_idempotency_keys deletes the expired rows.
+"""
+import hashlib
+import json
+import logging
+import time
+from datetime import timedelta
+from functools import wraps
+
+from django.conf import settings
+from django.db import IntegrityError, transaction
+from django.utils import timezone
+from rest_framework import status
+from rest_framework.response import Response
+from rest_framework.utils.encoders import JSONEncoder
+
+from .models import IdempotencyKey
+
+logger = logging.getLogger(__name__)
+
+IDEMPOTENCY_HEADER = 'Idempotency-Key'
+
+
+def request_hash(request):
+    """Hash the method, path and body (uploaded files by content) of a request."""
+    digest = hashlib.sha256(f'{request.method} {request.path}'.encode())
+    data = request.data
+    keys = sorted(data.keys()) if hasattr(data, 'keys') else []
+    for key in keys:
+        values = data.getlist(key) if hasattr(data, 'getlist') else [data[key]]
+        for value in values:
+            digest.update(f'\0{key}='.encode())
+            if getattr(value, 'sha256', None):
+                # Streamed to GCS (uploads.py), hashed on the way in
+                digest.update(value.sha256.encode())
+            elif hasattr(value, 'chunks'):
+                for chunk in value.chunks():
+                    digest.update(chunk)
+                value.seek(0)
+            else:
+                digest.update(json.dumps(value, sort_keys=True, cls=JSONEncoder).encode())
+    return digest.hexdigest()
+
+
+def _claim(user, key, fingerprint):
+    """Create the key row. Returns (row, created)."""
+    now = timezone.now()
+    try:
+        with transaction.atomic():
+            row = IdempotencyKey.objects.create(
+                user=user, key=key, request_hash=fingerprint,
+                expires_at=now + timedelta(hours=settings.IDEMPOTENCY_KEY_TTL_HOURS)
+            )
+            return row, True
+    except IntegrityError:
+        pass
+
+    row = IdempotencyKey.objects.filter(user=user, key=key).first()
+    if row is None:
+        # Released between our insert and this read; the caller tries again
+        return None, False
+
+    abandoned = (
+        row.status == 'in_progress'
+        and row.created_at < now - timedelta(seconds=settings.IDEMPOTENCY_LOCK_SECONDS)
+    )
+    if row.expires_at <= now or abandoned:
+        # Compare-and-delete so two retries can't both take over the key
+        IdempotencyKey.objects.filter(pk=row.pk, created_at=row.created_at).delete()
+        return None, False
+    return row, False
+
+
+def _replay(row):
+    response = Response(row.response_body, status=row.response_status)
+    response['Idempotent-Replayed'] = 'true'
+    return response
+
+
+def idempotent(view):
+    """
+    Make a function-based API view honour the Idempotency-Key header.
+
+    Goes below @permission_classes so request.user is authenticated. Requests
+    without the header run as usual.
+    """
+    @wraps(view)
+    def wrapper(request, *args, **kwargs):
+        key = request.headers.get(IDEMPOTENCY_HEADER)
+        if not key:
+            return view(request, *args, **kwargs)
+        if len(key) > 255:
+            return Response(
+                {"detail": f"{IDEMPOTENCY_HEADER} must be at most 255 characters"},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+
+        fingerprint = request_hash(request)
+        deadline = time.time() + settings.IDEMPOTENCY_WAIT_SECONDS
+        while True:
+            row, created = _claim(request.user, key, fingerprint)
+            if created:
+                break
+            if row is not None:
+                if row.request_hash != fingerprint:
+                    return Response(
+                        {"detail": f"{IDEMPOTENCY_HEADER} was already used for a different request"},
+                        status=status.HTTP_422_UNPROCESSABLE_ENTITY
+                    )
+                if row.status == 'completed':
+                    return _replay(row)
+            # In progress elsewhere (or just released): wait and look again
+            if time.time() >= deadline:
+                response = Response(
+                    {"detail": "A request with this Idempotency-Key is still being processed"},
+                    status=status.HTTP_409_CONFLICT
+                )
+                response['Retry-After'] = '5'
+                return response
+            time.sleep(0.25)
+
+        try:
+            response = view(request, *args, **kwargs)
+        except Exception:
+            row.delete()
+            raise
+
+        if response.status_code >= 500 or not hasattr(response, 'data'):
+            # Nothing durable happened (or nothing we can replay); let the client retry
+            row.delete()
+            return response
+
+        row.status = 'completed'
+        row.response_status = response.status_code
+        # Round-trip through DRF's encoder so dates, decimals etc. fit in the JSON column
+        row.response_body = json.loads(json.dumps(response.data, cls=JSONEncoder))
+        row.save(update_fields=['status', 'response_status', 'response_body'])
+        return response
+
+    return wrapper
@@ -0,0 +1,215 @@
+import random
+import statistics
+import time
+from datetime import timedelta
+
+from django.contrib.auth import get_user_model
+from django.core.management.base import BaseCommand
+from django.db import connection, transaction
+from django.utils import timezone
+
+from api.models import PasswordResetOTP, VideoGeneration
+from api.pagination import encode_cursor, keyset_filter, keyset_paginate
+
+User = get_user_model()
+
+
+class Command(BaseCommand):
+    help = (
+        "Seed a large synthetic dataset and compare query plans and latencies of the "
+        "feed, per-user listing and OTP lookup queries with and without the indexes "
+        "declared on the models. Everything runs in one transaction that is rolled back."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--rows', type=int, default=1_000_000, help='VideoGeneration rows to seed')
+        parser.add_argument('--users', type=int, default=1_000, help='Users to spread the rows across')
+        parser.add_argument('--otps', type=int, default=100_000, help='PasswordResetOTP rows to seed')
+        parser.add_argument('--iterations', type=int, default=20, help='Timed runs per query')
+        parser.add_argument('--batch-size', type=int, default=5_000, help='bulk_create batch size')
+        parser.add_argument('--no-plans', action='store_true', help='Skip printing EXPLAIN output')
+
+    def handle(self, *args, **options):
+        self.options = options
+        with transaction.atomic():
+            self.seed()
+            self.analyze()
+            queries = self.build_queries()
+
+            self.drop_indexes()
+            self.analyze()
+            before = self.run_queries('without indexes', queries)
+
+            self.create_indexes()
+            self.analyze()
+            after = self.run_queries('with indexes', queries)
+
+            self.report(before, after)
+            transaction.set_rollback(True)
+        self.stdout.write("Rolled back all seeded rows and index changes.")
+
+    # ------------------------------------------------------------------
+    # Seeding
+    # ------------------------------------------------------------------
+
+    def seed(self):
+        rows, batch_size = self.options['rows'], self.options['batch_size']
+        self.stdout.write(self.style.MIGRATE_HEADING(
+            f"Seeding {self.options['users']} users, {rows} videos, {self.options['otps']} OTPs on {connection.vendor}..."
+        ))
+        started = time.perf_counter()
+
+        run_id = random.randint(0, 10**9)
+        User.objects.bulk_create(
+            [User(username=f'bench_{run_id}_{i}', email=f'bench_{run_id}_{i}@example.com', password='!')
+             for i in range(self.options['users'])],
+            batch_size=batch_size,
+        )
+        user_ids = list(User.objects.filter(username__startswith=f'bench_{run_id}_').values_list('id', flat=True))
+        # One heavy user owns ~5% of all videos, like a power user with thousands of renders
+        self.heavy_user_id = user_ids[0]
+
+        now = timezone.now()
+        statuses = ['done'] * 8 + ['error', 'processing']
+        created = 0
+        while created < rows:
+            count = min(batch_size, rows - created)
+            batch = []
+            for i in range(count):
+                n = created + i
+                user_id = self.heavy_user_id if random.random() < 0.05 else random.choice(user_ids)
+                batch.append(VideoGeneration(
+                    user_id=user_id,
+                    name=f'Benchmark video {n}',
+                    source_url='https://storage.googleapis.com/bench/image.png',
+                    script_input='Lorem ipsum dolor sit amet',
+                    talk_id=f'bench-{run_id}-{n}',
+                    status=random.choice(statuses),
+                    is_public=random.random() < 0.2,
+                    config={},
+                ))
+            VideoGeneration.objects.bulk_create(batch, batch_size=batch_size)
+            created += count
+
+        # auto_now_add ignores explicit values, so spread created_at over a year afterwards
+        self.stdout.write("Spreading created_at over the last year...")
+        ids = list(VideoGeneration.objects.filter(talk_id__startswith=f'bench-{run_id}-').values_list('id', flat=True))
+        for start in range(0, len(ids), batch_size):
+            chunk = VideoGeneration.objects.filter(id__in=ids[start:start + batch_size]).only('id')
+            updates = []
+            for video in chunk:
+                video.created_at = now - timedelta(seconds=random.randint(0, 365 * 24 * 3600))
+                updates.append(video)
+            VideoGeneration.objects.bulk_update(updates, ['created_at'], batch_size=batch_size)
+
+        emails = [f'bench_{run_id}_{i}@example.com' for i in range(self.options['users'])]
+        otps = []
+        for _ in range(self.options['otps']):
+            otps.append(PasswordResetOTP(
+                email=random.choice(emails),
+                otp=f'{random.randint(0, 999999):06d}',
+                expires_at=now + timedelta(minutes=10),
+                is_used=random.random() < 0.9,
+            ))
+        PasswordResetOTP.objects.bulk_create(otps, batch_size=batch_size)
+        self.sample_otp = otps[-1]
+
+        self.stdout.write(f"Seeded in {time.perf_counter() - started:.1f}s")
+
+    def analyze(self):
+        with connection.cursor() as cursor:
+            cursor.execute('ANALYZE')
+
+    # ------------------------------------------------------------------
+    # Indexes
+    # ------------------------------------------------------------------
+
+    def model_indexes(self):
+        for model in (VideoGeneration, PasswordResetOTP):
+            for index in model._meta.indexes:
+                yield model, index
+
+    def schema_editor(self):
+        # Only used to render DDL, which is then executed directly: SQLite refuses
+        # to enter a schema_editor context inside an atomic block.
+        editor = connection.schema_editor()
+        editor.deferred_sql = []
+        return editor
+
+    def drop_indexes(self):
+        editor = self.schema_editor()
+        with connection.cursor() as cursor:
+            for model, index in self.model_indexes():
+                cursor.execute(str(index.remove_sql(model, editor)))
+
+    def create_indexes(self):
+        editor = self.schema_editor()
+        with connection.cursor() as cursor:
+            for model, index in self.model_indexes():
+                cursor.execute(str(index.create_sql(model, editor)))
+
+    # ------------------------------------------------------------------
+    # Queries
+    # ------------------------------------------------------------------
+
+    def build_queries(self):
+        feed = VideoGeneration.objects.filter(is_public=True, status='done')
+        page_size = 10
+        # Page 500, or the last page when the feed is shorter than that
+        depth = min(page_size * 500, max(feed.count() - 1, 0))
+        deep_row = feed.order_by('-created_at', '-id').values_list('created_at', 'id')[depth]
+        self.deep_values = list(deep_row)
+        deep_cursor = encode_cursor(self.deep_values)
+        otp = self.sample_otp
+
+        return {
+            'feed page 1': lambda: keyset_paginate(feed, ('created_at', 'id'), page_size=page_size)['results'],
+            'feed page 500': lambda: keyset_paginate(
+                feed, ('created_at', 'id'), cursor=deep_cursor, page_size=page_size
+            )['results'],
+            'user listing': lambda: list(
+                VideoGeneration.objects.filter(user_id=self.heavy_user_id).order_by('-created_at', '-id')[:20]
+            ),
+            'otp lookup': lambda: PasswordResetOTP.objects.filter(
+                email=otp.email, otp=otp.otp, is_used=False
+            ).order_by('-created_at').first(),
+        }
+
+    def explain(self, name):
+        feed = VideoGeneration.objects.filter(is_public=True, status='done').order_by('-created_at', '-id')
+        otp = self.sample_otp
+        querysets = {
+            'feed page 1': feed[:11],
+            'feed page 500': feed.filter(keyset_filter(('created_at', 'id'), self.deep_values))[:11],
+            'user listing': VideoGeneration.objects.filter(user_id=self.heavy_user_id).order_by('-created_at', '-id')[:20],
+            'otp lookup': PasswordResetOTP.objects.filter(
+                email=otp.email, otp=otp.otp, is_used=False
+            ).order_by('-created_at')[:1],
+        }
+        return querysets[name].explain()
+
+    def run_queries(self, label, queries):
+        self.stdout.write(self.style.MIGRATE_HEADING(f"\n=== {label} ==="))
+        results = {}
+        for name, query in queries.items():
+            query()  # warm up caches
+            timings = []
+            for _ in range(self.options['iterations']):
+                started = time.perf_counter()
+                query()
+                timings.append((time.perf_counter() - started) * 1000)
+            timings.sort()
+            p95 = timings[min(len(timings) - 1, int(len(timings) * 0.95))]
+            results[name] = (statistics.median(timings), p95)
+            self.stdout.write(f"{name:<15} median {results[name][0]:9.2f} ms   p95 {p95:9.2f} ms")
+            if not self.options['no_plans']:
+                for line in self.explain(name).splitlines():
+                    self.stdout.write(f"    {line}")
+        return results
+
+    def report(self, before, after):
+        self.stdout.write(self.style.MIGRATE_HEADING("\n=== Summary (median ms) ==="))
+        for name in before:
+            old, new = before[name][0], after[name][0]
+            speedup = old / new if new else float('inf')
+            self.stdout.write(self.style.SUCCESS(f"{name:<15} {old:9.2f} -> {new:9.2f}  ({speedup:.1f}x)"))
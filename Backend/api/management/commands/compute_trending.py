@@ -0,0 +1,22 @@
+from django.core.management.base import BaseCommand
+
+from api.feed_cache import invalidate_feed
+from api.trending import update_trending_scores
+
+
+class Command(BaseCommand):
+    help = (
+        "Fold likes, views and new videos since the last run into the trending scores "
+        "used by the social feed's ?sort=trending. Run it every few minutes (e.g. from "
+        "cron), and with --full occasionally to account for unlikes."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--full', action='store_true', help='Recompute all scores from scratch')
+        parser.add_argument('--batch-size', type=int, default=5000, help='Events read per query')
+
+    def handle(self, *args, **options):
+        processed = update_trending_scores(full=options['full'], batch_size=options['batch_size'])
+        if processed:
+            invalidate_feed()
+        self.stdout.write(self.style.SUCCESS(f"Processed {processed} events"))
@@ -0,0 +1,27 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from api.scheduler import dispatch_jobs
+
+
+class Command(BaseCommand):
+    help = (
+        "Hand queued render jobs to D-ID/HeyGen in fair-share order, within the "
+        "per-user and global in-flight limits. Run once (e.g. from cron) or with "
+        "--loop as a long-running worker."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--loop', action='store_true', help='Keep dispatching until interrupted')
+        parser.add_argument('--interval', type=float, default=2.0, help='Seconds between passes with --loop')
+        parser.add_argument('--max-jobs', type=int, default=None, help='Dispatch at most this many jobs per pass')
+
+    def handle(self, *args, **options):
+        while True:
+            dispatched = dispatch_jobs(max_jobs=options['max_jobs'])
+            if dispatched or not options['loop']:
+                self.stdout.write(self.style.SUCCESS(f"Dispatched {dispatched} jobs"))
+            if not options['loop']:
+                return
+            time.sleep(options['interval'])
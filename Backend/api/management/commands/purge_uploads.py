@@ -0,0 +1,60 @@
+from datetime import timedelta
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.db.models import Q
+from django.utils import timezone
+from google.api_core.exceptions import NotFound
+
+from api.gcp_storage import init_gcp_client
+from api.models import GenerationPipeline, UploadedAsset
+from api.pipelines import owned_objects
+
+
+class Command(BaseCommand):
+    help = (
+        "Delete direct uploads that were never finalized within UPLOAD_PENDING_TTL_HOURS, "
+        "and records of rejected ones, as well as HeyGen pipelines that failed and weren't "
+        "resumed within PIPELINE_RESUME_HOURS, with the files they stored. Run it daily (e.g. from cron)."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=500, help='Uploads handled per query')
+
+    def handle(self, *args, **options):
+        cutoff = timezone.now() - timedelta(hours=settings.UPLOAD_PENDING_TTL_HOURS)
+        bucket = init_gcp_client().bucket(settings.GCP_BUCKET_NAME)
+        stale = UploadedAsset.objects.filter(Q(status='pending') | Q(status='rejected'), created_at__lte=cutoff)
+        deleted = 0
+        while True:
+            assets = list(stale.values_list('id', 'blob_name', 'status')[:options['batch_size']])
+            if not assets:
+                break
+            for _, blob_name, asset_status in assets:
+                if asset_status == 'pending':
+                    # The client may have uploaded without finalizing
+                    try:
+                        bucket.blob(blob_name).delete()
+                    except NotFound:
+                        pass
+            deleted += UploadedAsset.objects.filter(id__in=[asset_id for asset_id, _, _ in assets]).delete()[0]
+        self.stdout.write(self.style.SUCCESS(f"Deleted {deleted} abandoned uploads"))
+
+        cutoff = timezone.now() - timedelta(hours=settings.PIPELINE_RESUME_HOURS)
+        # Without a video: once one is queued, it references the stored files
+        stale = GenerationPipeline.objects.filter(
+            state__in=['failed', 'running'], updated_at__lte=cutoff, video__isnull=True
+        )
+        deleted = 0
+        while True:
+            pipelines = list(stale[:options['batch_size']])
+            if not pipelines:
+                break
+            for pipeline in pipelines:
+                for blob_name in owned_objects(pipeline):
+                    try:
+                        bucket.blob(blob_name).delete()
+                    except NotFound:
+                        pass
+            deleted += GenerationPipeline.objects.filter(id__in=[pipeline.id for pipeline in pipelines]).delete()[0]
+        self.stdout.write(self.style.SUCCESS(f"Deleted {deleted} abandoned pipelines"))
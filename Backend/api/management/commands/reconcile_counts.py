@@ -0,0 +1,71 @@
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.db.models import Count
+
+from api.feed_cache import invalidate_feed
+from api.models import VideoGeneration, VideoLike, VideoView
+
+
+class Command(BaseCommand):
+    help = (
+        "Repair drift in the denormalized VideoGeneration.likes_count and views_count "
+        "columns by recounting VideoLike/VideoView rows, one batch of videos at a time."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=1000, help='Videos per batch')
+        parser.add_argument(
+            '--views', action='store_true',
+            help='Also reconcile views_count. Views still buffered in running processes '
+                 'are counted here and again when they flush, so prefer a quiet period.'
+        )
+        parser.add_argument('--dry-run', action='store_true', help='Report drift without fixing it')
+
+    def handle(self, *args, **options):
+        batch_size = options['batch_size']
+        columns = [('likes_count', VideoLike)]
+        if options['views']:
+            columns.append(('views_count', VideoView))
+
+        checked = repaired = 0
+        last_id = 0
+        while True:
+            batch = list(
+                VideoGeneration.objects.filter(id__gt=last_id)
+                .order_by('id')
+                .values('id', *[column for column, _ in columns])[:batch_size]
+            )
+            if not batch:
+                break
+            last_id = batch[-1]['id']
+            ids = [row['id'] for row in batch]
+
+            with transaction.atomic():
+                for column, related_model in columns:
+                    actual = dict(
+                        related_model.objects.filter(video_id__in=ids)
+                        .values('video_id')
+                        .annotate(n=Count('id'))
+                        .order_by()
+                        .values_list('video_id', 'n')
+                    )
+                    for row in batch:
+                        expected = actual.get(row['id'], 0)
+                        if row[column] == expected:
+                            continue
+                        self.stdout.write(f"Video {row['id']}: {column} {row[column]} -> {expected}")
+                        if options['dry_run']:
+                            repaired += 1
+                            continue
+                        # Compare-and-set so a concurrent F() increment isn't overwritten
+                        repaired += VideoGeneration.objects.filter(
+                            pk=row['id'], **{column: row[column]}
+                        ).update(**{column: expected})
+
+            checked += len(batch)
+
+        if repaired and not options['dry_run']:
+            invalidate_feed()
+
+        verb = 'would repair' if options['dry_run'] else 'repaired'
+        self.stdout.write(self.style.SUCCESS(f"Checked {checked} videos, {verb} {repaired} counts"))
@@ -0,0 +1,36 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from api.rehosting import backfill_rehost_tasks, process_rehost_tasks
+
+
+class Command(BaseCommand):
+    help = (
+        "Copy finished videos from the providers into GCP Storage and switch their "
+        "result_url to the copy. Run once (e.g. from cron) or with --loop as a "
+        "long-running worker."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--loop', action='store_true', help='Keep processing until interrupted')
+        parser.add_argument('--interval', type=float, default=5.0, help='Seconds between passes with --loop')
+        parser.add_argument('--max-tasks', type=int, default=None, help='Process at most this many tasks per pass')
+        parser.add_argument('--workers', type=int, default=None, help='Copies to run at once (default: REHOST_WORKERS)')
+        parser.add_argument(
+            '--backfill', action='store_true',
+            help='First queue finished videos still served from a provider URL'
+        )
+
+    def handle(self, *args, **options):
+        if options['backfill']:
+            self.stdout.write(f"Queued {backfill_rehost_tasks()} videos for re-hosting")
+        while True:
+            totals = process_rehost_tasks(max_tasks=options['max_tasks'], workers=options['workers'])
+            if any(totals.values()) or not options['loop']:
+                self.stdout.write(self.style.SUCCESS(
+                    f"Re-hosted {totals['done']} videos, {totals['retry']} to retry, {totals['failed']} failed"
+                ))
+            if not options['loop']:
+                return
+            time.sleep(options['interval'])
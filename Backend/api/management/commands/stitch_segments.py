@@ -0,0 +1,29 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from api.segments import process_stitches
+
+
+class Command(BaseCommand):
+    help = (
+        "Join the finished segments of segmented videos into one video with ffmpeg "
+        "and upload it to GCP Storage. Run once (e.g. from cron) or with --loop as a "
+        "long-running worker."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--loop', action='store_true', help='Keep processing until interrupted')
+        parser.add_argument('--interval', type=float, default=5.0, help='Seconds between passes with --loop')
+        parser.add_argument('--max-videos', type=int, default=None, help='Stitch at most this many videos per pass')
+
+    def handle(self, *args, **options):
+        while True:
+            totals = process_stitches(max_videos=options['max_videos'])
+            if any(totals.values()) or not options['loop']:
+                self.stdout.write(self.style.SUCCESS(
+                    f"Stitched {totals['done']} videos, {totals['retry']} to retry, {totals['failed']} failed"
+                ))
+            if not options['loop']:
+                return
+            time.sleep(options['interval'])
@@ -0,0 +1,36 @@
+# Generated by Django 5.2.7 on 2026-10-19 11:07
+
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("api", "0007_videogeneration_avatar_scale_and_more"),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name="passwordresetotp",
+            index=models.Index(
+                fields=["email", "otp", "is_used", "-created_at"],
+                name="pwreset_otp_lookup_idx",
+            ),
+        ),
+        migrations.AddIndex(
+            model_name="videogeneration",
+            index=models.Index(
+                fields=["user", "-created_at", "-id"], name="videogen_user_created_idx"
+            ),
+        ),
+        migrations.AddIndex(
+            model_name="videogeneration",
+            index=models.Index(
+                condition=models.Q(("is_public", True), ("status", "done")),
+                fields=["-created_at", "-id"],
+                name="videogen_public_feed_idx",
+            ),
+        ),
+    ]
@@ -0,0 +1,38 @@
+# Generated by Django 5.2.7 on 2026-10-19 11:12
+
+from django.conf import settings
+from django.db import migrations, models
+from django.db.models import Count
+
+
+def backfill_likes_count(apps, schema_editor):
+    VideoGeneration = apps.get_model("api", "VideoGeneration")
+    VideoLike = apps.get_model("api", "VideoLike")
+    counts = VideoLike.objects.values("video_id").annotate(n=Count("id")).order_by()
+    for row in counts.iterator():
+        VideoGeneration.objects.filter(pk=row["video_id"]).update(likes_count=row["n"])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("api", "0008_feed_user_and_otp_indexes"),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="videogeneration",
+            name="likes_count",
+            field=models.IntegerField(default=0),
+        ),
+        migrations.RunPython(backfill_likes_count, migrations.RunPython.noop),
+        migrations.AddIndex(
+            model_name="videogeneration",
+            index=models.Index(
+                condition=models.Q(("is_public", True), ("status", "done")),
+                fields=["-likes_count", "-id"],
+                name="videogen_popular_feed_idx",
+            ),
+        ),
+    ]
@@ -0,0 +1,80 @@
+# Generated by Django 5.2.7 on 2026-10-19 11:14
+
+from django.db import migrations
+
+# Full-text index over VideoGeneration.name and script_input (see api/search.py).
+# Maintained by the database itself, so every save updates it incrementally.
+
+SQLITE_SETUP = [
+    """
+    CREATE VIRTUAL TABLE api_videogeneration_fts USING fts5(
+        name, script_input,
+        content='api_videogeneration', content_rowid='id',
+        tokenize='unicode61 remove_diacritics 2'
+    )
+    """,
+    """
+    CREATE TRIGGER api_videogeneration_fts_ai AFTER INSERT ON api_videogeneration BEGIN
+        INSERT INTO api_videogeneration_fts(rowid, name, script_input)
+        VALUES (new.id, new.name, new.script_input);
+    END
+    """,
+    """
+    CREATE TRIGGER api_videogeneration_fts_ad AFTER DELETE ON api_videogeneration BEGIN
+        INSERT INTO api_videogeneration_fts(api_videogeneration_fts, rowid, name, script_input)
+        VALUES ('delete', old.id, old.name, old.script_input);
+    END
+    """,
+    # Only fires for the searchable columns, so counter updates don't touch the index
+    """
+    CREATE TRIGGER api_videogeneration_fts_au
+    AFTER UPDATE OF name, script_input ON api_videogeneration BEGIN
+        INSERT INTO api_videogeneration_fts(api_videogeneration_fts, rowid, name, script_input)
+        VALUES ('delete', old.id, old.name, old.script_input);
+        INSERT INTO api_videogeneration_fts(rowid, name, script_input)
+        VALUES (new.id, new.name, new.script_input);
+    END
+    """,
+    "INSERT INTO api_videogeneration_fts(api_videogeneration_fts) VALUES ('rebuild')",
+]
+
+SQLITE_TEARDOWN = [
+    "DROP TRIGGER IF EXISTS api_videogeneration_fts_ai",
+    "DROP TRIGGER IF EXISTS api_videogeneration_fts_ad",
+    "DROP TRIGGER IF EXISTS api_videogeneration_fts_au",
+    "DROP TABLE IF EXISTS api_videogeneration_fts",
+]
+
+POSTGRES_SETUP = [
+    """
+    CREATE INDEX videogen_search_gin_idx ON api_videogeneration
+    USING GIN (to_tsvector('simple', coalesce(name, '') || ' ' || coalesce(script_input, '')))
+    """,
+]
+
+POSTGRES_TEARDOWN = [
+    "DROP INDEX IF EXISTS videogen_search_gin_idx",
+]
+
+
+def install_search_index(apps, schema_editor):
+    vendor = schema_editor.connection.vendor
+    for sql in {"sqlite": SQLITE_SETUP, "postgresql": POSTGRES_SETUP}.get(vendor, []):
+        schema_editor.execute(sql)
+
+
+def uninstall_search_index(apps, schema_editor):
+    vendor = schema_editor.connection.vendor
+    for sql in {"sqlite": SQLITE_TEARDOWN, "postgresql": POSTGRES_TEARDOWN}.get(vendor, []):
+        schema_editor.execute(sql)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("api", "0010_trending_scores"),
+    ]
+
+    operations = [
+        migrations.RunPython(install_search_index, uninstall_search_index),
+    ]
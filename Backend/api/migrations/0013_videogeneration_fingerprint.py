@@ -0,0 +1,28 @@
+# Generated by Django 5.2.7 on 2026-10-19 11:22
+
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("api", "0012_idempotency_keys"),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="videogeneration",
+            name="fingerprint",
+            field=models.CharField(blank=True, max_length=64, null=True),
+        ),
+        migrations.AddIndex(
+            model_name="videogeneration",
+            index=models.Index(
+                condition=models.Q(("status", "done")),
+                fields=["user", "fingerprint", "-created_at"],
+                name="videogen_fingerprint_idx",
+            ),
+        ),
+    ]
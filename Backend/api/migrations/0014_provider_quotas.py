@@ -0,0 +1,32 @@
+# Generated by Django 5.2.7 on 2026-10-19 11:25
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("api", "0013_videogeneration_fingerprint"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="ProviderQuota",
+            fields=[
+                (
+                    "id",
+                    models.BigAutoField(
+                        auto_created=True,
+                        primary_key=True,
+                        serialize=False,
+                        verbose_name="ID",
+                    ),
+                ),
+                ("name", models.CharField(max_length=100, unique=True)),
+                ("tokens", models.FloatField(default=0)),
+                ("refilled_at", models.FloatField(default=0)),
+                ("blocked_until", models.FloatField(default=0)),
+                ("leases", models.JSONField(default=dict)),
+            ],
+        ),
+    ]
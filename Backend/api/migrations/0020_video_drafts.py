@@ -0,0 +1,30 @@
+# Generated by Django 5.2.7 on 2026-10-19 11:48
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("api", "0019_generation_pipelines"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="videogeneration",
+            name="is_draft",
+            field=models.BooleanField(default=False),
+        ),
+        migrations.AddField(
+            model_name="videogeneration",
+            name="parent",
+            field=models.ForeignKey(
+                blank=True,
+                null=True,
+                on_delete=django.db.models.deletion.SET_NULL,
+                related_name="children",
+                to="api.videogeneration",
+            ),
+        ),
+    ]
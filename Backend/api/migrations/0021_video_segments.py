@@ -0,0 +1,30 @@
+# Generated by Django 5.2.7 on 2026-10-19 11:50
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("api", "0020_video_drafts"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="videogeneration",
+            name="segment_index",
+            field=models.PositiveSmallIntegerField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name="videogeneration",
+            name="segment_of",
+            field=models.ForeignKey(
+                blank=True,
+                null=True,
+                on_delete=django.db.models.deletion.CASCADE,
+                related_name="segments",
+                to="api.videogeneration",
+            ),
+        ),
+    ]
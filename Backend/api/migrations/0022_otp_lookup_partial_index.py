@@ -0,0 +1,25 @@
+# Generated by Django 5.2.7 on 2026-10-19 12:10
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("api", "0021_video_segments"),
+    ]
+
+    operations = [
+        migrations.RemoveIndex(
+            model_name="passwordresetotp",
+            name="pwreset_otp_lookup_idx",
+        ),
+        migrations.AddIndex(
+            model_name="passwordresetotp",
+            index=models.Index(
+                condition=models.Q(("is_used", False)),
+                fields=["email", "otp", "-created_at"],
+                name="pwreset_otp_lookup_idx",
+            ),
+        ),
+    ]
@@ -39,6 +39,15 @@ class PasswordResetOTP(models.Model):
 
     class Meta:
         ordering = ['-created_at']
+        indexes = [
+            # verify_otp_and_reset_password: filter(email, otp, is_used=False).order_by('-created_at').
+            # Partial on is_used: the filter is rendered as NOT is_used, which can't
+            # seek an index column, so as a key column it left the ORDER BY unserved
+            models.Index(
+                fields=['email', 'otp', '-created_at'], condition=models.Q(is_used=False),
+                name='pwreset_otp_lookup_idx'
+            ),
+        ]
 
 
 class VideoGeneration(models.Model):
@@ -80,10 +89,29 @@ class VideoGeneration(models.Model):
     # Metadata and config
     metadata = models.JSONField(blank=True, null=True)
     config = models.JSONField(default=dict)
+    # Hash of the render inputs, with assets by content (see render_cache.py)
+    fingerprint = models.CharField(max_length=64, blank=True, null=True)
+    # Set for videos created from a manifest by create_generation_batch
+    batch = models.ForeignKey(
+        'GenerationBatch', on_delete=models.SET_NULL, related_name='videos', blank=True, null=True
+    )
+    # Low-resolution preview of the script's start (HeyGen draft mode, see pipelines.py)
+    is_draft = models.BooleanField(default=False)
+    # The video this one was iterated from or promoted from; it reuses that one's uploads
+    parent = models.ForeignKey(
+        'self', on_delete=models.SET_NULL, related_name='children', blank=True, null=True
+    )
+    # Segmented rendering (segments.py): one part of a long script, rendered as
+    # its own provider job and stitched into segment_of
+    segment_of = models.ForeignKey(
+        'self', on_delete=models.CASCADE, related_name='segments', blank=True, null=True
+    )
+    segment_index = models.PositiveSmallIntegerField(blank=True, null=True)
     
     # Social features
     is_public = models.BooleanField(default=False)
     views_count = models.IntegerField(default=0)
+    likes_count = models.IntegerField(default=0)  # kept in sync by like_video
     created_at = models.DateTimeField(auto_now_add=True)
     modified_at = models.DateTimeField(auto_now=True)
 
@@ -92,6 +120,28 @@ class VideoGeneration(models.Model):
 
     class Meta:
         ordering = ['-created_at']
+        indexes = [
+            # list_video_generations: filter(user).order_by('-created_at')
+            models.Index(fields=['user', '-created_at', '-id'], name='videogen_user_created_idx'),
+            # get_public_videos: only the public, finished rows, in feed (keyset) order
+            models.Index(
+                fields=['-created_at', '-id'],
+                name='videogen_public_feed_idx',
+                condition=models.Q(is_public=True, status='done'),
+            ),
+            # get_public_videos?sort=popular
+            models.Index(
+                fields=['-likes_count', '-id'],
+                name='videogen_popular_feed_idx',
+                condition=models.Q(is_public=True, status='done'),
+            ),
+            # render_cache.find_cached_render: filter(user, fingerprint, status='done')
+            models.Index(
+                fields=['user', 'fingerprint', '-created_at'],
+                name='videogen_fingerprint_idx',
+                condition=models.Q(status='done'),
+            ),
+        ]
 
 
 class VideoLike(models.Model):
@@ -121,3 +171,261 @@ class VideoView(models.Model):
         user_str = self.user.username if self.user else self.ip_address
         return f"View on {self.video.name} by {user_str}"
 
+
+
+class VideoTrendingScore(models.Model):
+    """Time-decayed popularity of a video, maintained by the compute_trending command."""
+    video = models.OneToOneField(VideoGeneration, on_delete=models.CASCADE, primary_key=True, related_name='trending')
+    # Natural log of the forward-decayed sum of event weights (see trending.py)
+    score = models.FloatField()
+    updated_at = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        indexes = [
+            # get_public_videos?sort=trending
+            models.Index(fields=['-score', '-video'], name='trending_score_idx'),
+        ]
+
+    def __str__(self):
+        return f"Trending score {self.score:.3f} for video {self.video_id}"
+
+
+class JobCheckpoint(models.Model):
+    """Position (usually the last processed row id) of an incremental background job."""
+    name = models.CharField(max_length=100, unique=True)
+    position = models.BigIntegerField(default=0)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    def __str__(self):
+        return f"{self.name} @ {self.position}"
+
+
+class IdempotencyKey(models.Model):
+    """Outcome of a request sent with an Idempotency-Key header (see idempotency.py)."""
+    STATUS_CHOICES = [
+        ('in_progress', 'In progress'),
+        ('completed', 'Completed'),
+    ]
+
+    user = models.ForeignKey(User, on_delete=models.CASCADE, related_name='idempotency_keys')
+    key = models.CharField(max_length=255)
+    # Hash of the method, path and body, to reject a key reused for a different request
+    request_hash = models.CharField(max_length=64)
+    status = models.CharField(max_length=20, choices=STATUS_CHOICES, default='in_progress')
+    response_status = models.PositiveSmallIntegerField(blank=True, null=True)
+    response_body = models.JSONField(blank=True, null=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+    expires_at = models.DateTimeField()
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['user', 'key'], name='idempotency_user_key_unique'),
+        ]
+        indexes = [
+            # purge_idempotency_keys
+            models.Index(fields=['expires_at'], name='idempotency_expires_idx'),
+        ]
+
+    def __str__(self):
+        return f"Idempotency key {self.key} ({self.status})"
+
+
+class ProviderQuota(models.Model):
+    """Shared token bucket and concurrency slots of one provider API key (see rate_limits.py)."""
+    name = models.CharField(max_length=100, unique=True)
+    tokens = models.FloatField(default=0)
+    # Unix timestamps, so the arithmetic stays simple floats
+    refilled_at = models.FloatField(default=0)
+    blocked_until = models.FloatField(default=0)
+    # Requests in flight: lease id -> expiry, so a crashed worker's slots free themselves
+    leases = models.JSONField(default=dict)
+
+    def __str__(self):
+        return f"{self.name}: {self.tokens:.2f} tokens, {len(self.leases)} in flight"
+
+
+class GenerationJob(models.Model):
+    """
+    A render waiting for (or handed to) a provider; dispatched by scheduler.py.
+
+    The queue order lives in virtual_finish (weighted fair queuing across
+    users), so it survives restarts.
+    """
+    STATE_CHOICES = [
+        ('queued', 'Queued'),
+        ('dispatching', 'Dispatching'),
+        ('submitted', 'Submitted'),
+        ('completed', 'Completed'),
+        ('failed', 'Failed'),
+    ]
+    PRIORITY_CHOICES = [
+        ('high', 'High'),
+        ('normal', 'Normal'),
+        ('low', 'Low'),
+    ]
+
+    video = models.OneToOneField(VideoGeneration, on_delete=models.CASCADE, related_name='job')
+    user = models.ForeignKey(User, on_delete=models.CASCADE, related_name='generation_jobs')
+    state = models.CharField(max_length=20, choices=STATE_CHOICES, default='queued')
+    priority = models.CharField(max_length=10, choices=PRIORITY_CHOICES, default='normal')
+    # 'd-id', 'heygen' or 'auto' (routing.py picks among `candidates` at dispatch time)
+    requested_provider = models.CharField(max_length=20)
+    candidates = models.JSONField(default=list)
+    # Per provider: what to send it and which VideoGeneration fields to set once it accepts
+    payload = models.JSONField(default=dict)
+    virtual_start = models.FloatField()
+    virtual_finish = models.FloatField()
+    attempts = models.PositiveIntegerField(default=0)
+    not_before = models.DateTimeField(default=timezone.now)
+    last_error = models.TextField(blank=True, default='')
+    created_at = models.DateTimeField(auto_now_add=True)
+    dispatched_at = models.DateTimeField(blank=True, null=True)
+
+    class Meta:
+        indexes = [
+            # scheduler._claim_next: next queued job in fair-queuing order
+            models.Index(
+                fields=['virtual_finish', 'id'],
+                name='genjob_queue_idx',
+                condition=models.Q(state='queued'),
+            ),
+            # scheduler.enqueue: the user's latest virtual finish time
+            models.Index(fields=['user', '-virtual_finish'], name='genjob_user_finish_idx'),
+            models.Index(fields=['state', 'dispatched_at'], name='genjob_state_idx'),
+        ]
+
+    def __str__(self):
+        return f"Job for video {self.video_id} ({self.state})"
+
+
+class GenerationBatch(models.Model):
+    """Videos created together from one manifest, sharing the same avatar (see batches.py)."""
+    user = models.ForeignKey(User, on_delete=models.CASCADE, related_name='generation_batches')
+    name = models.CharField(max_length=255)
+    # GCP public URL of the shared avatar image, uploaded once for the whole batch
+    source_url = models.URLField()
+    priority = models.CharField(max_length=10, default='low')
+    total = models.PositiveIntegerField(default=0)
+    # Batch-wide defaults (script template, voice) the rows were expanded from
+    config = models.JSONField(default=dict)
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        ordering = ['-created_at']
+
+    def __str__(self):
+        return f"Batch {self.name} ({self.total} videos)"
+
+
+class UploadedAsset(models.Model):
+    """A file the client uploads straight to GCS with a signed URL (see signed_uploads.py)."""
+    KIND_CHOICES = [
+        ('image', 'Image'),
+        ('background', 'Background'),
+        ('audio', 'Audio'),
+    ]
+    STATUS_CHOICES = [
+        ('pending', 'Pending'),
+        ('ready', 'Ready'),
+        ('rejected', 'Rejected'),
+    ]
+
+    user = models.ForeignKey(User, on_delete=models.CASCADE, related_name='uploaded_assets')
+    kind = models.CharField(max_length=20, choices=KIND_CHOICES)
+    blob_name = models.CharField(max_length=255, unique=True)
+    filename = models.CharField(max_length=255)
+    content_type = models.CharField(max_length=100)
+    # Declared by the client when asking for the URL, checked against GCS on finalize
+    size = models.BigIntegerField()
+    # Base64 MD5 as GCS reports it; declared by the client or recorded on finalize
+    md5 = models.CharField(max_length=32, blank=True, default='')
+    status = models.CharField(max_length=20, choices=STATUS_CHOICES, default='pending')
+    error = models.CharField(max_length=255, blank=True, default='')
+    created_at = models.DateTimeField(auto_now_add=True)
+    finalized_at = models.DateTimeField(blank=True, null=True)
+
+    class Meta:
+        indexes = [
+            # purge_uploads: abandoned pending uploads
+            models.Index(fields=['status', 'created_at'], name='asset_status_created_idx'),
+        ]
+
+    @property
+    def name(self):
+        """File name, as on an UploadedFile, so views can treat both alike."""
+        return self.filename
+
+    def __str__(self):
+        return f"{self.kind} {self.blob_name} ({self.status})"
+
+
+class RehostTask(models.Model):
+    """Copying a finished video from its provider into GCS (see rehosting.py)."""
+    STATE_CHOICES = [
+        ('queued', 'Queued'),
+        ('running', 'Running'),
+        ('done', 'Done'),
+        ('failed', 'Failed'),
+    ]
+
+    video = models.OneToOneField(VideoGeneration, on_delete=models.CASCADE, related_name='rehost_task')
+    # Provider URLs are signed and can be long
+    source_url = models.TextField()
+    # Chosen up front so retries overwrite the same object instead of leaving copies behind
+    blob_name = models.CharField(max_length=255)
+    state = models.CharField(max_length=20, choices=STATE_CHOICES, default='queued')
+    attempts = models.PositiveIntegerField(default=0)
+    not_before = models.DateTimeField(default=timezone.now)
+    last_error = models.TextField(blank=True, default='')
+    created_at = models.DateTimeField(auto_now_add=True)
+    started_at = models.DateTimeField(blank=True, null=True)
+    finished_at = models.DateTimeField(blank=True, null=True)
+
+    class Meta:
+        indexes = [
+            # rehosting._claim_next: due tasks, oldest first
+            models.Index(fields=['state', 'not_before'], name='rehost_state_due_idx'),
+        ]
+
+    def __str__(self):
+        return f"Re-host of video {self.video_id} ({self.state})"
+
+
+class GenerationPipeline(models.Model):
+    """
+    The stages of creating a HeyGen video, with each finished stage's output,
+    so that a failed run resumes where it stopped (see pipelines.py).
+    """
+    STATE_CHOICES = [
+        ('running', 'Running'),
+        ('failed', 'Failed'),
+        ('completed', 'Completed'),
+    ]
+
+    user = models.ForeignKey(User, on_delete=models.CASCADE, related_name='generation_pipelines')
+    state = models.CharField(max_length=20, choices=STATE_CHOICES, default='running')
+    # Form fields of the request (project name, avatar placement, voice...)
+    params = models.JSONField(default=dict)
+    # Stage name -> its output (GCP URLs, talking_photo_id, video id), in completion order
+    checkpoints = models.JSONField(default=dict)
+    failed_stage = models.CharField(max_length=50, blank=True, default='')
+    error = models.TextField(blank=True, default='')
+    # render_cache fingerprint of the inputs; a retry of the same request resumes this run
+    fingerprint = models.CharField(max_length=64, blank=True, default='')
+    runs = models.PositiveIntegerField(default=1)
+    video = models.OneToOneField(
+        VideoGeneration, on_delete=models.SET_NULL, null=True, blank=True, related_name='pipeline'
+    )
+    created_at = models.DateTimeField(auto_now_add=True)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        indexes = [
+            # pipelines.start_pipeline: the user's failed run for the same inputs
+            models.Index(fields=['user', 'fingerprint', 'state'], name='pipeline_resume_idx'),
+            # purge_uploads: failed runs nobody resumed
+            models.Index(fields=['state', 'updated_at'], name='pipeline_state_idx'),
+        ]
+
+    def __str__(self):
+        return f"Pipeline {self.pk} ({self.state}, {len(self.checkpoints)} stages done)"
@@ -0,0 +1,129 @@
+import base64
+import datetime
+import json
+
+from django.core.exceptions import FieldDoesNotExist, ValidationError
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db.models import Q
+
+
+class CursorEncoder(DjangoJSONEncoder):
+    """
+    DjangoJSONEncoder, but datetimes keep their microseconds.
+
+    The stock encoder cuts them to milliseconds, and a cursor that doesn't
+    match the last row exactly skips the rows after it.
+    """
+
+    def default(self, o):
+        if isinstance(o, datetime.datetime):
+            return o.isoformat()
+        return super().default(o)
+
+
+class InvalidCursor(ValueError):
+    """Raised when a pagination cursor cannot be decoded."""
+
+
+def encode_cursor(values):
+    """
+    Encode the ordering values of the last row of a page into an opaque token.
+
+    Args:
+        values: List of values, one per ordering field
+
+    Returns:
+        URL-safe cursor string
+    """
+    raw = json.dumps(values, cls=CursorEncoder, separators=(',', ':'))
+    return base64.urlsafe_b64encode(raw.encode()).decode().rstrip('=')
+
+
+def decode_cursor(cursor, model, ordering):
+    """
+    Decode a cursor produced by encode_cursor back into typed values.
+
+    Args:
+        cursor: Cursor string from the client
+        model: Model class the ordering fields belong to
+        ordering: Sequence of field names the cursor was built from
+
+    Returns:
+        List of values converted with each model field's to_python()
+    """
+    try:
+        padded = cursor + '=' * (-len(cursor) % 4)
+        values = json.loads(base64.urlsafe_b64decode(padded.encode()).decode())
+    except (ValueError, TypeError) as e:
+        raise InvalidCursor(f"Malformed cursor: {e}")
+
+    if not isinstance(values, list) or len(values) != len(ordering):
+        raise InvalidCursor("Cursor does not match the requested ordering")
+
+    decoded = []
+    for name, value in zip(ordering, values):
+        try:
+            field = model._meta.get_field(name)
+        except FieldDoesNotExist:
+            # Annotated values (e.g. scores) are stored as plain JSON numbers
+            decoded.append(value)
+            continue
+        try:
+            decoded.append(field.to_python(value))
+        except ValidationError as e:
+            raise InvalidCursor(f"Invalid cursor value for {name}: {e}")
+    return decoded
+
+
+def keyset_filter(ordering, values):
+    """
+    Build the "strictly after this row" condition for a descending ordering.
+
+    For ordering (a, b) and values (x, y) this is: a < x OR (a = x AND b < y),
+    plus a redundant a <= x so the database can seek the index instead of scanning it.
+    """
+    condition = Q()
+    for i, name in enumerate(ordering):
+        clause = Q(**{f'{name}__lt': values[i]})
+        for prev_name, prev_value in zip(ordering[:i], values[:i]):
+            clause &= Q(**{prev_name: prev_value})
+        condition |= clause
+    return Q(**{f'{ordering[0]}__lte': values[0]}) & condition
+
+
+def keyset_paginate(queryset, ordering, cursor=None, page_size=10):
+    """
+    Paginate a queryset by seeking past the last seen row instead of using OFFSET.
+
+    Every page costs the same regardless of how deep the client has scrolled,
+    and no COUNT(*) is issued. The last ordering field must be unique (usually 'id').
+
+    Args:
+        queryset: Base queryset (filters applied, ordering is replaced)
+        ordering: Field names to order by, all descending
+        cursor: Opaque cursor from a previous page, or None for the first page
+        page_size: Number of rows per page
+
+    Returns:
+        Dict with 'results' (list of model instances), 'next_cursor' and 'has_next'
+    """
+    queryset = queryset.order_by(*[f'-{name}' for name in ordering])
+    if cursor:
+        values = decode_cursor(cursor, queryset.model, ordering)
+        queryset = queryset.filter(keyset_filter(ordering, values))
+
+    # Fetch one extra row to know whether another page exists
+    rows = list(queryset[:page_size + 1])
+    has_next = len(rows) > page_size
+    rows = rows[:page_size]
+
+    next_cursor = None
+    if has_next and rows:
+        last = rows[-1]
+        next_cursor = encode_cursor([getattr(last, name) for name in ordering])
+
+    return {
+        'results': rows,
+        'next_cursor': next_cursor,
+        'has_next': has_next,
+    }
@@ -0,0 +1,344 @@
+"""
+Resumable creation of HeyGen videos.
+
+Creating a HeyGen video takes several steps, any of which can fail: storing
+the avatar, background and audio in GCS, registering the avatar with HeyGen
+as a talking photo, and queueing the render. They used to run as one block,
+so a failure threw away the work of every step before it, and the user's
+retry repeated all the uploads.
+
+Each step is now a stage of a GenerationPipeline. A finished stage's output
+(GCP URLs, talking_photo_id, the video id) is saved on the pipeline, a
+failure records the stage that failed, and a resumed run skips every stage
+that already has an output. A run resumes through
+POST /api/heygen/pipelines/{id}/resume/, or when the same request (same
+inputs, by render fingerprint) is sent again within PIPELINE_RESUME_HOURS.
+
+Inputs are stored before anything is sent to HeyGen, so resuming needs no
+files unless a storing stage is the one that failed. Submitting the render
+to HeyGen is the scheduler's job, which retries it on its own (scheduler.py).
+
+Drafts are quick previews for trying out the avatar layout: the first
+sentence of the script (or the first HEYGEN_DRAFT_AUDIO_SECONDS of the audio)
+rendered at HEYGEN_DRAFT_DIMENSION. A pipeline can be seeded with the stored
+inputs and talking photo of an earlier one (reusable_checkpoints()), so the
+next draft, and promoting a draft to the full render, only queue a render.
+"""
+import io
+import logging
+import re
+from datetime import timedelta
+
+from django.conf import settings
+from django.core.files.base import ContentFile
+from django.db import transaction
+from django.db.models import F, Q
+from django.utils import timezone
+
+from .gcp_storage import blob_name_from_url, generate_unique_blob_name, open_gcp_object, upload_file_object_to_gcp
+from .models import GenerationPipeline, UploadedAsset, VideoGeneration
+from .providers import heygen_audio_voice, heygen_text_voice, heygen_video_input, upload_heygen_talking_photo
+from .scheduler import enqueue, placeholder_talk_id
+from .uploads import store_upload
+
+logger = logging.getLogger(__name__)
+
+# Stages whose output a later pipeline can start from
+REUSABLE_STAGES = ('avatar', 'background', 'audio', 'draft_audio', 'talking_photo')
+
+# CJK text has no space after a full stop
+CJK_SENTENCE_ENDS = ('。', '！', '？')
+SENTENCE_END = re.compile(r'(?<=[.!?])\s|(?<=[。！？])')
+
+# A draft shorter than this ran into an abbreviation ("Dr. Smith"), not a sentence end
+DRAFT_MIN_WORDS = 3
+
+
+class PipelineInputMissing(ValueError):
+    """A stage that still has to run needs a file the request didn't include."""
+
+
+def start_pipeline(user, fingerprint, params, checkpoints=None):
+    """
+    The pipeline for a create request: the user's failed run for the same
+    inputs if there is one (taking the request's params), else a new one.
+
+    Args:
+        fingerprint: render_cache fingerprint, or '' for requests without one
+            (they never resume an earlier run)
+        checkpoints: Stage outputs to start a new pipeline from, see reusable_checkpoints()
+    """
+    if fingerprint:
+        cutoff = timezone.now() - timedelta(hours=settings.PIPELINE_RESUME_HOURS)
+        failed = (
+            GenerationPipeline.objects.filter(user=user, fingerprint=fingerprint, state='failed', updated_at__gte=cutoff)
+            .order_by('-updated_at')
+            .first()
+        )
+        if failed is not None and claim_pipeline(failed, params):
+            return failed
+    return GenerationPipeline.objects.create(
+        user=user, fingerprint=fingerprint, params=params, checkpoints=checkpoints or {}
+    )
+
+
+def reusable_checkpoints(pipeline, stages=REUSABLE_STAGES):
+    """
+    Outputs of a finished pipeline's input stages, to seed another pipeline with.
+
+    The objects stay owned by the original pipeline, so cleaning up the new
+    one never deletes them.
+    """
+    return {
+        name: {**pipeline.checkpoints[name], 'owned': False}
+        for name in stages
+        if name in pipeline.checkpoints
+    }
+
+
+def pipeline_of(video):
+    """
+    The pipeline that created a video, or None.
+
+    Videos that reused a finished render (render_cache.clone_render) have
+    none of their own; theirs is the original's.
+    """
+    for _ in range(5):
+        pipeline = GenerationPipeline.objects.filter(video=video).first()
+        reused_from = (video.config or {}).get('reused_from')
+        if pipeline is not None or not reused_from:
+            return pipeline
+        video = VideoGeneration.objects.filter(pk=reused_from, user_id=video.user_id).first()
+        if video is None:
+            return None
+    return None
+
+
+def draft_script(script):
+    """
+    The first sentence of a script, at most HEYGEN_DRAFT_MAX_CHARS long (cut at a word).
+
+    Sentences are added until the draft has DRAFT_MIN_WORDS words, so a
+    period after an abbreviation doesn't end it.
+    """
+    first, *rest = SENTENCE_END.split(script.strip())
+    for sentence in rest:
+        if first.endswith(CJK_SENTENCE_ENDS) or len(first.split()) >= DRAFT_MIN_WORDS:
+            break
+        first = f'{first} {sentence}'
+    limit = settings.HEYGEN_DRAFT_MAX_CHARS
+    if len(first) > limit:
+        cut = first[:limit + 1]
+        # A word ending right at the limit is kept whole
+        first = cut.rstrip() if cut[-1].isspace() else cut.rsplit(None, 1)[0][:limit]
+    return first
+
+
+def claim_pipeline(pipeline, params=None):
+    """
+    Mark a failed pipeline as running again, optionally updating its params.
+
+    A run that has been 'running' for PIPELINE_LOCK_SECONDS is taken to have
+    died and may be claimed too. Returns False if another run holds the
+    pipeline or it already completed.
+    """
+    now = timezone.now()
+    fields = {'state': 'running', 'runs': F('runs') + 1, 'updated_at': now}
+    if params:
+        fields['params'] = {**pipeline.params, **params}
+    claimed = GenerationPipeline.objects.filter(pk=pipeline.pk).filter(
+        Q(state='failed') | Q(state='running', updated_at__lt=now - timedelta(seconds=settings.PIPELINE_LOCK_SECONDS))
+    ).update(**fields)
+    if claimed:
+        pipeline.refresh_from_db()
+    return bool(claimed)
+
+
+def run_stages(pipeline, stages):
+    """
+    Run the stages that have no checkpoint yet, in order, saving each output.
+
+    Args:
+        stages: (name, callable) pairs; the callable returns the stage's
+            JSON-serializable output
+
+    Raises:
+        Whatever the failing stage raised, after recording it on the pipeline
+    """
+    for name, run in stages:
+        if name in pipeline.checkpoints:
+            continue
+        try:
+            output = run()
+        except Exception as e:
+            pipeline.state = 'failed'
+            pipeline.failed_stage = name
+            pipeline.error = f'{type(e).__name__}: {e}'
+            pipeline.save(update_fields=['state', 'failed_stage', 'error', 'updated_at'])
+            logger.warning('Pipeline %s failed at stage %s: %s', pipeline.pk, name, e)
+            raise
+        pipeline.checkpoints[name] = output
+        pipeline.save(update_fields=['checkpoints', 'updated_at'])
+        logger.info('Pipeline %s: stage %s done', pipeline.pk, name)
+
+    pipeline.state = 'completed'
+    pipeline.failed_stage = ''
+    pipeline.error = ''
+    pipeline.save(update_fields=['state', 'failed_stage', 'error', 'updated_at'])
+
+
+def owned_objects(pipeline):
+    """Names of the GCS objects the pipeline stored itself (not direct uploads it only references)."""
+    return [
+        blob_name_from_url(output['url'])
+        for output in pipeline.checkpoints.values()
+        if output.get('owned') and output.get('url')
+    ]
+
+
+def run_heygen_pipeline(pipeline, avatar_file=None, background_file=None, audio_file=None):
+    """
+    Run (or resume) the stages of a HeyGen video and return the queued VideoGeneration.
+
+    The files are UploadedFiles or UploadedAssets, as the create view takes
+    them; only those of stages without a checkpoint are needed.
+    """
+    params = pipeline.params
+    user_id = pipeline.user_id
+
+    def store(uploaded_file, field, folder):
+        def run():
+            if uploaded_file is None:
+                raise PipelineInputMissing(f'{field} is required to resume this video')
+            # Persisted: a later stage failing must not delete it (uploads.py)
+            url = store_upload(uploaded_file, folder, persist=True)
+            return {
+                'url': url,
+                'content_type': uploaded_file.content_type,
+                # Direct uploads belong to their UploadedAsset
+                'owned': not isinstance(uploaded_file, UploadedAsset),
+            }
+        return run
+
+    def store_audio():
+        if not params.get('has_audio'):
+            return {'url': None}
+        if audio_file is None:
+            raise PipelineInputMissing('audio_file is required to resume this video')
+        if isinstance(audio_file, UploadedAsset):
+            # Already an MP3 in GCP
+            return {'url': store_upload(audio_file, f"heygen/audio/{user_id}"), 'owned': False}
+        from .views import convert_audio_to_mp3
+        converted_audio = convert_audio_to_mp3(audio_file)
+        audio_blob_name = generate_unique_blob_name(f"heygen/audio/{user_id}", "audio.mp3")
+        return {'url': upload_file_object_to_gcp(converted_audio, audio_blob_name), 'owned': True}
+
+    def store_draft_audio():
+        audio_url = pipeline.checkpoints.get('audio', {}).get('url')
+        if not audio_url:
+            return {'url': None}
+        from pydub import AudioSegment
+        source = open_gcp_object(blob_name_from_url(audio_url))
+        clip = AudioSegment.from_file(source, format='mp3')[:settings.HEYGEN_DRAFT_AUDIO_SECONDS * 1000]
+        output = io.BytesIO()
+        clip.export(output, format='mp3', bitrate='128k')
+        audio_blob_name = generate_unique_blob_name(f"heygen/audio/{user_id}", "draft.mp3")
+        url = upload_file_object_to_gcp(ContentFile(output.getvalue(), name='draft.mp3'), audio_blob_name)
+        return {'url': url, 'owned': True}
+
+    def register_avatar():
+        avatar = pipeline.checkpoints['avatar']
+        if avatar_file is not None and not isinstance(avatar_file, UploadedAsset):
+            # Still at hand from this request
+            stream = avatar_file
+            stream.seek(0)
+        else:
+            # Streamed back from GCS, not read into memory
+            stream = open_gcp_object(blob_name_from_url(avatar['url']))
+        talking_photo_id, talking_photo_url = upload_heygen_talking_photo(stream, avatar['content_type'])
+        return {'talking_photo_id': talking_photo_id, 'talking_photo_url': talking_photo_url}
+
+    def submit():
+        if pipeline.video_id:
+            # Queued by a run that died before checkpointing it
+            return {'video_id': pipeline.video_id}
+        checkpoints = pipeline.checkpoints
+        draft = params.get('draft', False)
+        input_type = params['input_type']
+        background_type = params['background_type']
+        audio_url = checkpoints.get('draft_audio' if draft else 'audio', {}).get('url')
+        script = draft_script(params['script']) if draft else params['script']
+        if input_type == 'text':
+            voice = heygen_text_voice(script, params['voice_id'])
+        else:
+            voice = heygen_audio_voice(audio_url)
+        video_input = heygen_video_input(
+            checkpoints['talking_photo']['talking_photo_id'],
+            voice,
+            {
+                "type": background_type,
+                "url": checkpoints['background']['url'],
+                "play_style": "loop" if background_type == "video" else "static"
+            },
+            scale=params['avatar_scale'],
+            shape=params['avatar_shape'],
+            offset=(params['avatar_x'], params['avatar_y']),
+        )
+        heygen_payload = {
+            "title": params['project_name'],
+            "caption": params['need_subtitles'],
+            "dimension": params['dimension'],
+            "video_inputs": [video_input]
+        }
+
+        # The scheduler calls HeyGen's video generation API when the job's turn comes
+        with transaction.atomic():
+            video_gen = VideoGeneration.objects.create(
+                user_id=user_id,
+                name=params['project_name'],
+                platform='heygen',
+                source_url=checkpoints['avatar']['url'],
+                script_input=script if input_type == 'text' else '',
+                talk_id=placeholder_talk_id(),
+                status='queued',
+                talking_photo_id=checkpoints['talking_photo']['talking_photo_id'],
+                talking_photo_url=checkpoints['talking_photo']['talking_photo_url'],
+                background_url=checkpoints['background']['url'],
+                background_type=background_type,
+                avatar_shape=params['avatar_shape'],
+                avatar_scale=params['avatar_scale'],
+                avatar_x=params['avatar_x'],
+                avatar_y=params['avatar_y'],
+                need_subtitles=params['need_subtitles'],
+                input_type=input_type,
+                audio_url=audio_url,
+                voice_id=params['voice_id'] if input_type == 'text' else None,
+                voice_name=params['voice_name'] if input_type == 'text' else None,
+                config={'heygen_payload': heygen_payload},
+                fingerprint=pipeline.fingerprint or None,
+                is_draft=draft,
+                parent_id=params.get('parent_id'),
+            )
+            enqueue(
+                video_gen,
+                {'heygen': {'heygen_payload': heygen_payload, 'fields': {'status': 'processing'}}},
+                'heygen', ['heygen'], priority=params['priority']
+            )
+            pipeline.video = video_gen
+            pipeline.save(update_fields=['video', 'updated_at'])
+        return {'video_id': video_gen.id}
+
+    stages = [
+        ('avatar', store(avatar_file, 'avatar_file', f"heygen/avatars/{user_id}")),
+        ('background', store(background_file, 'background_file', f"heygen/backgrounds/{user_id}")),
+    ]
+    if params['input_type'] == 'audio':
+        stages.append(('audio', store_audio))
+        if params.get('draft'):
+            stages.append(('draft_audio', store_draft_audio))
+    stages += [
+        ('talking_photo', register_avatar),
+        ('submit', submit),
+    ]
+    run_stages(pipeline, stages)
+    return pipeline.video
@@ -0,0 +1,194 @@
+"""
+Thin clients for the render providers' "start a video" calls.
+
+Every call either returns the provider's id for the new job or raises
+ProviderError, so callers (and the router in routing.py) can tell a
+provider outage from a bad request without parsing responses themselves.
+"""
+import logging
+
+import requests
+from django.conf import settings
+
+from .rate_limits import RateLimited, provider_slot, report_rate_limited
+
+logger = logging.getLogger(__name__)
+
+PROVIDERS = ('d-id', 'heygen')
+
+PROVIDER_NAMES = {'d-id': 'D-ID', 'heygen': 'HeyGen'}
+
+REQUEST_TIMEOUT = 60
+
+# Used when a HeyGen render is requested without a layout of its own (routed requests)
+DEFAULT_HEYGEN_DIMENSION = {"width": 1280, "height": 720}
+DEFAULT_HEYGEN_BACKGROUND = {"type": "color", "value": "#FFFFFF"}
+
+
+class ProviderNotConfigured(Exception):
+    """The provider's API key is missing from settings."""
+
+
+class ProviderError(Exception):
+    """A provider rejected or failed a request."""
+
+    def __init__(self, provider, message, status_code=None, response_text=''):
+        super().__init__(message)
+        self.provider = provider
+        self.message = message
+        self.status_code = status_code
+        self.response_text = response_text
+
+    @property
+    def retryable(self):
+        """True for outages (network, 5xx, 429), where another attempt or provider may succeed."""
+        return self.status_code is None or self.status_code >= 500 or self.status_code == 429
+
+    @property
+    def outage(self):
+        """True if the provider itself failed, as opposed to refusing us (feeds the circuit breaker)."""
+        return self.status_code is None or self.status_code >= 500
+
+
+class ProviderThrottled(ProviderError):
+    """Our own rate limiter found no capacity for the key in time (see rate_limits.py)."""
+
+    def __init__(self, provider, retry_after):
+        super().__init__(provider, f'{PROVIDER_NAMES[provider]} is busy, please retry shortly', 429)
+        self.retry_after = retry_after
+
+
+def api_key(provider):
+    """Return the configured API key for a provider."""
+    key = getattr(settings, 'HEYGEN_API_KEY' if provider == 'heygen' else 'DDI_API_KEY', None)
+    if not key:
+        raise ProviderNotConfigured(f'{PROVIDER_NAMES[provider]} API key not configured')
+    return key
+
+
+def request(provider, method, url, max_wait=None, **kwargs):
+    """
+    Call a provider API within its key's rate and concurrency limits.
+
+    Raises:
+        ProviderThrottled: if the key had no capacity within max_wait
+        requests.exceptions.RequestException: on network errors
+    """
+    key = api_key(provider)
+    try:
+        with provider_slot(provider, key, max_wait):
+            response = requests.request(method, url, timeout=REQUEST_TIMEOUT, **kwargs)
+    except RateLimited as e:
+        raise ProviderThrottled(provider, e.retry_after)
+    if response.status_code == 429:
+        report_rate_limited(provider, key, response)
+    return response
+
+
+def _post(provider, message, url, **kwargs):
+    try:
+        response = request(provider, 'POST', url, **kwargs)
+    except requests.exceptions.RequestException as e:
+        raise ProviderError(provider, f'Network error calling {PROVIDER_NAMES[provider]} API', response_text=str(e))
+    logger.info('%s %s: %s', PROVIDER_NAMES[provider], url, response.status_code)
+    if not response.ok:
+        raise ProviderError(provider, message, response.status_code, response.text)
+    return response
+
+
+def start_did_talk(talk_payload):
+    """Start a D-ID talk. Returns its talk id."""
+    response = _post(
+        'd-id', 'Failed to start video generation', 'https://api.d-id.com/talks',
+        headers={
+            'Accept': 'application/json',
+            'Content-Type': 'application/json',
+            'Authorization': f"Basic {api_key('d-id')}",
+        },
+        json=talk_payload
+    )
+    data = response.json()
+    if not data.get('id'):
+        raise ProviderError('d-id', 'No talk ID from D-ID', response.status_code, response.text)
+    return data['id']
+
+
+def upload_heygen_talking_photo(image, content_type):
+    """
+    Register an avatar image with HeyGen. Returns (talking_photo_id, talking_photo_url).
+
+    `image` is bytes or a sized file object (e.g. an UploadedFile), which is
+    streamed as the request body instead of being read into memory.
+    """
+    response = _post(
+        'heygen', 'Failed to upload avatar to HeyGen', 'https://upload.heygen.com/v1/talking_photo',
+        headers={'x-api-key': api_key('heygen'), 'Content-Type': content_type},
+        data=image
+    )
+    data = response.json()
+    if data.get('code') != 100:
+        raise ProviderError('heygen', 'HeyGen talking photo upload failed', response.status_code, response.text)
+    return data['data']['talking_photo_id'], data['data']['talking_photo_url']
+
+
+def start_heygen_video(heygen_payload):
+    """Start a HeyGen render. Returns its video id."""
+    response = _post(
+        'heygen', 'Failed to generate video with HeyGen', 'https://api.heygen.com/v2/video/generate',
+        headers={'X-Api-Key': api_key('heygen'), 'Content-Type': 'application/json'},
+        json=heygen_payload
+    )
+    data = response.json()
+    if data.get('error'):
+        raise ProviderError('heygen', 'HeyGen video generation error', response.status_code, response.text)
+    return data['data']['video_id']
+
+
+def heygen_video_input(talking_photo_id, voice, background, scale=1.0, shape='square', offset=(0.0, 0.0)):
+    """One entry of heygen_payload['video_inputs']: a talking photo with a voice and background."""
+    return {
+        "character": {
+            "type": "talking_photo",
+            "talking_photo_id": talking_photo_id,
+            "scale": scale,
+            "talking_photo_style": shape,  # "circle" or "square"
+            "offset": {"x": offset[0], "y": offset[1]},
+            "talking_style": "stable",
+            "expression": "default",
+            "engine_id": "avatar_iv"
+        },
+        "voice": voice,
+        "background": background,
+    }
+
+
+def heygen_text_voice(text, voice_id):
+    return {
+        "type": "text",
+        "input_text": text,
+        "voice_id": voice_id,
+        "speed": 1.0,
+        "pitch": 0
+    }
+
+
+def heygen_audio_voice(audio_url):
+    # HeyGen uses "audio_url" not "input_audio_url"
+    return {"type": "audio", "audio_url": audio_url}
+
+
+def start_heygen_talking_photo_video(title, image_bytes, content_type, voice):
+    """
+    Render a plain talking-photo video at HeyGen, the equivalent of a D-ID talk.
+
+    Returns:
+        (video_id, heygen_payload, talking_photo_id, talking_photo_url)
+    """
+    talking_photo_id, talking_photo_url = upload_heygen_talking_photo(image_bytes, content_type)
+    heygen_payload = {
+        "title": title,
+        "caption": False,
+        "dimension": DEFAULT_HEYGEN_DIMENSION,
+        "video_inputs": [heygen_video_input(talking_photo_id, voice, DEFAULT_HEYGEN_BACKGROUND)],
+    }
+    return start_heygen_video(heygen_payload), heygen_payload, talking_photo_id, talking_photo_url
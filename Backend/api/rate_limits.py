@@ -0,0 +1,140 @@
+"""
+Client-side pacing of provider API calls, shared by every worker process.
+
+Each provider API key gets a ProviderQuota row holding a token bucket and a
+set of concurrency slots:
+
+* The bucket refills at PROVIDER_RATE_HEADROOM times the key's
+  requests_per_minute and holds at most `burst` tokens. Every call takes one.
+* At most `concurrency` calls are in flight at once. Slots are leases that
+  expire, so a worker that dies mid-call can't leak them.
+* A 429 from the provider empties the bucket and blocks the key until its
+  Retry-After has passed.
+
+Callers wait (up to a limit) for a token and a slot instead of firing and
+bouncing off the provider's limit. The row is updated under
+select_for_update, so the accounting holds across processes.
+"""
+import hashlib
+import logging
+import time
+import uuid
+from contextlib import contextmanager
+
+from django.conf import settings
+from django.db import transaction
+from django.utils.http import parse_http_date_safe
+
+from .models import ProviderQuota
+
+logger = logging.getLogger(__name__)
+
+# Leases outlive the longest provider call (requests timeout plus margin)
+LEASE_SECONDS = 120
+
+
+class RateLimited(Exception):
+    """No token or slot became available within the allowed wait."""
+
+    def __init__(self, provider, retry_after):
+        super().__init__(f'{provider} rate limit reached, retry in {retry_after:.0f}s')
+        self.provider = provider
+        self.retry_after = retry_after
+
+
+def quota_name(provider, key):
+    """Bucket name for a provider key; rotating the key starts a fresh bucket."""
+    return f"{provider}:{hashlib.sha256(key.encode()).hexdigest()[:12]}"
+
+
+def limits_for(provider):
+    limits = settings.PROVIDER_RATE_LIMITS.get(provider, {})
+    rate = limits.get('requests_per_minute', 60) * settings.PROVIDER_RATE_HEADROOM / 60.0
+    return rate, limits.get('burst', 1), limits.get('concurrency', 1)
+
+
+def _try_acquire(provider, name):
+    """
+    Take a token and a slot if both are free.
+
+    Returns:
+        (lease id, 0) on success, or (None, seconds until worth trying again)
+    """
+    rate, burst, concurrency = limits_for(provider)
+    now = time.time()
+    with transaction.atomic():
+        quota, created = ProviderQuota.objects.select_for_update().get_or_create(
+            name=name, defaults={'tokens': burst, 'refilled_at': now}
+        )
+        quota.tokens = min(burst, quota.tokens + (now - quota.refilled_at) * rate)
+        quota.refilled_at = now
+        quota.leases = {lease: expires for lease, expires in quota.leases.items() if expires > now}
+
+        if now < quota.blocked_until:
+            wait = quota.blocked_until - now
+        elif quota.tokens < 1:
+            wait = (1 - quota.tokens) / rate
+        elif len(quota.leases) >= concurrency:
+            # Slots free up when calls finish; poll
+            wait = 0.25
+        else:
+            lease = uuid.uuid4().hex
+            quota.tokens -= 1
+            quota.leases[lease] = now + LEASE_SECONDS
+            quota.save()
+            return lease, 0
+
+        quota.save()
+        return None, wait
+
+
+def _release(name, lease):
+    with transaction.atomic():
+        quota = ProviderQuota.objects.select_for_update().filter(name=name).first()
+        if quota and quota.leases.pop(lease, None) is not None:
+            quota.save(update_fields=['leases'])
+
+
+def report_rate_limited(provider, key, response):
+    """The provider answered 429: stop calling until its Retry-After has passed."""
+    retry_after = response.headers.get('Retry-After', '')
+    if retry_after.isdigit():
+        seconds = int(retry_after)
+    else:
+        retry_at = parse_http_date_safe(retry_after)
+        seconds = retry_at - time.time() if retry_at else settings.PROVIDER_RATE_LIMIT_BACKOFF_SECONDS
+    logger.warning('%s returned 429, pausing calls for %.0fs', provider, seconds)
+    ProviderQuota.objects.filter(name=quota_name(provider, key)).update(
+        tokens=0, refilled_at=time.time(), blocked_until=time.time() + max(seconds, 0)
+    )
+
+
+@contextmanager
+def provider_slot(provider, key, max_wait=None):
+    """
+    Hold a token and a concurrency slot of the provider key for the duration of one call.
+
+    Args:
+        provider: 'd-id' or 'heygen'
+        key: The API key the call is made with
+        max_wait: Seconds to wait for capacity (default PROVIDER_RATE_LIMIT_MAX_WAIT_SECONDS)
+
+    Raises:
+        RateLimited: if no capacity became available in time
+    """
+    if max_wait is None:
+        max_wait = settings.PROVIDER_RATE_LIMIT_MAX_WAIT_SECONDS
+    name = quota_name(provider, key)
+    deadline = time.time() + max_wait
+    while True:
+        lease, wait = _try_acquire(provider, name)
+        if lease:
+            break
+        if time.time() + wait > deadline:
+            raise RateLimited(provider, wait)
+        time.sleep(wait)
+
+    try:
+        yield
+    finally:
+        _release(name, lease)
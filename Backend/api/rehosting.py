@@ -0,0 +1,274 @@
+"""
+Copying finished videos from the providers into GCP Storage.
+
+Provider result URLs are temporary, so every finished video is copied into
+our bucket. This used to happen inline in the status poll that noticed the
+render was done, which held that HTTP request for as long as the download
+took, and on any error kept the provider URL for good.
+
+Now the poll only records a RehostTask and serves the provider URL
+meanwhile. A pool of worker threads works through the tasks:
+
+* At most REHOST_WORKERS copies run per pool, and REHOST_MAX_RUNNING
+  across all workers.
+* A failed copy is retried with exponential backoff (REHOST_RETRY_SECONDS,
+  doubling up to REHOST_RETRY_MAX_SECONDS), REHOST_MAX_ATTEMPTS times.
+* Task state lives in the database, so queued work survives restarts, and
+  a task whose worker died is picked up again after REHOST_TIMEOUT_SECONDS.
+* The copy is checked (size, MP4 header) before result_url is switched to
+  it. The switch is a single conditional UPDATE that only applies while the
+  video still points at a provider URL.
+
+The pool runs in the rehost_videos management command, and also in a
+background thread of the web process (REHOST_IN_PROCESS).
+"""
+import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import connection, connections, transaction
+from django.utils import timezone
+
+from .gcp_storage import download_and_upload_to_gcp, generate_unique_blob_name, init_gcp_client
+from .models import RehostTask, VideoGeneration
+from .signed_uploads import SNIFF_BYTES, sniff_family
+from .video_status import GCP_URL_PREFIX
+
+logger = logging.getLogger(__name__)
+
+
+class RehostVerificationError(Exception):
+    """The copied object isn't a usable video."""
+
+
+def schedule_rehost(video, provider_url):
+    """
+    Queue a copy of a finished video's provider URL into GCS.
+
+    Call after the video is saved pointing at provider_url. A task that is
+    still pending picks up the new URL (provider URLs are re-signed).
+    """
+    if video.result_url and video.result_url.startswith(GCP_URL_PREFIX):
+        return None
+    with transaction.atomic():
+        task, created = RehostTask.objects.select_for_update().get_or_create(
+            video=video,
+            defaults={
+                'source_url': provider_url,
+                'blob_name': generate_unique_blob_name('videos', f"{video.name}_{video.talk_id}.mp4"),
+            },
+        )
+        if not created and task.state != 'running' and task.source_url != provider_url:
+            # A fresh URL deserves a fresh set of attempts
+            task.source_url = provider_url
+            task.state = 'queued'
+            task.attempts = 0
+            task.not_before = timezone.now()
+            task.save(update_fields=['source_url', 'state', 'attempts', 'not_before'])
+    if settings.REHOST_IN_PROCESS:
+        transaction.on_commit(rehost_soon)
+    return task
+
+
+def _running_count(now):
+    return RehostTask.objects.filter(
+        state='running', started_at__gte=now - timedelta(seconds=settings.REHOST_TIMEOUT_SECONDS)
+    ).count()
+
+
+def _claim_next():
+    """Mark the next due task as 'running' and return it, or None."""
+    now = timezone.now()
+    with transaction.atomic():
+        if _running_count(now) >= settings.REHOST_MAX_RUNNING:
+            return None
+        task = (
+            RehostTask.objects.select_for_update()
+            .filter(state='queued', not_before__lte=now)
+            .order_by('not_before', 'id')
+            .first()
+        )
+        if task is None:
+            return None
+        task.state = 'running'
+        task.started_at = now
+        task.attempts += 1
+        task.save(update_fields=['state', 'started_at', 'attempts'])
+        return task
+
+
+def _verify(blob_name):
+    """Check the stored copy is a non-empty video; returns its size."""
+    blob = init_gcp_client().bucket(settings.GCP_BUCKET_NAME).blob(blob_name)
+    blob.reload()
+    if not blob.size:
+        raise RehostVerificationError(f'{blob_name} is empty')
+    if sniff_family(blob.download_as_bytes(start=0, end=SNIFF_BYTES - 1)) != 'video':
+        raise RehostVerificationError(f'{blob_name} is not a video file')
+    return blob.size
+
+
+def _delete_copy(blob_name):
+    try:
+        init_gcp_client().bucket(settings.GCP_BUCKET_NAME).blob(blob_name).delete()
+    except Exception as e:
+        logger.warning('Could not delete unused copy %s: %s', blob_name, e)
+
+
+def _finish(task, state, error=''):
+    # Not task.save(): the video (and with it the task) may have been deleted meanwhile
+    RehostTask.objects.filter(pk=task.pk).update(state=state, last_error=error, finished_at=timezone.now())
+
+
+def _retry_or_fail(task, error):
+    if task.attempts >= settings.REHOST_MAX_ATTEMPTS:
+        logger.error('Giving up re-hosting video %s after %s attempts: %s', task.video_id, task.attempts, error)
+        _finish(task, 'failed', error)
+        return 'failed'
+    delay = min(settings.REHOST_RETRY_SECONDS * 2 ** (task.attempts - 1), settings.REHOST_RETRY_MAX_SECONDS)
+    RehostTask.objects.filter(pk=task.pk).update(
+        state='queued', last_error=error, not_before=timezone.now() + timedelta(seconds=delay)
+    )
+    logger.warning('Re-hosting video %s failed (attempt %s), retrying in %ss: %s', task.video_id, task.attempts, delay, error)
+    return 'retry'
+
+
+def run_task(task):
+    """
+    Copy one claimed task's video into GCS and point the video at it.
+
+    Returns:
+        'done', 'retry' or 'failed'
+    """
+    try:
+        url = download_and_upload_to_gcp(task.source_url, task.blob_name, content_type='video/mp4')
+        size = _verify(task.blob_name)
+    except Exception as e:
+        return _retry_or_fail(task, f'{type(e).__name__}: {e}')
+
+    with transaction.atomic():
+        swapped = VideoGeneration.objects.filter(pk=task.video_id).exclude(
+            result_url__startswith=GCP_URL_PREFIX
+        ).update(result_url=url, modified_at=timezone.now())
+        _finish(task, 'done')
+    if not swapped:
+        # Deleted, or already pointing at another copy
+        _delete_copy(task.blob_name)
+    logger.info('Re-hosted video %s (%s bytes) as %s', task.video_id, size, task.blob_name)
+    return 'done'
+
+
+def _recover_stale():
+    """Requeue tasks whose worker died mid-copy."""
+    cutoff = timezone.now() - timedelta(seconds=settings.REHOST_TIMEOUT_SECONDS)
+    return RehostTask.objects.filter(state='running', started_at__lt=cutoff).update(state='queued')
+
+
+def _work(max_tasks, counter, lock):
+    results = []
+    try:
+        while True:
+            with lock:
+                if max_tasks is not None and counter[0] >= max_tasks:
+                    return results
+                counter[0] += 1
+            task = _claim_next()
+            if task is None:
+                return results
+            try:
+                results.append(run_task(task))
+            except Exception as e:
+                logger.exception('Error re-hosting video %s: %s', task.video_id, e)
+                results.append(_retry_or_fail(task, str(e)))
+    finally:
+        # Worker threads get their own connection; don't leave it open
+        connection.close()
+
+
+def process_rehost_tasks(max_tasks=None, workers=None):
+    """
+    Run due re-host tasks on a pool of worker threads until none are left.
+
+    Returns:
+        {'done': n, 'retry': n, 'failed': n}
+    """
+    _recover_stale()
+    workers = workers or settings.REHOST_WORKERS
+    counter, lock = [0], threading.Lock()
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        futures = [executor.submit(_work, max_tasks, counter, lock) for _ in range(workers)]
+    totals = {'done': 0, 'retry': 0, 'failed': 0}
+    for future in futures:
+        for result in future.result():
+            totals[result] += 1
+    return totals
+
+
+def backfill_rehost_tasks():
+    """Queue finished videos that still point at a provider URL and have no task yet."""
+    videos = (
+        VideoGeneration.objects.filter(status='done', result_url__isnull=False, rehost_task__isnull=True)
+        .exclude(result_url='')
+        .exclude(result_url__startswith=GCP_URL_PREFIX)
+    )
+    tasks = [
+        RehostTask(
+            video=video, source_url=video.result_url,
+            blob_name=generate_unique_blob_name('videos', f"{video.name}_{video.talk_id}.mp4"),
+        )
+        for video in videos.only('id', 'name', 'talk_id', 'result_url')
+    ]
+    RehostTask.objects.bulk_create(tasks, batch_size=500)
+    return len(tasks)
+
+
+def _seconds_until_next_task():
+    """Seconds until the earliest queued task is due, or None if there are none."""
+    not_before = (
+        RehostTask.objects.filter(state='queued').order_by('not_before').values_list('not_before', flat=True).first()
+    )
+    if not_before is None:
+        return None
+    # Due tasks left over mean the REHOST_MAX_RUNNING cap is reached elsewhere; check back shortly
+    return max((not_before - timezone.now()).total_seconds(), 1.0)
+
+
+_rehost_state = threading.Lock()
+_rehost_wakeup = threading.Event()
+_rehost_running = False
+
+
+def rehost_soon():
+    """Make sure the background re-host pool of this process is running and awake."""
+    global _rehost_running
+    with _rehost_state:
+        _rehost_wakeup.set()
+        if _rehost_running:
+            return
+        _rehost_running = True
+    threading.Thread(target=_rehost_in_background, daemon=True).start()
+
+
+def _rehost_in_background():
+    """Process tasks as they are scheduled, sleeping until retries are due; exits when none are left."""
+    global _rehost_running
+    try:
+        while True:
+            _rehost_wakeup.clear()
+            try:
+                process_rehost_tasks()
+                delay = _seconds_until_next_task()
+            except Exception as e:
+                logger.exception('Error processing re-host tasks: %s', e)
+                delay = settings.REHOST_RETRY_SECONDS
+            with _rehost_state:
+                if delay is None and not _rehost_wakeup.is_set():
+                    _rehost_running = False
+                    return
+            # Don't hold a connection while idle
+            connections.close_all()
+            _rehost_wakeup.wait(delay)
+    finally:
+        connections.close_all()
@@ -0,0 +1,150 @@
+"""
+Reuse of finished renders for identical generation requests.
+
+A render is fingerprinted from everything that shapes the output video: the
+provider settings that end up in talk_payload/heygen_payload, with uploaded
+assets identified by their content hash instead of their (always fresh) GCP
+URL. When the same user submits a request whose fingerprint matches one of
+their finished videos, a new VideoGeneration is created that points at the
+existing result instead of paying for another render.
+
+The fingerprint is computed from the request before any upload, LLM call or
+provider call, so a cache hit skips all of them.
+"""
+import hashlib
+import json
+import uuid
+from datetime import timedelta
+
+from django.conf import settings
+from django.utils import timezone
+
+from .models import UploadedAsset, VideoGeneration
+from .video_status import GCP_URL_PREFIX
+
+# Bump when the payload builders change in a way that changes the output video
+FINGERPRINT_VERSION = 1
+
+# Fields copied from the cached video; everything else comes from the new request
+CLONED_FIELDS = [
+    'platform', 'source_url', 'result_url', 'audio_url', 'image_id', 'image_s3_url',
+    'talking_photo_id', 'talking_photo_url', 'background_url', 'background_type',
+    'avatar_shape', 'avatar_scale', 'avatar_x', 'avatar_y', 'need_subtitles',
+    'input_type', 'voice_provider', 'voice_id', 'voice_name', 'metadata', 'is_draft',
+]
+
+
+def file_sha256(uploaded_file):
+    """Content hash of an uploaded file; leaves it rewound for the upload that follows."""
+    if isinstance(uploaded_file, UploadedAsset):
+        # Uploaded straight to GCS (signed_uploads.py): identified by the MD5 GCS verified
+        return f'md5:{uploaded_file.md5}' if uploaded_file.md5 else f'blob:{uploaded_file.blob_name}'
+    if getattr(uploaded_file, 'sha256', None):
+        # Streamed to GCS (uploads.py), hashed on the way in
+        return uploaded_file.sha256
+    digest = hashlib.sha256()
+    for chunk in uploaded_file.chunks():
+        digest.update(chunk)
+    uploaded_file.seek(0)
+    return digest.hexdigest()
+
+
+def normalize_text(text):
+    """Line endings and surrounding whitespace don't change the spoken script."""
+    return (text or '').replace('\r\n', '\n').strip()
+
+
+def fingerprint(spec):
+    """Stable hash of a render spec (a JSON-serializable dict)."""
+    canonical = json.dumps({'v': FINGERPRINT_VERSION, **spec}, sort_keys=True, separators=(',', ':'))
+    return hashlib.sha256(canonical.encode()).hexdigest()
+
+
+def did_fingerprint(image_file, source_url, input_type, script_input, voice_provider, voice_id,
+                    voice_language, audio_file, driver_config, provider='d-id', heygen_voice_id=None):
+    """
+    Fingerprint of a request to create_video_generation, mirroring its talk_payload.
+
+    With provider 'heygen' or 'auto' the render may come from HeyGen, in the
+    HeyGen voice, so both are part of the fingerprint. Plain D-ID requests
+    leave them out and keep matching renders fingerprinted before routing.
+    """
+    spec = {
+        'platform': 'd-id',
+        'source': {'sha256': file_sha256(image_file)} if image_file else {'url': source_url},
+        'config': driver_config,
+    }
+    if input_type == 'voice':
+        spec['script'] = {'type': 'audio', 'sha256': file_sha256(audio_file)}
+    else:
+        # The script is localized by an LLM before it reaches D-ID, so the
+        # target language is part of the input
+        spec['script'] = {
+            'type': 'text',
+            'input': normalize_text(script_input),
+            'language': voice_language or '',
+            'provider': {'type': voice_provider, 'voice_id': voice_id} if voice_provider and voice_id else None,
+        }
+    if provider != 'd-id':
+        spec['routing'] = {'provider': provider, 'heygen_voice_id': heygen_voice_id or None}
+    return fingerprint(spec)
+
+
+def heygen_fingerprint(avatar_file, background_file, background_type, avatar_shape, avatar_scale,
+                       avatar_x, avatar_y, need_subtitles, input_type, script, voice_id, audio_file,
+                       dimension, draft=False):
+    """Fingerprint of a HeyGen render, mirroring the heygen_payload built by create_heygen_video."""
+    spec = {
+        'platform': 'heygen',
+        'avatar': file_sha256(avatar_file),
+        'style': avatar_shape,
+        'scale': avatar_scale,
+        'offset': [avatar_x, avatar_y],
+        'background': {'type': background_type, 'sha256': file_sha256(background_file)},
+        'caption': need_subtitles,
+        'dimension': dimension,
+    }
+    if input_type == 'text':
+        spec['voice'] = {'type': 'text', 'input': normalize_text(script), 'voice_id': voice_id}
+    else:
+        spec['voice'] = {'type': 'audio', 'sha256': file_sha256(audio_file) if audio_file else None}
+    if draft:
+        # Only the start of the script is rendered (pipelines.draft_script)
+        spec['draft'] = True
+    return fingerprint(spec)
+
+
+def reuse_requested(request):
+    """Clients opt out of reuse with reuse_cached=false (e.g. to re-roll a render)."""
+    return str(request.data.get('reuse_cached', 'true')).lower() != 'false'
+
+
+def find_cached_render(user, video_fingerprint):
+    """
+    Latest finished video of this user with the same fingerprint, or None.
+
+    Only videos re-hosted on GCP qualify: provider result URLs expire.
+    """
+    max_age = timedelta(hours=settings.RENDER_CACHE_MAX_AGE_HOURS)
+    return VideoGeneration.objects.filter(
+        user=user,
+        fingerprint=video_fingerprint,
+        status='done',
+        result_url__startswith=GCP_URL_PREFIX,
+        created_at__gte=timezone.now() - max_age,
+    ).order_by('-created_at').first()
+
+
+def clone_render(cached, user, name, script_input):
+    """Create a finished VideoGeneration for `user` that reuses `cached`'s result."""
+    return VideoGeneration.objects.create(
+        user=user,
+        name=name,
+        script_input=script_input,
+        # Never sent to a provider: the video is already done
+        talk_id=f'cache-{uuid.uuid4().hex}',
+        status='done',
+        fingerprint=cached.fingerprint,
+        config={**(cached.config or {}), 'reused_from': cached.id},
+        **{field: getattr(cached, field) for field in CLONED_FIELDS},
+    )
@@ -0,0 +1,156 @@
+"""
+Choosing a render provider for requests either provider can serve.
+
+Each provider's health and speed are measured from our own VideoGeneration
+history: the share of finished jobs that ended in 'done', how long jobs
+waited before the provider started rendering (queue latency), and how long
+they took to render once started. The expected time to a successful video
+is the typical queue wait plus render time, divided by the success rate, and
+the provider with the lowest one is tried first. Jobs still waiting at the
+provider count towards the queue wait, so a backed-up provider drops in the
+ranking before its backlog has finished.
+
+On top of that, a circuit breaker per provider watches the synchronous
+"start a video" calls. After PROVIDER_BREAKER_FAILURES failures within
+PROVIDER_BREAKER_WINDOW_SECONDS the provider is skipped for
+PROVIDER_BREAKER_COOLDOWN_SECONDS. After that a single probe request is let
+through, and its outcome closes the breaker or opens it again.
+"""
+import logging
+import statistics
+import time
+from datetime import datetime, timedelta
+
+from django.conf import settings
+from django.core.cache import cache
+from django.utils import timezone
+
+from .models import VideoGeneration
+from .providers import PROVIDERS
+from .video_status import QUEUED_STATUSES, SEGMENTED_TALK_ID_PREFIX, TERMINAL_STATUSES
+
+logger = logging.getLogger(__name__)
+
+# Assumed for providers without enough history yet
+DEFAULT_DURATION_SECONDS = 120.0
+
+
+def _seconds_between(start, end):
+    if isinstance(end, str):
+        end = datetime.fromisoformat(end)
+    return max((end - start).total_seconds(), 0.0)
+
+
+def compute_provider_stats(provider):
+    """Success rate and latencies of a provider's recent jobs."""
+    since = timezone.now() - timedelta(hours=settings.ROUTING_STATS_HOURS)
+    rows = (
+        VideoGeneration.objects.filter(platform=provider, created_at__gte=since)
+        .exclude(talk_id__startswith='cache-')  # reused renders never reached the provider
+        .exclude(talk_id__startswith=SEGMENTED_TALK_ID_PREFIX)  # stitched locally; its segments are the provider jobs
+        .order_by('-created_at')
+        .values_list('status', 'created_at', 'modified_at', 'config')[:settings.ROUTING_STATS_WINDOW]
+    )
+
+    done = failed = 0
+    queue_times, render_times = [], []
+    now = timezone.now()
+    for video_status, created_at, modified_at, config in rows:
+        config = config or {}
+        if video_status == 'queued':
+            continue  # still in our own queue (scheduler.py), not sent to the provider yet
+        # Time spent in our own queue says nothing about the provider
+        submitted_at = datetime.fromisoformat(config['submitted_at']) if config.get('submitted_at') else created_at
+        started_at = config.get('started_at')
+        if started_at:
+            queue_times.append(_seconds_between(submitted_at, started_at))
+        elif video_status in QUEUED_STATUSES:
+            # Still waiting at the provider: it has waited at least this long, so a backlog shows at once
+            queue_times.append(_seconds_between(submitted_at, now))
+        if video_status == 'done':
+            done += 1
+            # Without a start time (finished between two polls) the queue wait is counted in here
+            render_times.append(_seconds_between(
+                datetime.fromisoformat(started_at) if started_at else submitted_at,
+                config.get('finished_at') or modified_at
+            ))
+        elif video_status in TERMINAL_STATUSES:
+            failed += 1
+
+    return {
+        'provider': provider,
+        'finished': done + failed,
+        # Laplace-smoothed so one early failure doesn't rule a provider out
+        'success_rate': (done + 1) / (done + failed + 2),
+        'queue_seconds': statistics.median(queue_times) if queue_times else None,
+        'render_seconds': statistics.median(render_times) if render_times else None,
+    }
+
+
+def get_provider_stats(provider):
+    """compute_provider_stats(), cached for ROUTING_STATS_CACHE_SECONDS."""
+    return cache.get_or_set(
+        f'provider-stats:{provider}',
+        lambda: compute_provider_stats(provider),
+        settings.ROUTING_STATS_CACHE_SECONDS
+    )
+
+
+def expected_seconds(stats):
+    """Expected time until a successful video: queue wait plus render time, retries for failures included."""
+    duration = (stats['queue_seconds'] or 0.0) + (stats['render_seconds'] or DEFAULT_DURATION_SECONDS)
+    return duration / stats['success_rate']
+
+
+def _breaker_keys(provider):
+    prefix = f'provider-breaker:{provider}'
+    return f'{prefix}:failures', f'{prefix}:open-until', f'{prefix}:probe'
+
+
+def is_available(provider):
+    """False while the provider's circuit is open."""
+    _, open_key, probe_key = _breaker_keys(provider)
+    open_until = cache.get(open_key)
+    if open_until is None:
+        return True
+    if time.time() < open_until:
+        return False
+    # Half-open: one request gets to find out whether the provider is back
+    return cache.add(probe_key, 1, settings.PROVIDER_BREAKER_COOLDOWN_SECONDS)
+
+
+def record_success(provider):
+    cache.delete_many(_breaker_keys(provider))
+
+
+def record_failure(provider):
+    failures_key, open_key, probe_key = _breaker_keys(provider)
+    cache.add(failures_key, 0, settings.PROVIDER_BREAKER_WINDOW_SECONDS)
+    try:
+        failures = cache.incr(failures_key)
+    except ValueError:
+        failures = 1
+    # A failed probe reopens the circuit straight away
+    if failures >= settings.PROVIDER_BREAKER_FAILURES or cache.get(open_key) is not None:
+        logger.warning('Opening circuit for %s after %s failures', provider, failures)
+        cache.set(open_key, time.time() + settings.PROVIDER_BREAKER_COOLDOWN_SECONDS, None)
+        cache.delete_many([failures_key, probe_key])
+
+
+def rank_providers(candidates=PROVIDERS):
+    """
+    Order candidate providers for a request, best first.
+
+    Providers with an open circuit are left out. Healthy providers come before
+    ones whose success rate dropped below ROUTING_MIN_SUCCESS_RATE, and within
+    each group the one expected to deliver a video soonest comes first.
+    """
+    ranked = []
+    for provider in candidates:
+        if not is_available(provider):
+            continue
+        stats = get_provider_stats(provider)
+        degraded = stats['finished'] >= 10 and stats['success_rate'] < settings.ROUTING_MIN_SUCCESS_RATE
+        ranked.append((degraded, expected_seconds(stats), provider))
+    ranked.sort()
+    return [provider for _, _, provider in ranked]
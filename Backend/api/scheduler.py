@@ -0,0 +1,406 @@
+"""
+Fair-share dispatching of render jobs to the providers.
+
+Creating a video no longer calls the provider directly. The request queues
+a GenerationJob, and the dispatcher hands jobs to D-ID/HeyGen in an order
+that shares provider capacity fairly between users:
+
+* Weighted fair queuing: each job gets a virtual finish time of
+  max(system virtual time, the user's previous virtual finish) + 1 / weight.
+  Jobs are dispatched in virtual-finish order. A user who queues 200 jobs
+  only pushes their own later jobs back, and someone submitting one job
+  slots in right after the heavy user's current one.
+* Priority tiers are weights (SCHEDULER_PRIORITY_WEIGHTS), so high-priority
+  work gets a larger share without starving low-priority work.
+* At most SCHEDULER_USER_MAX_IN_FLIGHT jobs per user and
+  SCHEDULER_MAX_IN_FLIGHT jobs overall are rendering at the provider at
+  once.
+
+The order is stored on the rows (virtual_finish), so it survives restarts.
+Dispatching runs in the dispatch_jobs management command, and also in a
+background thread of the web process (SCHEDULER_DISPATCH_IN_PROCESS). Each
+pass refreshes the status of the jobs at the providers itself, so slots are
+freed when renders finish whether or not anyone polls them, and the thread
+sleeps until the next deferred job is due or the next status check.
+"""
+import logging
+import threading
+import uuid
+from datetime import timedelta
+
+import requests
+from django.conf import settings
+from django.db import connections, transaction
+from django.db.models import Count, Max, Q
+from django.db.models.functions import Coalesce
+from django.utils import timezone
+
+from .models import GenerationJob, JobCheckpoint
+from .providers import (
+    ProviderError,
+    ProviderNotConfigured,
+    ProviderThrottled,
+    start_did_talk,
+    start_heygen_talking_photo_video,
+    start_heygen_video,
+)
+from .routing import is_available, rank_providers, record_failure, record_success
+from .video_status import TERMINAL_STATUSES, refresh_video_statuses
+
+logger = logging.getLogger(__name__)
+
+VIRTUAL_TIME_CHECKPOINT = 'scheduler:virtual-time'
+# JobCheckpoint.position is an integer; virtual time is stored in millionths
+VIRTUAL_TIME_SCALE = 1_000_000
+
+QUEUED_TALK_ID_PREFIX = 'queued-'
+
+
+def placeholder_talk_id():
+    """talk_id of a video whose job hasn't reached a provider yet (talk_id is unique)."""
+    return f'{QUEUED_TALK_ID_PREFIX}{uuid.uuid4().hex}'
+
+
+def job_priority(request, default='normal'):
+    """Priority tier requested by the client; only staff may ask for 'high'."""
+    priority = request.data.get('priority', default)
+    if priority not in settings.SCHEDULER_PRIORITY_WEIGHTS:
+        return default
+    if priority == 'high' and not request.user.is_staff:
+        return default
+    return priority
+
+
+def enqueue(video, payload, requested_provider, candidates, priority='normal'):
+    """
+    Queue a render for dispatch.
+
+    Args:
+        video: The VideoGeneration (status 'queued', placeholder talk_id)
+        payload: {provider: {...}} as understood by _start()
+        requested_provider: 'd-id', 'heygen' or 'auto'
+        candidates: Providers that can serve the job
+        priority: 'high', 'normal' or 'low'
+    """
+    return enqueue_many([(video, payload)], requested_provider, candidates, priority)[0]
+
+
+def enqueue_many(items, requested_provider, candidates, priority='normal', cost=1.0):
+    """
+    Queue several renders at once (one transaction, one bulk insert).
+
+    Args:
+        items: (video, payload) pairs, see enqueue()
+        requested_provider, candidates, priority: As for enqueue(), shared by all items
+        cost: Share of a whole video each item stands for in the fair queue
+            (the segments of one video split a single video's cost)
+    """
+    weight = settings.SCHEDULER_PRIORITY_WEIGHTS[priority] / cost
+    jobs = []
+    with transaction.atomic():
+        checkpoint, _ = JobCheckpoint.objects.select_for_update().get_or_create(name=VIRTUAL_TIME_CHECKPOINT)
+        virtual_time = checkpoint.position / VIRTUAL_TIME_SCALE
+        last_finish = {}
+        for video, payload in items:
+            if video.user_id not in last_finish:
+                last_finish[video.user_id] = GenerationJob.objects.filter(user_id=video.user_id).aggregate(
+                    last=Max('virtual_finish')
+                )['last'] or 0.0
+            start = max(virtual_time, last_finish[video.user_id])
+            last_finish[video.user_id] = start + 1.0 / weight
+            jobs.append(GenerationJob(
+                video=video,
+                user_id=video.user_id,
+                priority=priority,
+                requested_provider=requested_provider,
+                candidates=list(candidates),
+                payload=payload,
+                virtual_start=start,
+                virtual_finish=start + 1.0 / weight,
+            ))
+        jobs = GenerationJob.objects.bulk_create(jobs, batch_size=500)
+    if settings.SCHEDULER_DISPATCH_IN_PROCESS:
+        # Callers may be inside a larger transaction; the dispatcher can't see the jobs before it commits
+        transaction.on_commit(dispatch_soon)
+    return jobs
+
+
+def _in_flight(now):
+    # Jobs whose render never reported back stop counting after a while
+    since = now - timedelta(seconds=settings.SCHEDULER_IN_FLIGHT_TIMEOUT_SECONDS)
+    return GenerationJob.objects.filter(state__in=['dispatching', 'submitted'], dispatched_at__gte=since)
+
+
+def _in_flight_by_user(now):
+    """Videos with a job handed to a provider that hasn't finished, per user."""
+    # The segments of a segmented render (segments.py) render side by side as one video
+    return dict(
+        _in_flight(now)
+        .values('user_id')
+        .annotate(n=Count(Coalesce('video__segment_of_id', 'video_id'), distinct=True))
+        .order_by()
+        .values_list('user_id', 'n')
+    )
+
+
+def _claim_next(skip):
+    """Mark the next dispatchable job as 'dispatching' and return it, or None."""
+    now = timezone.now()
+    with transaction.atomic():
+        if _in_flight(now).count() >= settings.SCHEDULER_MAX_IN_FLIGHT:
+            return None
+        in_flight = _in_flight_by_user(now)
+        at_cap = [user_id for user_id, n in in_flight.items() if n >= settings.SCHEDULER_USER_MAX_IN_FLIGHT]
+        # Remaining segments of a segmented video that already holds a slot may still go
+        started = list(
+            _in_flight(now).filter(user_id__in=at_cap, video__segment_of__isnull=False)
+            .values_list('video__segment_of_id', flat=True).distinct()
+        )
+
+        job = (
+            GenerationJob.objects.select_for_update()
+            .filter(state='queued', not_before__lte=now)
+            .exclude(Q(user_id__in=at_cap) & ~Q(video__segment_of_id__in=started))
+            .exclude(id__in=skip)
+            .order_by('virtual_finish', 'id')
+            .first()
+        )
+        if job is None:
+            return None
+
+        job.state = 'dispatching'
+        job.dispatched_at = now
+        job.attempts += 1
+        job.save(update_fields=['state', 'dispatched_at', 'attempts'])
+
+        # System virtual time follows the start tag of the job in service
+        position = int(job.virtual_start * VIRTUAL_TIME_SCALE)
+        JobCheckpoint.objects.filter(
+            name=VIRTUAL_TIME_CHECKPOINT, position__lt=position
+        ).update(position=position)
+        return job
+
+
+def _start(platform, spec):
+    """Submit one job to one provider. Returns (provider job id, extra video fields)."""
+    if platform == 'd-id':
+        return start_did_talk(spec['talk_payload']), {}
+    if 'heygen_payload' in spec:
+        return start_heygen_video(spec['heygen_payload']), {}
+
+    # A D-ID style request served by HeyGen: register the photo first
+    image_response = requests.get(spec['image_url'], timeout=60)
+    image_response.raise_for_status()
+    video_id, heygen_payload, talking_photo_id, talking_photo_url = start_heygen_talking_photo_video(
+        spec['title'], image_response.content,
+        image_response.headers.get('Content-Type', 'image/jpeg'), spec['voice']
+    )
+    return video_id, {
+        'talking_photo_id': talking_photo_id,
+        'talking_photo_url': talking_photo_url,
+        'config': {'heygen_payload': heygen_payload},
+    }
+
+
+def _mark_submitted(job, platform, talk_id, extra, attempts):
+    video = job.video
+    fields = {**job.payload[platform].get('fields', {}), **extra}
+    config = {**(video.config or {}), **fields.pop('config', {})}
+    # Provider-side timings (routing.py) start here, not when the job was queued
+    config['submitted_at'] = timezone.now().isoformat()
+    config['routing'] = {
+        'requested': job.requested_provider,
+        'candidates': job.candidates,
+        'attempts': attempts,
+    }
+    for name, value in fields.items():
+        setattr(video, name, value)
+    video.platform = platform
+    video.talk_id = talk_id
+    video.config = config
+    video.save()
+
+    job.state = 'submitted'
+    job.last_error = ''
+    job.save(update_fields=['state', 'last_error'])
+    logger.info('Dispatched job %s (video %s) to %s as %s', job.pk, video.pk, platform, talk_id)
+
+
+def _defer(job, delay, error, count_attempt=True):
+    job.state = 'queued'
+    job.not_before = timezone.now() + timedelta(seconds=delay)
+    job.last_error = error
+    if not count_attempt:
+        # Waiting for capacity isn't a failed attempt
+        job.attempts -= 1
+    job.save(update_fields=['state', 'not_before', 'last_error', 'attempts'])
+
+
+def _fail(job, error):
+    job.state = 'failed'
+    job.last_error = error
+    job.save(update_fields=['state', 'last_error'])
+    video = job.video
+    video.status = 'error'
+    video.config = {**(video.config or {}), 'dispatch_error': error}
+    video.save()
+    logger.warning('Job %s (video %s) failed: %s', job.pk, video.pk, error)
+    if video.segment_of_id:
+        from .segments import roll_up
+        roll_up(video.segment_of_id)
+
+
+def _submit(job):
+    """
+    Hand a claimed job to the best available provider.
+
+    Returns:
+        'dispatched', 'deferred' (back in the queue for later) or 'failed'
+    """
+    if job.requested_provider == 'auto':
+        ranked = rank_providers(job.candidates)
+    else:
+        ranked = [provider for provider in job.candidates if is_available(provider)]
+    if not ranked:
+        _defer(job, settings.PROVIDER_BREAKER_COOLDOWN_SECONDS, 'No provider available', count_attempt=False)
+        return 'deferred'
+
+    attempts = []
+    retry_after = 0
+    for platform in ranked:
+        try:
+            talk_id, extra = _start(platform, job.payload[platform])
+        except ProviderNotConfigured as e:
+            attempts.append({'provider': platform, 'error': str(e)})
+            continue
+        except ProviderThrottled as e:
+            attempts.append({'provider': platform, 'error': e.message, 'status_code': 429})
+            retry_after = max(retry_after, e.retry_after)
+            continue
+        except ProviderError as e:
+            logger.error('%s API error: %s - %s', platform, e.status_code, e.response_text)
+            attempts.append({'provider': platform, 'error': e.message, 'status_code': e.status_code})
+            if not e.retryable:
+                _fail(job, f'{e.message}: {e.response_text}')
+                return 'failed'
+            if e.outage:
+                record_failure(platform)
+            continue
+        except requests.exceptions.RequestException as e:
+            attempts.append({'provider': platform, 'error': str(e)})
+            continue
+        record_success(platform)
+        _mark_submitted(job, platform, talk_id, extra, attempts)
+        return 'dispatched'
+
+    error = '; '.join(f"{a['provider']}: {a['error']}" for a in attempts)
+    if attempts and all(a.get('status_code') == 429 for a in attempts):
+        _defer(job, retry_after, error, count_attempt=False)
+        return 'deferred'
+    if job.attempts >= settings.SCHEDULER_MAX_ATTEMPTS:
+        _fail(job, error)
+        return 'failed'
+    _defer(job, retry_after or settings.SCHEDULER_RETRY_SECONDS * job.attempts, error)
+    return 'deferred'
+
+
+def refresh_submitted():
+    """Refresh the provider status of in-flight jobs so finished renders free their slots."""
+    from .models import VideoGeneration
+
+    video_ids = _in_flight(timezone.now()).filter(state='submitted').values_list('video_id', flat=True)
+    videos = list(VideoGeneration.objects.filter(id__in=video_ids).exclude(status__in=TERMINAL_STATUSES))
+    # Videos refreshed within VIDEO_STATUS_REFRESH_SECONDS (e.g. by a client poll) aren't asked again
+    refresh_video_statuses(videos)
+
+
+def dispatch_jobs(max_jobs=None):
+    """
+    Dispatch queued jobs until capacity or the queue runs out.
+
+    Returns:
+        Number of jobs handed to a provider
+    """
+    refresh_submitted()
+    now = timezone.now()
+    # Finished renders free their slots
+    GenerationJob.objects.filter(state='submitted', video__status__in=TERMINAL_STATUSES).update(state='completed')
+    # A worker that died mid-dispatch: try again (the provider may or may not have the job)
+    GenerationJob.objects.filter(
+        state='dispatching',
+        dispatched_at__lt=now - timedelta(seconds=settings.SCHEDULER_DISPATCH_TIMEOUT_SECONDS)
+    ).update(state='queued')
+
+    dispatched = 0
+    skip = set()
+    while max_jobs is None or dispatched < max_jobs:
+        job = _claim_next(skip)
+        if job is None:
+            break
+        if _submit(job) == 'dispatched':
+            dispatched += 1
+        else:
+            skip.add(job.pk)
+    return dispatched
+
+
+def seconds_until_next_dispatch():
+    """
+    Seconds until dispatch_jobs() may have something to do, or None if nothing is pending.
+
+    That is when the earliest deferred job is due, or SCHEDULER_POLL_SECONDS
+    while renders are in flight (their status is checked to free slots).
+    """
+    now = timezone.now()
+    in_flight = _in_flight(now).exists()
+    not_before = (
+        GenerationJob.objects.filter(state='queued').order_by('not_before')
+        .values_list('not_before', flat=True).first()
+    )
+    if not_before is None and not in_flight:
+        return None
+    # Due jobs left over are waiting for a slot, which the next status check may free
+    delay = settings.SCHEDULER_POLL_SECONDS
+    if not_before is not None and not_before > now:
+        until_due = (not_before - now).total_seconds()
+        delay = min(delay, until_due) if in_flight else until_due
+    return max(delay, 1.0)
+
+
+_dispatch_state = threading.Lock()
+_dispatch_wakeup = threading.Event()
+_dispatch_running = False
+
+
+def dispatch_soon():
+    """Make sure the background dispatcher of this process is running and awake."""
+    global _dispatch_running
+    with _dispatch_state:
+        _dispatch_wakeup.set()
+        if _dispatch_running:
+            return
+        _dispatch_running = True
+    threading.Thread(target=_dispatch_in_background, daemon=True).start()
+
+
+def _dispatch_in_background():
+    """Dispatch as jobs are queued and finish, sleeping until the next one is due; exits when none are left."""
+    global _dispatch_running
+    try:
+        while True:
+            _dispatch_wakeup.clear()
+            try:
+                dispatch_jobs()
+                delay = seconds_until_next_dispatch()
+            except Exception as e:
+                logger.exception('Error dispatching generation jobs: %s', e)
+                delay = settings.SCHEDULER_RETRY_SECONDS
+            with _dispatch_state:
+                if delay is None and not _dispatch_wakeup.is_set():
+                    _dispatch_running = False
+                    return
+            # Don't hold a connection while idle
+            connections.close_all()
+            _dispatch_wakeup.wait(delay)
+    finally:
+        connections.close_all()
@@ -0,0 +1,220 @@
+"""
+Full-text search over VideoGeneration.name and script_input.
+
+One interface, one backend per database:
+
+* SQLite: an FTS5 external-content table kept in sync by triggers.
+* PostgreSQL: a GIN index on a to_tsvector() expression.
+* Anything else: a slow icontains fallback, so the endpoints still work.
+
+Both index-backed variants are maintained by the database on every
+INSERT/UPDATE/DELETE, so the index is always current without a reindex
+job. Results are ranked, and pages are cut with keyset pagination on
+(score, id).
+"""
+import re
+
+from django.db import connection
+from django.db.models import Q
+
+from .models import VideoGeneration
+from .pagination import decode_cursor, encode_cursor
+
+# Created, along with its sync triggers, by migration 0011_video_search_index
+SQLITE_FTS_TABLE = 'api_videogeneration_fts'
+
+# Must match the expression of the GIN index (modulo the alias) for it to be used
+POSTGRES_VECTOR = (
+    "to_tsvector('simple', coalesce(v.name, '') || ' ' || coalesce(v.script_input, ''))"
+)
+
+SEARCH_ORDERING = ('search_score', 'id')
+
+
+class SearchBackend:
+    """Base class: subclasses return ranked (id, score) rows for a query."""
+
+    # Placeholder for a score from the cursor in the keyset condition
+    score_param = '%s'
+
+    def ranked_ids(self, query, user, public_only, after, limit):
+        """Return up to `limit` (id, score) rows, best first, strictly after `after`."""
+        raise NotImplementedError
+
+    def search(self, query, user=None, public_only=False, cursor=None, page_size=20, queryset=None):
+        """
+        Search videos by name and script.
+
+        Args:
+            query: Free-text query from the user
+            user: Restrict to this user's videos
+            public_only: Restrict to public, finished videos (the social feed)
+            cursor: Cursor from a previous page
+            page_size: Results per page
+            queryset: Queryset used to load the matching rows (e.g. with .only())
+
+        Returns:
+            Dict with 'results' (VideoGeneration instances, best match first),
+            'next_cursor' and 'has_next'
+        """
+        empty = {'results': [], 'next_cursor': None, 'has_next': False}
+        if not query.strip():
+            return empty
+
+        after = decode_cursor(cursor, VideoGeneration, SEARCH_ORDERING) if cursor else None
+        rows = self.ranked_ids(query, user, public_only, after, page_size + 1)
+        if rows is None:
+            return empty
+
+        has_next = len(rows) > page_size
+        rows = rows[:page_size]
+
+        if queryset is None:
+            queryset = VideoGeneration.objects.select_related('user')
+        videos = queryset.in_bulk([video_id for video_id, _ in rows])
+        results = []
+        for video_id, score in rows:
+            video = videos.get(video_id)
+            if video:
+                video.search_score = score
+                results.append(video)
+
+        next_cursor = encode_cursor(list(rows[-1][::-1])) if has_next and rows else None
+        return {'results': results, 'next_cursor': next_cursor, 'has_next': has_next}
+
+    @staticmethod
+    def _scope_sql(user, public_only):
+        # Segments of a segmented render (segments.py) are found through their parent
+        where, params = ['v.segment_of_id IS NULL'], []
+        if user is not None:
+            where.append('v.user_id = %s')
+            params.append(user.pk)
+        if public_only:
+            where.append('v.is_public = %s AND v.status = %s')
+            params.extend([True, 'done'])
+        return where, params
+
+    @classmethod
+    def _ranked_sql(cls, inner_sql, params, after, limit):
+        # The score is wrapped in a subquery so it can be used in the keyset condition
+        sql = f"SELECT id, search_score FROM ({inner_sql}) ranked"
+        if after:
+            score = cls.score_param
+            sql += f" WHERE search_score <= {score} AND (search_score < {score} OR (search_score = {score} AND id < %s))"
+            params = params + [after[0], after[0], after[0], after[1]]
+        sql += " ORDER BY search_score DESC, id DESC LIMIT %s"
+        with connection.cursor() as cursor:
+            cursor.execute(sql, params + [limit])
+            return [(row[0], row[1]) for row in cursor.fetchall()]
+
+
+class SQLiteSearchBackend(SearchBackend):
+    def ranked_ids(self, query, user, public_only, after, limit):
+        # Quote every term so user input can't inject FTS5 syntax; '*' allows prefix matches
+        terms = re.findall(r'\w+', query)
+        if not terms:
+            return None
+        match = ' '.join('"{}"*'.format(term) for term in terms)
+
+        scope_sql, scope_params = self._scope_sql(user, public_only)
+        where = [f'{SQLITE_FTS_TABLE} MATCH %s'] + scope_sql
+        inner = (
+            # bm25() is lower-is-better; the name column weighs twice the script
+            f"SELECT v.id AS id, -bm25({SQLITE_FTS_TABLE}, 2.0, 1.0) AS search_score "
+            f"FROM {SQLITE_FTS_TABLE} JOIN api_videogeneration v ON v.id = {SQLITE_FTS_TABLE}.rowid "
+            f"WHERE {' AND '.join(where)}"
+        )
+        return self._ranked_sql(inner, [match] + scope_params, after, limit)
+
+
+class PostgresSearchBackend(SearchBackend):
+    # ts_rank_cd() returns real; as float4 the score never equals the cursor's
+    # Python float, so ties at a page boundary were skipped or repeated
+    score_param = '%s::float8'
+
+    def ranked_ids(self, query, user, public_only, after, limit):
+        scope_sql, scope_params = self._scope_sql(user, public_only)
+        where = [f"{POSTGRES_VECTOR} @@ websearch_to_tsquery('simple', %s)"] + scope_sql
+        inner = (
+            f"SELECT v.id AS id, ts_rank_cd({POSTGRES_VECTOR}, websearch_to_tsquery('simple', %s))::float8 AS search_score "
+            f"FROM api_videogeneration v WHERE {' AND '.join(where)}"
+        )
+        return self._ranked_sql(inner, [query, query] + scope_params, after, limit)
+
+
+class BasicSearchBackend(SearchBackend):
+    """Unindexed fallback for databases without a full-text backend."""
+
+    def ranked_ids(self, query, user, public_only, after, limit):
+        videos = VideoGeneration.objects.filter(
+            Q(name__icontains=query) | Q(script_input__icontains=query), segment_of__isnull=True
+        )
+        if user is not None:
+            videos = videos.filter(user=user)
+        if public_only:
+            videos = videos.filter(is_public=True, status='done')
+        if after:
+            videos = videos.filter(id__lt=after[1])
+        # No relevance ranking: newest first, all with the same score
+        return [(video_id, 0.0) for video_id in videos.order_by('-id').values_list('id', flat=True)[:limit]]
+
+
+def get_search_backend():
+    """Return the search backend for the default database."""
+    if connection.vendor == 'sqlite':
+        return SQLiteSearchBackend()
+    if connection.vendor == 'postgresql':
+        return PostgresSearchBackend()
+    return BasicSearchBackend()
+
+
+SQLITE_TRIGGERS = {
+    'api_videogeneration_fts_ai': f"""
+        CREATE TRIGGER IF NOT EXISTS api_videogeneration_fts_ai AFTER INSERT ON api_videogeneration BEGIN
+            INSERT INTO {SQLITE_FTS_TABLE}(rowid, name, script_input)
+            VALUES (new.id, new.name, new.script_input);
+        END
+    """,
+    'api_videogeneration_fts_ad': f"""
+        CREATE TRIGGER IF NOT EXISTS api_videogeneration_fts_ad AFTER DELETE ON api_videogeneration BEGIN
+            INSERT INTO {SQLITE_FTS_TABLE}({SQLITE_FTS_TABLE}, rowid, name, script_input)
+            VALUES ('delete', old.id, old.name, old.script_input);
+        END
+    """,
+    'api_videogeneration_fts_au': f"""
+        CREATE TRIGGER IF NOT EXISTS api_videogeneration_fts_au
+        AFTER UPDATE OF name, script_input ON api_videogeneration BEGIN
+            INSERT INTO {SQLITE_FTS_TABLE}({SQLITE_FTS_TABLE}, rowid, name, script_input)
+            VALUES ('delete', old.id, old.name, old.script_input);
+            INSERT INTO {SQLITE_FTS_TABLE}(rowid, name, script_input)
+            VALUES (new.id, new.name, new.script_input);
+        END
+    """,
+}
+
+
+def ensure_search_triggers(using='default'):
+    """
+    Re-create the SQLite FTS sync triggers if they are missing.
+
+    SQLite migrations that alter api_videogeneration rebuild the table, which
+    silently drops its triggers. This runs after every migrate and restores
+    them, then rebuilds the index to pick up rows written in between.
+    """
+    from django.db import connections
+
+    conn = connections[using]
+    if conn.vendor != 'sqlite':
+        return
+
+    with conn.cursor() as cursor:
+        cursor.execute("SELECT name FROM sqlite_master WHERE type IN ('table', 'trigger')")
+        existing = {row[0] for row in cursor.fetchall()}
+        if SQLITE_FTS_TABLE not in existing:
+            return  # search migration not applied yet
+
+        missing = [name for name in SQLITE_TRIGGERS if name not in existing]
+        for name in missing:
+            cursor.execute(SQLITE_TRIGGERS[name])
+        if missing:
+            cursor.execute(f"INSERT INTO {SQLITE_FTS_TABLE}({SQLITE_FTS_TABLE}) VALUES ('rebuild')")
@@ -0,0 +1,459 @@
+"""
+Rendering long scripts as parallel segments, stitched locally.
+
+A provider renders a script in time roughly proportional to its length, so
+a long script is one long wait. With segmented=true (text input only),
+create_video_generation instead:
+
+1. Splits the script at paragraph and sentence boundaries into pieces of
+   about SEGMENT_MAX_CHARS, at most SEGMENT_MAX_COUNT of them.
+2. Creates the video the user sees (the parent, talk_id "segmented-...")
+   and one VideoGeneration per piece (segment_of/segment_index). Each
+   segment is queued as its own job. The scheduler dispatches them side by
+   side: together they count as one video toward the per-user limit, and
+   as one video's worth of fair-queue share.
+3. Rolls the segment statuses up into the parent as they change
+   (queued -> processing -> stitching -> done/error). One failed segment
+   fails the parent, and segments still waiting in our queue are
+   cancelled.
+4. Once every segment is done, downloads the clips in parallel and joins
+   them with ffmpeg's concat demuxer. Segments render at the same provider,
+   so the clips share codec parameters and are joined by stream copy
+   (no re-encoding); if that fails they are re-encoded instead. The result
+   is uploaded to GCS and becomes the parent's result_url.
+
+The wall-clock time of a long video approaches that of its longest segment
+plus the stitch. Stitching runs in a background thread of the web process
+(SEGMENT_STITCH_IN_PROCESS) or in the stitch_segments management command.
+"""
+import copy
+import logging
+import os
+import subprocess
+import tempfile
+import threading
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta
+
+import requests
+from django.conf import settings
+from django.db import connections, transaction
+from django.utils import timezone
+
+from .feed_cache import invalidate_feed
+from .gcp_storage import generate_unique_blob_name, init_gcp_client, upload_file_to_gcp
+from .models import GenerationJob, VideoGeneration
+from .pipelines import SENTENCE_END
+from .routing import rank_providers
+from .scheduler import enqueue_many, placeholder_talk_id
+from .video_status import SEGMENTED_TALK_ID_PREFIX, TERMINAL_STATUSES, refresh_video_statuses
+
+logger = logging.getLogger(__name__)
+
+PARAGRAPH_BREAK = '\n\n'
+
+DOWNLOAD_CHUNK_SIZE = 1024 * 1024
+
+
+class StitchError(Exception):
+    """The segments couldn't be joined into one video."""
+
+
+def _units(text):
+    """(separator, text) pairs: whole paragraphs, or the sentences of ones that are too long."""
+    units = []
+    for paragraph in (p.strip() for p in text.replace('\r\n', '\n').split(PARAGRAPH_BREAK)):
+        if not paragraph:
+            continue
+        if len(paragraph) <= settings.SEGMENT_MAX_CHARS:
+            sentences = [paragraph]
+        else:
+            sentences = [s.strip() for s in SENTENCE_END.split(paragraph) if s.strip()]
+        for index, sentence in enumerate(sentences):
+            units.append((' ' if index else PARAGRAPH_BREAK, sentence))
+    return units
+
+
+def split_script(text):
+    """
+    Split a script into segments at paragraph and sentence boundaries.
+
+    A script of N characters makes ceil(N / SEGMENT_MAX_CHARS) pieces, at
+    most SEGMENT_MAX_COUNT, as even in length as the boundaries allow (the
+    longest one sets the pace). A script that fits in one piece comes back
+    as a single item.
+    """
+    units = _units(text)
+    remaining = len(''.join(f'{separator}{unit}' for separator, unit in units))
+    count = min(-(-remaining // settings.SEGMENT_MAX_CHARS), settings.SEGMENT_MAX_COUNT)
+    if count <= 1:
+        return [PARAGRAPH_BREAK.join(unit for _, unit in units)] if units else []
+    pieces, current = [], ''
+    for separator, unit in units:
+        target = remaining / (count - len(pieces))
+        extended = f'{current}{separator}{unit}' if current else unit
+        # Cut before this unit if that lands closer to an even share; the last piece takes the rest
+        if current and len(pieces) < count - 1 and len(extended) - target > target - len(current):
+            pieces.append(current)
+            remaining -= len(current) + len(separator)
+            current = unit
+        else:
+            current = extended
+    pieces.append(current)
+    return pieces
+
+
+def segment_payload(job_payload, text, title):
+    """A copy of a text render's job payload (see create_video_generation) that speaks only text."""
+    payload = copy.deepcopy(job_payload)
+    if 'd-id' in payload:
+        payload['d-id']['talk_payload']['script']['input'] = text
+    if 'heygen' in payload:
+        payload['heygen']['voice']['input_text'] = text
+        payload['heygen']['title'] = title
+    return payload
+
+
+def create_segmented_video(fields, pieces, job_payload, requested_provider, candidates, priority='normal'):
+    """
+    Create a video rendered as one queued segment per script piece.
+
+    Args:
+        fields: VideoGeneration fields of the video, as for a single render
+        pieces: The script split by split_script()
+        job_payload, requested_provider, candidates, priority: As for scheduler.enqueue()
+
+    Returns:
+        The parent VideoGeneration
+    """
+    if len(candidates) > 1:
+        # One provider for every segment: clips from the same renderer can be joined without re-encoding
+        candidates = rank_providers(candidates)[:1] or candidates[:1]
+    fields = dict(fields)
+    config = fields.pop('config', None) or {}
+    count = len(pieces)
+
+    with transaction.atomic():
+        parent = VideoGeneration.objects.create(
+            **fields,
+            talk_id=f'{SEGMENTED_TALK_ID_PREFIX}{uuid.uuid4().hex}',
+            status='queued',
+            config={**config, 'segments': count, 'segments_done': 0},
+        )
+        # A render cache hit on a segment would be a different, shorter video
+        fields.pop('fingerprint', None)
+        items = []
+        for index, piece in enumerate(pieces):
+            title = f"{fields['name'][:240]} [{index + 1}/{count}]"
+            segment = VideoGeneration.objects.create(
+                **{**fields, 'name': title, 'script_input': piece},
+                talk_id=placeholder_talk_id(),
+                status='queued',
+                config=dict(config),
+                segment_of=parent,
+                segment_index=index,
+            )
+            items.append((segment, segment_payload(job_payload, piece, title)))
+        enqueue_many(items, requested_provider, candidates, priority, cost=1.0 / count)
+    return parent
+
+
+def _cancel_queued_segments(parent_id):
+    """Drop the jobs of segments not handed to a provider yet; their video can't be completed anyway."""
+    jobs = GenerationJob.objects.filter(video__segment_of_id=parent_id, state='queued')
+    video_ids = list(jobs.values_list('video_id', flat=True))
+    jobs.update(state='failed', last_error='Another segment failed')
+    VideoGeneration.objects.filter(pk__in=video_ids).update(status='error', modified_at=timezone.now())
+
+
+def roll_up(parent_id):
+    """
+    Update a segmented video from its segments' statuses.
+
+    Call whenever a segment's status changes. Once all segments are done the
+    video moves to 'stitching' and is stitched.
+    """
+    with transaction.atomic():
+        parent = VideoGeneration.objects.select_for_update().filter(pk=parent_id).first()
+        if parent is None or parent.status in TERMINAL_STATUSES or parent.status == 'stitching':
+            return parent
+        rows = list(VideoGeneration.objects.filter(segment_of_id=parent_id).values_list('status', 'result_url'))
+        config = dict(parent.config or {})
+        done = sum(1 for segment_status, result_url in rows if segment_status == 'done' and result_url)
+        failed = sum(1 for segment_status, _ in rows if segment_status in TERMINAL_STATUSES - {'done'})
+
+        if failed:
+            new_status = 'error'
+            config['segment_error'] = f'{failed} of {len(rows)} segments failed'
+        elif rows and done == len(rows):
+            new_status = 'stitching'
+            config['stitch'] = {'attempts': 0}
+        elif any(segment_status != 'queued' for segment_status, _ in rows):
+            new_status = 'processing'
+        else:
+            new_status = 'queued'
+        if new_status == parent.status and config.get('segments_done') == done:
+            return parent
+
+        old_status = parent.status
+        config['segments_done'] = done
+        now = timezone.now().isoformat()
+        if new_status == 'error':
+            config.setdefault('finished_at', now)
+        elif new_status != 'queued':
+            config.setdefault('started_at', now)
+        parent.status = new_status
+        parent.config = config
+        parent.save()
+        if new_status == 'error':
+            _cancel_queued_segments(parent_id)
+    logger.info('Segmented video %s: %s -> %s (%s/%s segments done)', parent_id, old_status, new_status, done, len(rows))
+    if new_status == 'stitching' and settings.SEGMENT_STITCH_IN_PROCESS:
+        transaction.on_commit(stitch_soon)
+    return parent
+
+
+def _stitch_due(parent, now):
+    stitch = (parent.config or {}).get('stitch') or {}
+    if stitch.get('started_at'):
+        # Unless its worker died
+        timeout = timedelta(seconds=settings.SEGMENT_STITCH_TIMEOUT_SECONDS)
+        return datetime.fromisoformat(stitch['started_at']) < now - timeout
+    return not stitch.get('not_before') or datetime.fromisoformat(stitch['not_before']) <= now
+
+
+def refresh_segmented(video):
+    """Refresh a segmented video's segments from their providers and roll them up (see refresh_video_status)."""
+    if video.status == 'stitching':
+        if settings.SEGMENT_STITCH_IN_PROCESS and _stitch_due(video, timezone.now()):
+            stitch_soon()
+        return video
+    refresh_video_statuses(list(video.segments.select_related('user')))
+    roll_up(video.pk)
+    video.refresh_from_db()
+    return video
+
+
+def _download(url, path):
+    with requests.get(url, stream=True, timeout=60) as response:
+        response.raise_for_status()
+        with open(path, 'wb') as f:
+            for chunk in response.iter_content(chunk_size=DOWNLOAD_CHUNK_SIZE):
+                f.write(chunk)
+
+
+def _ffmpeg(args):
+    try:
+        result = subprocess.run(
+            [settings.FFMPEG_BINARY, '-hide_banner', '-loglevel', 'error', '-y', *args],
+            capture_output=True, text=True, timeout=settings.SEGMENT_STITCH_TIMEOUT_SECONDS
+        )
+    except FileNotFoundError:
+        raise StitchError(f'{settings.FFMPEG_BINARY} not found')
+    except subprocess.TimeoutExpired:
+        raise StitchError('ffmpeg timed out')
+    if result.returncode != 0:
+        raise StitchError(result.stderr.strip()[-500:] or f'ffmpeg exited with status {result.returncode}')
+
+
+def concat_clips(paths, output):
+    """
+    Join MP4 clips into one with ffmpeg's concat demuxer.
+
+    Returns:
+        'copy' if the streams were copied as they are, 'reencode' if the
+        clips didn't fit together and had to be re-encoded
+    """
+    list_path = f'{output}.txt'
+    with open(list_path, 'w') as f:
+        for path in paths:
+            escaped = path.replace("'", "'\\''")
+            f.write(f"file '{escaped}'\n")
+    inputs = ['-f', 'concat', '-safe', '0', '-i', list_path]
+    try:
+        _ffmpeg([*inputs, '-c', 'copy', '-movflags', '+faststart', output])
+        return 'copy'
+    except StitchError as e:
+        logger.info('Stream copy of %s clips failed, re-encoding: %s', len(paths), e)
+    _ffmpeg([
+        *inputs, '-c:v', 'libx264', '-preset', 'veryfast', '-crf', '20',
+        '-c:a', 'aac', '-b:a', '128k', '-movflags', '+faststart', output
+    ])
+    return 'reencode'
+
+
+def stitch(parent):
+    """
+    Download a segmented video's finished segments and join them into one MP4 in GCS.
+
+    Returns:
+        (public URL, blob name, 'copy' or 'reencode')
+    """
+    urls = list(parent.segments.order_by('segment_index').values_list('result_url', flat=True))
+    if not urls or len(urls) != (parent.config or {}).get('segments') or not all(urls):
+        raise StitchError('Not every segment has a result')
+    blob_name = generate_unique_blob_name('videos', f'{parent.name}_{parent.talk_id}.mp4')
+    with tempfile.TemporaryDirectory(prefix='stitch-') as workdir:
+        paths = [os.path.join(workdir, f'segment-{index:03d}.mp4') for index in range(len(urls))]
+        with ThreadPoolExecutor(max_workers=len(urls)) as executor:
+            list(executor.map(_download, urls, paths))
+        output = os.path.join(workdir, 'stitched.mp4')
+        mode = concat_clips(paths, output)
+        url = upload_file_to_gcp(output, blob_name)
+    return url, blob_name, mode
+
+
+def _claim_next():
+    """Mark the next segmented video due for stitching as started and return it, or None."""
+    now = timezone.now()
+    with transaction.atomic():
+        parents = VideoGeneration.objects.select_for_update().filter(
+            status='stitching', talk_id__startswith=SEGMENTED_TALK_ID_PREFIX
+        ).order_by('modified_at')
+        for parent in parents:
+            if not _stitch_due(parent, now):
+                continue
+            stitch_state = parent.config.get('stitch') or {}
+            parent.config = {**parent.config, 'stitch': {
+                **stitch_state,
+                'attempts': stitch_state.get('attempts', 0) + 1,
+                'started_at': now.isoformat(),
+                'not_before': None,
+            }}
+            parent.save(update_fields=['config', 'modified_at'])
+            return parent
+    return None
+
+
+def _finish(parent, result_url, blob_name, mode):
+    with transaction.atomic():
+        current = VideoGeneration.objects.select_for_update().filter(pk=parent.pk, status='stitching').first()
+        if current is not None:
+            current.status = 'done'
+            current.result_url = result_url
+            current.config = {
+                **current.config,
+                'stitch': {**current.config.get('stitch', {}), 'started_at': None, 'mode': mode},
+                'finished_at': timezone.now().isoformat(),
+            }
+            current.save()
+    if current is None:
+        # Deleted meanwhile
+        try:
+            init_gcp_client().bucket(settings.GCP_BUCKET_NAME).blob(blob_name).delete()
+        except Exception as e:
+            logger.warning('Could not delete unused stitch %s: %s', blob_name, e)
+        return
+    logger.info('Stitched video %s from %s segments (%s) as %s', parent.pk, current.config['segments'], mode, blob_name)
+    if current.is_public:
+        invalidate_feed()
+
+
+def _retry_or_fail(parent, error):
+    with transaction.atomic():
+        current = VideoGeneration.objects.select_for_update().filter(pk=parent.pk, status='stitching').first()
+        if current is None:
+            return 'failed'
+        stitch_state = {**current.config.get('stitch', {}), 'started_at': None, 'error': error}
+        attempts = stitch_state.get('attempts', 0)
+        if attempts >= settings.SEGMENT_STITCH_MAX_ATTEMPTS:
+            logger.error('Giving up stitching video %s after %s attempts: %s', parent.pk, attempts, error)
+            current.status = 'error'
+            current.config = {
+                **current.config, 'stitch': stitch_state,
+                'stitch_error': error, 'finished_at': timezone.now().isoformat(),
+            }
+            current.save()
+            return 'failed'
+        delay = settings.SEGMENT_STITCH_RETRY_SECONDS * attempts
+        stitch_state['not_before'] = (timezone.now() + timedelta(seconds=delay)).isoformat()
+        current.config = {**current.config, 'stitch': stitch_state}
+        current.save(update_fields=['config', 'modified_at'])
+    logger.warning('Stitching video %s failed (attempt %s), retrying in %ss: %s', parent.pk, attempts, delay, error)
+    return 'retry'
+
+
+def run_stitch(parent):
+    """
+    Stitch one claimed segmented video.
+
+    Returns:
+        'done', 'retry' or 'failed'
+    """
+    try:
+        result_url, blob_name, mode = stitch(parent)
+    except Exception as e:
+        return _retry_or_fail(parent, f'{type(e).__name__}: {e}')
+    _finish(parent, result_url, blob_name, mode)
+    return 'done'
+
+
+def process_stitches(max_videos=None):
+    """
+    Stitch segmented videos whose segments are all done, one at a time.
+
+    Returns:
+        {'done': n, 'retry': n, 'failed': n}
+    """
+    totals = {'done': 0, 'retry': 0, 'failed': 0}
+    while max_videos is None or sum(totals.values()) < max_videos:
+        parent = _claim_next()
+        if parent is None:
+            break
+        totals[run_stitch(parent)] += 1
+    return totals
+
+
+def _seconds_until_next_stitch():
+    """Seconds until a stitch retry is due, or None if none is waiting."""
+    now = timezone.now()
+    waiting = [
+        datetime.fromisoformat(config['stitch']['not_before'])
+        for config in VideoGeneration.objects.filter(
+            status='stitching', talk_id__startswith=SEGMENTED_TALK_ID_PREFIX
+        ).values_list('config', flat=True)
+        if (config.get('stitch') or {}).get('not_before')
+    ]
+    if not waiting:
+        return None
+    return max((min(waiting) - now).total_seconds(), 1.0)
+
+
+_stitch_state = threading.Lock()
+_stitch_wakeup = threading.Event()
+_stitch_running = False
+
+
+def stitch_soon():
+    """Make sure the background stitcher of this process is running and awake."""
+    global _stitch_running
+    with _stitch_state:
+        _stitch_wakeup.set()
+        if _stitch_running:
+            return
+        _stitch_running = True
+    threading.Thread(target=_stitch_in_background, daemon=True).start()
+
+
+def _stitch_in_background():
+    """Stitch videos as their segments finish, sleeping until retries are due; exits when none are left."""
+    global _stitch_running
+    try:
+        while True:
+            _stitch_wakeup.clear()
+            try:
+                process_stitches()
+                delay = _seconds_until_next_stitch()
+            except Exception as e:
+                logger.exception('Error stitching segmented videos: %s', e)
+                delay = settings.SEGMENT_STITCH_RETRY_SECONDS
+            with _stitch_state:
+                if delay is None and not _stitch_wakeup.is_set():
+                    _stitch_running = False
+                    return
+            # Don't hold a connection while idle
+            connections.close_all()
+            _stitch_wakeup.wait(delay)
+    finally:
+        connections.close_all()
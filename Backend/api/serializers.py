@@ -1,6 +1,6 @@
 from django.contrib.auth import get_user_model
 from rest_framework import serializers
-from .models import VideoGeneration, Profile, PasswordResetOTP, VideoLike, VideoView
+from .models import VideoGeneration, GenerationBatch, GenerationPipeline, Profile, PasswordResetOTP, VideoLike, VideoView
 
 User = get_user_model()
 
@@ -49,18 +49,60 @@ class ProfileSerializer(serializers.ModelSerializer):
         return super().update(instance, validated_data)
 
 
-class VideoGenerationSerializer(serializers.ModelSerializer):
-    likes_count = serializers.SerializerMethodField()
+def requested_fields(request):
+    """
+    Parse the ?fields=a,b,c sparse fieldset parameter.
+
+    Returns:
+        Set of requested field names (always including 'id'), or None for all fields
+    """
+    if request is None:
+        return None
+    raw = request.GET.get('fields', '')
+    fields = {name.strip() for name in raw.split(',') if name.strip()}
+    if not fields:
+        return None
+    return fields | {'id'}
+
+
+def select_fields(items, request):
+    """Apply ?fields= to already-serialized dicts (e.g. cached feed pages)."""
+    fields = requested_fields(request)
+    if not fields:
+        return items
+    return [{name: value for name, value in item.items() if name in fields} for item in items]
+
+
+class SparseFieldsetMixin:
+    """Drop the fields the client did not ask for with ?fields=."""
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        fields = requested_fields(self.context.get('request'))
+        if fields:
+            for name in set(self.fields) - fields:
+                self.fields.pop(name)
+
+
+def get_user_info(user):
+    return {
+        'id': user.id,
+        'username': user.username,
+        'email': user.email
+    }
+
+
+class VideoGenerationSerializer(SparseFieldsetMixin, serializers.ModelSerializer):
     is_liked = serializers.SerializerMethodField()
     user_info = serializers.SerializerMethodField()
 
     class Meta:
         model = VideoGeneration
         fields = '__all__'
-        read_only_fields = ('user', 'talk_id', 'created_at', 'modified_at', 'views_count')
-
-    def get_likes_count(self, obj):
-        return obj.likes.count()
+        read_only_fields = (
+            'user', 'talk_id', 'created_at', 'modified_at', 'views_count', 'likes_count', 'fingerprint',
+            'is_draft', 'parent', 'segment_of', 'segment_index',
+        )
 
     def get_is_liked(self, obj):
         request = self.context.get('request')
@@ -69,12 +111,88 @@ class VideoGenerationSerializer(serializers.ModelSerializer):
         return False
 
     def get_user_info(self, obj):
+        return get_user_info(obj.user)
+
+
+class VideoGenerationListSerializer(SparseFieldsetMixin, serializers.ModelSerializer):
+    """
+    Compact representation for list endpoints (project list, feed, search).
+
+    Leaves out the heavy JSON columns (config holds the whole provider payload,
+    metadata) and the provider-specific layout columns; fetch a single video
+    for those. Feeds merge the per-viewer is_liked flag in separately.
+    """
+    user_info = serializers.SerializerMethodField()
+
+    class Meta:
+        model = VideoGeneration
+        fields = (
+            'id', 'name', 'platform', 'status', 'talk_id', 'source_url', 'result_url',
+            'script_input', 'input_type', 'voice_provider', 'voice_id', 'voice_name',
+            'is_public', 'is_draft', 'parent', 'views_count', 'likes_count', 'user_info', 'created_at',
+            'modified_at',
+        )
+        read_only_fields = fields
+
+    def get_user_info(self, obj):
+        return get_user_info(obj.user)
+
+
+class GenerationBatchSerializer(serializers.ModelSerializer):
+    """
+    A batch with its aggregate progress.
+
+    Expects a queryset annotated by batches.with_progress(); videos that were
+    deleted since the batch was created drop out of the counts.
+    """
+    counts = serializers.SerializerMethodField()
+    progress = serializers.SerializerMethodField()
+    state = serializers.SerializerMethodField()
+
+    class Meta:
+        model = GenerationBatch
+        fields = ('id', 'name', 'source_url', 'priority', 'total', 'config', 'counts', 'progress', 'state', 'created_at')
+        read_only_fields = fields
+
+    def get_counts(self, obj):
         return {
-            'id': obj.user.id,
-            'username': obj.user.username,
-            'email': obj.user.email
+            'queued': obj.queued_count,
+            'in_progress': obj.video_count - obj.queued_count - obj.done_count - obj.failed_count,
+            'done': obj.done_count,
+            'failed': obj.failed_count,
         }
 
+    def get_progress(self, obj):
+        """Share of the batch's videos that have finished, successfully or not."""
+        if not obj.video_count:
+            return 1.0
+        return round((obj.done_count + obj.failed_count) / obj.video_count, 4)
+
+    def get_state(self, obj):
+        if obj.done_count + obj.failed_count < obj.video_count:
+            return 'queued' if obj.queued_count == obj.video_count else 'running'
+        return 'completed_with_errors' if obj.failed_count else 'completed'
+
+
+class GenerationPipelineSerializer(serializers.ModelSerializer):
+    """Progress of a HeyGen video creation; stage outputs themselves stay server-side."""
+    completed_stages = serializers.SerializerMethodField()
+
+    class Meta:
+        model = GenerationPipeline
+        fields = ('id', 'state', 'completed_stages', 'failed_stage', 'error', 'runs', 'video', 'created_at', 'updated_at')
+        read_only_fields = fields
+
+    def get_completed_stages(self, obj):
+        return list(obj.checkpoints)
+
+
+# Columns to load for VideoGenerationListSerializer, e.g.
+# VideoGeneration.objects.select_related('user').only(*VIDEO_LIST_ONLY_FIELDS)
+VIDEO_LIST_ONLY_FIELDS = [
+    name for name in VideoGenerationListSerializer.Meta.fields if name != 'user_info'
+] + ['user', 'user__id', 'user__username', 'user__email']
+
 
 class PasswordResetRequestSerializer(serializers.Serializer):
     email = serializers.EmailField()
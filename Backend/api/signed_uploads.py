@@ -0,0 +1,192 @@
+"""
+Uploads that go from the client straight to GCS, bypassing the app servers.
+
+1. POST /api/uploads/ declares the file (kind, name, type, size and MD5).
+   The server picks the blob name and answers with either a V4 signed PUT
+   URL or, for big files, a resumable session URI. Both are scoped to that
+   one object. GCS itself enforces the declared Content-Type and MD5 (signed
+   URL) or size (resumable session).
+2. The client uploads the bytes to GCS.
+3. POST /api/uploads/{id}/finalize/ checks the stored object's size, type
+   (metadata and the file's leading magic bytes) and MD5, which for a
+   resumable session is the only check of the content. A good upload is
+   marked 'ready', and a bad one is deleted.
+
+The create endpoints then take the asset id (image_asset, avatar_asset,
+background_asset, audio_asset) in place of the file.
+"""
+import base64
+import binascii
+import logging
+from datetime import timedelta
+
+from django.conf import settings
+from django.utils import timezone
+
+from .gcp_storage import generate_unique_blob_name, init_gcp_client, open_gcp_object
+from .models import UploadedAsset
+
+logger = logging.getLogger(__name__)
+
+# Per kind: bucket folder and accepted media type families. Audio must already
+# be MP3, since converting it would mean pulling the bytes back through a worker.
+ASSET_KINDS = {
+    'image': {'folder': 'images', 'families': ('image',)},
+    'background': {'folder': 'heygen/backgrounds/{user}', 'families': ('image', 'video')},
+    'audio': {'folder': 'audio', 'families': ('audio',), 'content_types': ('audio/mpeg', 'audio/mp3')},
+}
+
+# Bytes read from the start of an object to sniff its real type
+SNIFF_BYTES = 16
+
+
+class AssetError(ValueError):
+    """An upload request, finalize check or asset reference failed."""
+
+
+def sniff_family(head):
+    """'image', 'video' or 'audio' from a file's leading bytes, or None if unrecognised."""
+    if head.startswith((b'\x89PNG', b'\xff\xd8\xff', b'GIF8')) or (head[:4] == b'RIFF' and head[8:12] == b'WEBP'):
+        return 'image'
+    if head[4:8] == b'ftyp':
+        # M4A shares the MP4 container
+        return 'audio' if head[8:11] == b'M4A' else 'video'
+    if head.startswith(b'\x1aE\xdf\xa3'):
+        return 'video'
+    if head.startswith((b'ID3', b'OggS', b'fLaC')) or (head[:4] == b'RIFF' and head[8:12] == b'WAVE'):
+        return 'audio'
+    if len(head) > 1 and head[0] == 0xFF and head[1] & 0xE0 == 0xE0:
+        # MPEG audio frame sync
+        return 'audio'
+    return None
+
+
+def _blob(blob_name):
+    return init_gcp_client().bucket(settings.GCP_BUCKET_NAME).blob(blob_name)
+
+
+def _check_declaration(kind, content_type, size, md5):
+    spec = ASSET_KINDS.get(kind)
+    if spec is None:
+        raise AssetError(f"kind must be one of: {', '.join(ASSET_KINDS)}")
+    if content_type.split('/')[0] not in spec['families'] or (
+        'content_types' in spec and content_type not in spec['content_types']
+    ):
+        raise AssetError(f'content_type {content_type} is not accepted for {kind} uploads')
+    max_bytes = settings.UPLOAD_MAX_BYTES[kind]
+    if not 0 < size <= max_bytes:
+        raise AssetError(f'size must be between 1 and {max_bytes} bytes for {kind} uploads')
+    if not md5:
+        raise AssetError('md5 (the base64 encoded MD5 digest of the file) is required')
+    try:
+        if len(base64.b64decode(md5, validate=True)) != 16:
+            raise ValueError
+    except (binascii.Error, ValueError):
+        raise AssetError('md5 must be the base64 encoded MD5 digest')
+
+
+def create_upload(user, kind, filename, content_type, size, md5, resumable=False, origin=None):
+    """
+    Register a pending upload and authorize the client to write its object.
+
+    Returns:
+        (asset, {'upload_url', 'method', 'headers', 'expires_at'})
+    """
+    _check_declaration(kind, content_type, size, md5)
+    folder = ASSET_KINDS[kind]['folder'].format(user=user.id)
+    asset = UploadedAsset(
+        user=user, kind=kind, blob_name=generate_unique_blob_name(folder, filename),
+        filename=filename[:255], content_type=content_type, size=size, md5=md5,
+    )
+    blob = _blob(asset.blob_name)
+    expires_at = timezone.now() + timedelta(seconds=settings.UPLOAD_URL_EXPIRY_SECONDS)
+
+    if resumable:
+        # GCS rejects a session upload whose size differs from the declared one.
+        # The session URI itself is the credential, valid for a week.
+        upload_url = blob.create_resumable_upload_session(content_type=content_type, size=size, origin=origin)
+        instructions = {'method': 'PUT', 'headers': {'Content-Type': content_type}}
+    else:
+        upload_url = blob.generate_signed_url(
+            version='v4',
+            expiration=expires_at,
+            method='PUT',
+            content_type=content_type,
+            content_md5=md5,
+        )
+        instructions = {'method': 'PUT', 'headers': {'Content-Type': content_type, 'Content-MD5': md5}}
+
+    asset.save()
+    return asset, {'upload_url': upload_url, **instructions, 'expires_at': expires_at}
+
+
+def _reject(asset, blob, error):
+    asset.status = 'rejected'
+    asset.error = error
+    asset.finalized_at = timezone.now()
+    asset.save(update_fields=['status', 'error', 'finalized_at'])
+    try:
+        blob.delete()
+    except Exception as e:
+        logger.warning('Could not delete rejected upload %s: %s', asset.blob_name, e)
+    raise AssetError(error)
+
+
+def finalize_upload(asset):
+    """
+    Verify the uploaded object against the declaration and mark the asset ready.
+
+    Raises:
+        AssetError: if the object is missing (asset stays pending, the client
+            may still upload) or doesn't match (asset rejected, object deleted)
+    """
+    if asset.status == 'ready':
+        return asset
+    if asset.status == 'rejected':
+        raise AssetError(asset.error)
+
+    blob = _blob(asset.blob_name)
+    if not blob.exists():
+        raise AssetError('Object has not been uploaded yet')
+    blob.reload()
+
+    if blob.size != asset.size:
+        _reject(asset, blob, f'Uploaded {blob.size} bytes, expected {asset.size}')
+    if (blob.content_type or '').split(';')[0] != asset.content_type:
+        _reject(asset, blob, f'Uploaded as {blob.content_type}, expected {asset.content_type}')
+    if blob.md5_hash != asset.md5:
+        _reject(asset, blob, 'MD5 of the uploaded object does not match')
+    family = sniff_family(blob.download_as_bytes(start=0, end=SNIFF_BYTES - 1))
+    if family not in ASSET_KINDS[asset.kind]['families']:
+        _reject(asset, blob, f'File content is not a valid {asset.kind}')
+
+    asset.status = 'ready'
+    asset.finalized_at = timezone.now()
+    asset.save(update_fields=['status', 'finalized_at'])
+    return asset
+
+
+def get_asset(user, asset_id, kind):
+    """
+    A finalized asset of the user, for a create endpoint.
+
+    Views take it wherever they take an uploaded file: store_upload() and
+    the render fingerprints accept both.
+
+    Raises:
+        AssetError: if there is no such ready asset of this kind
+    """
+    try:
+        asset = UploadedAsset.objects.get(pk=int(asset_id), user=user)
+    except (TypeError, ValueError, UploadedAsset.DoesNotExist):
+        raise AssetError(f'Upload {asset_id} not found')
+    if asset.kind != kind:
+        raise AssetError(f'Upload {asset_id} is not a {kind} upload')
+    if asset.status != 'ready':
+        raise AssetError(f'Upload {asset_id} has not been finalized')
+    return asset
+
+
+def open_asset(asset):
+    """The asset's object as a sized, streaming file (e.g. a provider upload body)."""
+    return open_gcp_object(asset.blob_name, name=asset.filename, size=asset.size)
@@ -1,3 +1,1188 @@
-from django.test import TestCase
+import base64
+import hashlib
+import io
+import json
+import math
+import time
+import uuid
+from datetime import timedelta
+from unittest import mock
 
-# Create your tests here.
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.core.cache import cache
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.core.management import call_command
+from django.test import SimpleTestCase, TestCase, override_settings
+from django.utils import timezone
+from rest_framework.decorators import api_view, permission_classes
+from rest_framework.permissions import IsAuthenticated
+from rest_framework.response import Response
+from rest_framework.test import APIClient, APIRequestFactory, force_authenticate
+
+from .batches import ManifestError, expand_rows, read_manifest
+from .counters import ViewCountBuffer
+from .feed_cache import COUNTS_BUMP_KEY, get_feed_page, get_feed_version, invalidate_feed
+from .gcp_storage import parallel_download_and_upload_to_gcp
+from .idempotency import idempotent
+from .models import (
+    GenerationJob, GenerationPipeline, IdempotencyKey, PasswordResetOTP, RehostTask, VideoGeneration, VideoLike,
+    VideoTrendingScore, VideoView,
+)
+from .pagination import InvalidCursor, decode_cursor, encode_cursor, keyset_paginate
+from .pipelines import claim_pipeline, draft_script, reusable_checkpoints, run_stages, start_pipeline
+from .rate_limits import (
+    RateLimited, _release, _try_acquire, provider_slot, quota_name, report_rate_limited,
+)
+from .rehosting import _claim_next as claim_rehost_task, run_task, schedule_rehost
+from .render_cache import clone_render, did_fingerprint, file_sha256, find_cached_render
+from .routing import compute_provider_stats, rank_providers, record_failure
+from .scheduler import (
+    _claim_next, dispatch_jobs, enqueue_many, placeholder_talk_id, seconds_until_next_dispatch,
+)
+from .search import get_search_backend
+from .segments import create_segmented_video, roll_up, split_script
+from .signed_uploads import AssetError, create_upload, finalize_upload, get_asset, sniff_family
+from .trending import log_add, update_trending_scores
+from .uploads import StreamedUploadedFile, store_upload, streaming_uploads
+from .video_status import refresh_video_status
+
+
+def make_video(user, **fields):
+    values = {
+        'name': 'video',
+        'source_url': 'https://example.com/avatar.png',
+        'talk_id': f'tlk_{uuid.uuid4().hex}',
+        'status': 'done',
+        'result_url': 'https://example.com/video.mp4',
+    }
+    values.update(fields)
+    return VideoGeneration.objects.create(user=user, **values)
+
+
+class FakeBucket:
+    """In-memory stand-in for a GCS bucket: objects are name -> (bytes, content type)."""
+
+    def __init__(self):
+        self.objects = {}
+        # Names whose compose() fails
+        self.failing = set()
+
+    def blob(self, name):
+        return FakeBlob(self, name)
+
+    def delete_blobs(self, blobs, on_error=None):
+        for blob in blobs:
+            if self.objects.pop(blob.name, None) is None and on_error:
+                on_error(blob)
+
+
+class FakeBlob:
+    def __init__(self, bucket, name):
+        self.bucket = bucket
+        self.name = name
+        self.content_type = None
+
+    def open(self, mode, content_type=None, **kwargs):
+        if 'r' in mode:
+            return io.BytesIO(self.bucket.objects[self.name][0])
+        blob = self
+
+        class Writer(io.BytesIO):
+            def close(self):
+                blob.bucket.objects[blob.name] = (self.getvalue(), content_type)
+                super().close()
+
+        return Writer()
+
+    def exists(self):
+        return self.name in self.bucket.objects
+
+    def reload(self):
+        self.content_type = self.bucket.objects[self.name][1]
+
+    @property
+    def size(self):
+        return len(self.bucket.objects[self.name][0])
+
+    @property
+    def md5_hash(self):
+        return base64.b64encode(hashlib.md5(self.bucket.objects[self.name][0]).digest()).decode()
+
+    def download_as_bytes(self, start=0, end=None):
+        data = self.bucket.objects[self.name][0]
+        return data[start:None if end is None else end + 1]
+
+    def generate_signed_url(self, **kwargs):
+        return f'https://storage.googleapis.com/signed/{self.name}'
+
+    def create_resumable_upload_session(self, **kwargs):
+        return f'https://storage.googleapis.com/session/{self.name}'
+
+    def compose(self, sources):
+        if self.name in self.bucket.failing:
+            raise IOError(f'compose of {self.name} failed')
+        data = b''.join(self.bucket.objects[source.name][0] for source in sources)
+        self.bucket.objects[self.name] = (data, self.content_type)
+
+    def delete(self):
+        del self.bucket.objects[self.name]
+
+
+def fake_gcs(test):
+    """Point the GCS helpers at an in-memory bucket for the rest of the test."""
+    bucket = FakeBucket()
+    client = mock.Mock()
+    client.bucket.return_value = bucket
+    for module in ('gcp_storage', 'rehosting', 'signed_uploads', 'uploads'):
+        target = f'api.{module}.init_gcp_client'
+        patcher = mock.patch(target, return_value=client)
+        patcher.start()
+        test.addCleanup(patcher.stop)
+    return bucket
+
+
+class APITestBase(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.user = User.objects.create_user('alice', 'alice@example.com', 'password123')
+        self.other = User.objects.create_user('bob', 'bob@example.com', 'password123')
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+
+
+class KeysetPaginationTests(APITestBase):
+    def test_cursor_round_trip(self):
+        now = timezone.now()
+        cursor = encode_cursor([now, 42])
+        self.assertEqual(decode_cursor(cursor, VideoGeneration, ('created_at', 'id')), [now, 42])
+
+    def test_malformed_cursor(self):
+        with self.assertRaises(InvalidCursor):
+            decode_cursor('not-a-cursor', VideoGeneration, ('created_at', 'id'))
+        with self.assertRaises(InvalidCursor):
+            decode_cursor(encode_cursor([1]), VideoGeneration, ('created_at', 'id'))
+
+    def test_pages_cover_every_row_once(self):
+        created_at = timezone.now()
+        videos = [make_video(self.user, is_public=True) for _ in range(7)]
+        # Ties on created_at are broken by id
+        VideoGeneration.objects.update(created_at=created_at)
+        seen, cursor = [], None
+        while True:
+            page = keyset_paginate(VideoGeneration.objects.all(), ('created_at', 'id'), cursor, page_size=3)
+            seen += [video.id for video in page['results']]
+            if not page['has_next']:
+                break
+            cursor = page['next_cursor']
+        self.assertEqual(seen, sorted((video.id for video in videos), reverse=True))
+
+    def test_feed_follows_next_cursor(self):
+        for _ in range(5):
+            make_video(self.other, is_public=True)
+        make_video(self.other, is_public=False)
+        first = self.client.get('/api/social/videos/?page_size=3')
+        self.assertEqual(first.status_code, 200)
+        self.assertTrue(first.data['has_next'])
+        second = self.client.get(f"/api/social/videos/?page_size=3&cursor={first.data['next_cursor']}")
+        self.assertFalse(second.data['has_next'])
+        ids = [item['id'] for item in first.data['results'] + second.data['results']]
+        self.assertEqual(len(ids), 5)
+        self.assertEqual(len(set(ids)), 5)
+
+    def test_feed_rejects_bad_cursor(self):
+        response = self.client.get('/api/social/videos/?cursor=garbage')
+        self.assertEqual(response.status_code, 400)
+
+
+class PasswordResetOTPLookupTests(APITestBase):
+    def verify(self, otp):
+        return self.client.post('/api/auth/password-reset/verify/', {
+            'email': 'alice@example.com', 'otp': otp, 'new_password': 'new-password-123',
+        })
+
+    def test_newest_unused_code_wins(self):
+        PasswordResetOTP.objects.create(
+            email='alice@example.com', otp='123456', expires_at=timezone.now() - timedelta(minutes=1)
+        )
+        PasswordResetOTP.objects.create(email='alice@example.com', otp='123456')
+        response = self.verify('123456')
+        self.assertEqual(response.status_code, 200)
+        self.user.refresh_from_db()
+        self.assertTrue(self.user.check_password('new-password-123'))
+
+    def test_used_code_is_rejected(self):
+        PasswordResetOTP.objects.create(email='alice@example.com', otp='654321', is_used=True)
+        response = self.verify('654321')
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(response.data['detail'], 'Invalid OTP.')
+
+
+class FeedCacheTests(APITestBase):
+    def test_page_is_built_once_until_invalidated(self):
+        builds = []
+
+        def build():
+            builds.append(1)
+            return {'page': len(builds)}
+
+        self.assertEqual(get_feed_page(('recent', '', 10), build), {'page': 1})
+        self.assertEqual(get_feed_page(('recent', '', 10), build), {'page': 1})
+        invalidate_feed()
+        self.assertEqual(get_feed_page(('recent', '', 10), build), {'page': 2})
+
+    def test_count_changes_bump_the_version_once_per_fresh_period(self):
+        version = get_feed_version()
+        invalidate_feed(counts_only=True)
+        invalidate_feed(counts_only=True)
+        self.assertEqual(get_feed_version(), version + 1)
+        # Publishing and finished renders still invalidate right away
+        invalidate_feed()
+        self.assertEqual(get_feed_version(), version + 2)
+        cache.delete(COUNTS_BUMP_KEY)
+        invalidate_feed(counts_only=True)
+        self.assertEqual(get_feed_version(), version + 3)
+
+    def test_publishing_invalidates_the_feed(self):
+        video = make_video(self.user, is_public=False)
+        self.assertEqual(self.client.get('/api/social/videos/').data['results'], [])
+        response = self.client.post(f'/api/videos/{video.id}/publish/')
+        self.assertEqual(response.status_code, 200)
+        results = self.client.get('/api/social/videos/').data['results']
+        self.assertEqual([item['id'] for item in results], [video.id])
+
+
+class ViewCountBufferTests(APITestBase):
+    def test_flush_applies_buffered_views(self):
+        video = make_video(self.user)
+        buffer = ViewCountBuffer(flush_seconds=3600, flush_threshold=1000)
+        buffer.record(video.id)
+        buffer.record(video.id, 2)
+        self.assertEqual(buffer.pending(video.id), 3)
+        self.assertEqual(buffer.flush(), 1)
+        self.assertEqual(buffer.pending(video.id), 0)
+        video.refresh_from_db()
+        self.assertEqual(video.views_count, 3)
+
+    def test_quiet_buffer_flushes_on_timer(self):
+        buffer = ViewCountBuffer(flush_seconds=0.01, flush_threshold=1000)
+        flushed = []
+
+        def flush():
+            with buffer._lock:
+                flushed.append(dict(buffer._pending))
+                buffer._pending.clear()
+                buffer._pending_total = 0
+                buffer._last_flush = time.monotonic()
+
+        buffer.flush = flush
+        buffer.record(42)
+        deadline = time.monotonic() + 5
+        while buffer._timer_running and time.monotonic() < deadline:
+            time.sleep(0.01)
+        self.assertEqual(flushed, [{42: 1}])
+        self.assertFalse(buffer._timer_running)
+
+    def test_repeat_view_is_not_counted(self):
+        video = make_video(self.other, is_public=True)
+        # A buffer of its own: the shared one's timer would flush into later tests
+        buffer = ViewCountBuffer(flush_seconds=3600, flush_threshold=10 ** 6)
+        with mock.patch('api.counters.view_counts', buffer):
+            first = self.client.post(f'/api/social/videos/{video.id}/view/')
+            second = self.client.post(f'/api/social/videos/{video.id}/view/')
+        self.assertTrue(first.data['is_new_view'])
+        self.assertFalse(second.data['is_new_view'])
+        self.assertEqual(buffer.pending(video.id), 1)
+        self.assertEqual(second.data['views_count'], 1)
+        self.assertEqual(VideoView.objects.filter(video=video).count(), 1)
+
+
+class LikeCountTests(APITestBase):
+    def test_like_and_unlike_update_the_count(self):
+        video = make_video(self.other, is_public=True)
+        self.assertTrue(self.client.post(f'/api/social/videos/{video.id}/like/').data['is_liked'])
+        video.refresh_from_db()
+        self.assertEqual(video.likes_count, 1)
+        self.assertFalse(self.client.post(f'/api/social/videos/{video.id}/like/').data['is_liked'])
+        video.refresh_from_db()
+        self.assertEqual(video.likes_count, 0)
+
+    def test_reconcile_repairs_drift(self):
+        video = make_video(self.other, is_public=True)
+        VideoLike.objects.create(user=self.user, video=video)
+        VideoGeneration.objects.filter(pk=video.pk).update(likes_count=5)
+        call_command('reconcile_counts', stdout=io.StringIO())
+        video.refresh_from_db()
+        self.assertEqual(video.likes_count, 1)
+
+
+class TrendingScoreTests(APITestBase):
+    def test_log_add(self):
+        self.assertAlmostEqual(log_add(math.log(2), math.log(3)), math.log(5))
+        self.assertEqual(log_add(-math.inf, 1.5), 1.5)
+
+    def test_incremental_update_matches_full_recompute(self):
+        liked = make_video(self.other, is_public=True)
+        make_video(self.other, is_public=True)
+        update_trending_scores()
+        VideoLike.objects.create(user=self.user, video=liked)
+        self.assertEqual(update_trending_scores(), 1)
+        incremental = dict(VideoTrendingScore.objects.values_list('video_id', 'score'))
+        update_trending_scores(full=True)
+        full = dict(VideoTrendingScore.objects.values_list('video_id', 'score'))
+        self.assertEqual(incremental.keys(), full.keys())
+        for video_id, score in full.items():
+            self.assertAlmostEqual(incremental[video_id], score)
+
+    def test_trending_feed_ranks_by_score(self):
+        liked = make_video(self.other, is_public=True)
+        make_video(self.other, is_public=True)
+        VideoLike.objects.create(user=self.user, video=liked)
+        update_trending_scores()
+        results = self.client.get('/api/social/videos/?sort=trending').data['results']
+        self.assertEqual(len(results), 2)
+        self.assertEqual(results[0]['id'], liked.id)
+
+
+class SearchTests(APITestBase):
+    def test_matches_name_and_script_of_own_videos(self):
+        by_name = make_video(self.user, name='Quarterly report')
+        by_script = make_video(self.user, script_input='Here is the quarterly outlook')
+        make_video(self.user, name='Holiday greetings')
+        make_video(self.other, name='Quarterly report')
+        response = self.client.get('/api/videos/search/?q=quarterly')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual({item['id'] for item in response.data['results']}, {by_name.id, by_script.id})
+
+    def test_index_follows_updates(self):
+        video = make_video(self.user, name='Draft title')
+        VideoGeneration.objects.filter(pk=video.pk).update(name='Launch announcement')
+        page = get_search_backend().search('launch', user=self.user)
+        self.assertEqual([result.id for result in page['results']], [video.id])
+        self.assertEqual(get_search_backend().search('draft', user=self.user)['results'], [])
+
+    def test_pages_with_tied_scores_cover_every_match_once(self):
+        videos = [make_video(self.user, name='Product demo') for _ in range(5)]
+        seen, cursor = [], None
+        while True:
+            page = get_search_backend().search('demo', user=self.user, cursor=cursor, page_size=2)
+            seen += [result.id for result in page['results']]
+            if not page['has_next']:
+                break
+            cursor = page['next_cursor']
+        self.assertEqual(seen, sorted((video.id for video in videos), reverse=True))
+
+
+class SparseFieldsetTests(APITestBase):
+    def test_list_leaves_out_heavy_columns(self):
+        make_video(self.user, config={'talk_payload': {'script': 'x' * 1000}})
+        item = self.client.get('/api/videos/').data['results'][0]
+        self.assertNotIn('config', item)
+        self.assertNotIn('metadata', item)
+
+    def test_fields_selects_a_subset(self):
+        video = make_video(self.user)
+        response = self.client.get(f'/api/videos/{video.id}/?fields=id,status')
+        self.assertEqual(response.data, {'id': video.id, 'status': 'done'})
+        list_item = self.client.get('/api/videos/?fields=id,name').data['results'][0]
+        self.assertEqual(set(list_item), {'id', 'name'})
+
+    def test_feed_applies_fields_to_cached_pages(self):
+        make_video(self.other, is_public=True)
+        self.client.get('/api/social/videos/')
+        item = self.client.get('/api/social/videos/?fields=id,is_liked').data['results'][0]
+        self.assertEqual(set(item), {'id', 'is_liked'})
+
+
+class VideoListTests(APITestBase):
+    def test_list_is_paginated(self):
+        for _ in range(3):
+            make_video(self.user)
+        make_video(self.other)
+        first = self.client.get('/api/videos/?page_size=2')
+        self.assertEqual(len(first.data['results']), 2)
+        self.assertTrue(first.data['has_next'])
+        second = self.client.get(f"/api/videos/?page_size=2&cursor={first.data['next_cursor']}")
+        self.assertEqual(len(second.data['results']), 1)
+        self.assertFalse(second.data['has_next'])
+
+    def test_stream_returns_the_whole_list(self):
+        videos = [make_video(self.user) for _ in range(3)]
+        response = self.client.get('/api/videos/?stream=true&fields=id')
+        items = json.loads(b''.join(response.streaming_content))
+        self.assertEqual(items, [{'id': video.id} for video in reversed(videos)])
+
+    def test_stats(self):
+        make_video(self.user, views_count=4, likes_count=1)
+        make_video(self.user, views_count=6)
+        make_video(self.other, views_count=100)
+        response = self.client.get('/api/videos/stats/')
+        self.assertEqual(response.data, {'videos_count': 2, 'views_count': 10, 'likes_count': 1})
+
+
+class ConditionalResponseTests(APITestBase):
+    def test_detail_revalidates_until_the_video_changes(self):
+        video = make_video(self.user)
+        etag = self.client.get(f'/api/videos/{video.id}/')['ETag']
+        self.assertEqual(self.client.get(f'/api/videos/{video.id}/', HTTP_IF_NONE_MATCH=etag).status_code, 304)
+        video.name = 'renamed'
+        video.save()
+        self.assertEqual(self.client.get(f'/api/videos/{video.id}/', HTTP_IF_NONE_MATCH=etag).status_code, 200)
+
+    def test_status_of_finished_video_is_checked_before_refreshing(self):
+        video = make_video(self.user)
+        etag = self.client.post(f'/api/videos/{video.id}/update/')['ETag']
+        with mock.patch('api.views.refresh_video_status') as refresh:
+            response = self.client.post(f'/api/videos/{video.id}/update/', HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 304)
+        refresh.assert_not_called()
+
+    def test_feed_revalidates(self):
+        make_video(self.other, is_public=True)
+        etag = self.client.get('/api/social/videos/')['ETag']
+        self.assertEqual(self.client.get('/api/social/videos/', HTTP_IF_NONE_MATCH=etag).status_code, 304)
+        invalidate_feed()
+        self.assertEqual(self.client.get('/api/social/videos/', HTTP_IF_NONE_MATCH=etag).status_code, 200)
+
+
+@override_settings(SCHEDULER_DISPATCH_IN_PROCESS=False)
+class VideoStatusRefreshTests(APITestBase):
+    def test_terminal_video_is_not_refreshed(self):
+        video = make_video(self.user)
+        with mock.patch('api.video_status.fetch_provider_status') as fetch:
+            refresh_video_status(video)
+        fetch.assert_not_called()
+
+    def test_refresh_is_reused_for_a_while(self):
+        video = make_video(self.user, status='created', result_url=None)
+        with mock.patch('api.video_status.fetch_provider_status', return_value={'status': 'started'}) as fetch:
+            refresh_video_status(video)
+            refresh_video_status(video)
+        self.assertEqual(fetch.call_count, 1)
+        video.refresh_from_db()
+        self.assertEqual(video.status, 'started')
+        self.assertIn('started_at', video.config)
+
+    @override_settings(VIDEO_STATUS_WAIT_SECONDS=0)
+    def test_concurrent_refresh_reads_the_stored_state(self):
+        video = make_video(self.user, status='created', result_url=None)
+        cache.set(f'video-status:lock:{video.talk_id}', 1)
+        with mock.patch('api.video_status.fetch_provider_status') as fetch:
+            self.assertEqual(refresh_video_status(video).status, 'created')
+        fetch.assert_not_called()
+
+
+@override_settings(SCHEDULER_DISPATCH_IN_PROCESS=False)
+class BulkVideoStatusTests(APITestBase):
+    def test_returns_own_videos_and_refreshes_only_unfinished_ones(self):
+        done = make_video(self.user)
+        rendering = make_video(self.user, status='started', result_url=None)
+        foreign = make_video(self.other)
+        # Refreshes run on worker threads, which can't see this test's uncommitted rows
+        with mock.patch('api.video_status.refresh_video_status') as refresh:
+            response = self.client.post(
+                '/api/videos/status/', {'ids': [done.id, rendering.id, foreign.id]}, format='json'
+            )
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual({item['id'] for item in response.data['results']}, {done.id, rendering.id})
+        self.assertEqual(response.data['not_found'], [foreign.id])
+        self.assertEqual([call.args[0].id for call in refresh.call_args_list], [rendering.id])
+
+    def test_rejects_bad_ids(self):
+        self.assertEqual(self.client.post('/api/videos/status/', {'ids': []}, format='json').status_code, 400)
+        self.assertEqual(self.client.post('/api/videos/status/', {'ids': ['x']}, format='json').status_code, 400)
+
+
+class IdempotencyTests(APITestBase):
+    def setUp(self):
+        super().setUp()
+        self.factory = APIRequestFactory()
+        self.calls = []
+        self.status_code = 201
+        self.on_call = None
+
+        @api_view(['POST'])
+        @permission_classes([IsAuthenticated])
+        @idempotent
+        def view(request):
+            self.calls.append(request.data)
+            if self.on_call:
+                on_call, self.on_call = self.on_call, None
+                on_call()
+            return Response({'call': len(self.calls)}, status=self.status_code)
+
+        self.view = view
+
+    def post(self, data, key='key-1'):
+        headers = {'HTTP_IDEMPOTENCY_KEY': key} if key else {}
+        request = self.factory.post('/api/videos/create/', data, format='json', **headers)
+        force_authenticate(request, self.user)
+        return self.view(request)
+
+    def test_retry_replays_the_first_response(self):
+        first = self.post({'name': 'a'})
+        retry = self.post({'name': 'a'})
+        self.assertEqual(len(self.calls), 1)
+        self.assertEqual(retry.status_code, 201)
+        self.assertEqual(retry.data, first.data)
+        self.assertEqual(retry['Idempotent-Replayed'], 'true')
+
+    def test_key_reused_for_a_different_request(self):
+        self.post({'name': 'a'})
+        self.assertEqual(self.post({'name': 'b'}).status_code, 422)
+        self.assertEqual(len(self.calls), 1)
+
+    @override_settings(IDEMPOTENCY_WAIT_SECONDS=0)
+    def test_retry_while_in_progress_conflicts(self):
+        retries = []
+        self.on_call = lambda: retries.append(self.post({'name': 'a'}))
+        self.post({'name': 'a'})
+        self.assertEqual(retries[0].status_code, 409)
+        self.assertEqual(len(self.calls), 1)
+
+    def test_server_error_releases_the_key(self):
+        self.status_code = 500
+        self.post({'name': 'a'})
+        self.status_code = 201
+        self.assertEqual(self.post({'name': 'a'}).status_code, 201)
+        self.assertEqual(len(self.calls), 2)
+
+    def test_expired_key_runs_again(self):
+        self.post({'name': 'a'})
+        IdempotencyKey.objects.update(expires_at=timezone.now() - timedelta(seconds=1))
+        self.post({'name': 'a'})
+        self.assertEqual(len(self.calls), 2)
+
+    def test_without_key_every_request_runs(self):
+        self.post({'name': 'a'}, key=None)
+        self.post({'name': 'a'}, key=None)
+        self.assertEqual(len(self.calls), 2)
+        self.assertFalse(IdempotencyKey.objects.exists())
+
+
+class RenderCacheTests(APITestBase):
+    def did(self, script, **overrides):
+        args = {
+            'image_file': None, 'source_url': 'https://example.com/avatar.png', 'input_type': 'text',
+            'script_input': script, 'voice_provider': 'microsoft', 'voice_id': 'en-US-JennyNeural',
+            'voice_language': 'English', 'audio_file': None, 'driver_config': {'stitch': True},
+        }
+        args.update(overrides)
+        return did_fingerprint(**args)
+
+    def test_fingerprint_ignores_whitespace_but_not_content(self):
+        self.assertEqual(self.did('Hello there\r\n'), self.did('  Hello there'))
+        self.assertNotEqual(self.did('Hello there'), self.did('Hello world'))
+        self.assertNotEqual(self.did('Hello there'), self.did('Hello there', voice_id='en-GB-RyanNeural'))
+
+    def test_uploads_are_identified_by_content(self):
+        first = SimpleUploadedFile('a.png', b'\x89PNG same bytes')
+        second = SimpleUploadedFile('b.png', b'\x89PNG same bytes')
+        self.assertEqual(file_sha256(first), file_sha256(second))
+        self.assertEqual(first.read(), b'\x89PNG same bytes')
+
+    def test_only_rehosted_renders_of_the_same_user_are_reused(self):
+        fingerprint = self.did('Hello there')
+        make_video(self.user, fingerprint=fingerprint)
+        self.assertIsNone(find_cached_render(self.user, fingerprint))
+        cached = make_video(
+            self.user, fingerprint=fingerprint, result_url='https://storage.googleapis.com/bucket/videos/a.mp4'
+        )
+        self.assertEqual(find_cached_render(self.user, fingerprint), cached)
+        self.assertIsNone(find_cached_render(self.other, fingerprint))
+
+    def test_clone_points_at_the_cached_result(self):
+        cached = make_video(self.user, fingerprint='f' * 64, result_url='https://storage.googleapis.com/b/v.mp4')
+        clone = clone_render(cached, self.user, 'again', 'Hello there')
+        self.assertNotEqual(clone.id, cached.id)
+        self.assertEqual(clone.status, 'done')
+        self.assertEqual(clone.result_url, cached.result_url)
+        self.assertEqual(clone.config['reused_from'], cached.id)
+
+
+class ProviderRoutingTests(APITestBase):
+    def stats(self, provider, render_seconds, queue_seconds=None, success_rate=0.9, finished=20):
+        return {
+            'provider': provider, 'finished': finished, 'success_rate': success_rate,
+            'queue_seconds': queue_seconds, 'render_seconds': render_seconds,
+        }
+
+    def rank(self, stats):
+        with mock.patch('api.routing.get_provider_stats', side_effect=lambda provider: stats[provider]):
+            return rank_providers()
+
+    def test_faster_provider_first(self):
+        self.assertEqual(
+            self.rank({'d-id': self.stats('d-id', 90), 'heygen': self.stats('heygen', 60)}), ['heygen', 'd-id']
+        )
+
+    def test_queue_time_counts(self):
+        stats = {'d-id': self.stats('d-id', 90), 'heygen': self.stats('heygen', 60, queue_seconds=300)}
+        self.assertEqual(self.rank(stats), ['d-id', 'heygen'])
+
+    def test_degraded_provider_last(self):
+        stats = {'d-id': self.stats('d-id', 90), 'heygen': self.stats('heygen', 10, success_rate=0.2)}
+        self.assertEqual(self.rank(stats), ['d-id', 'heygen'])
+
+    def test_open_circuit_is_skipped(self):
+        for _ in range(settings.PROVIDER_BREAKER_FAILURES):
+            record_failure('heygen')
+        stats = {'d-id': self.stats('d-id', 90), 'heygen': self.stats('heygen', 10)}
+        self.assertEqual(self.rank(stats), ['d-id'])
+
+    def test_stats_count_jobs_still_waiting_at_the_provider(self):
+        submitted_at = (timezone.now() - timedelta(minutes=10)).isoformat()
+        make_video(
+            self.user, platform='heygen', status='pending', result_url=None, config={'submitted_at': submitted_at}
+        )
+        stats = compute_provider_stats('heygen')
+        self.assertGreaterEqual(stats['queue_seconds'], 600)
+        self.assertIsNone(stats['render_seconds'])
+
+    def test_fingerprint_includes_requested_provider(self):
+        args = [None, 'https://example.com/a.png', 'text', 'Hi', 'microsoft', 'en-US-JennyNeural', 'English', None, {}]
+        did = did_fingerprint(*args)
+        self.assertEqual(did, did_fingerprint(*args, 'd-id', 'ignored'))
+        self.assertNotEqual(did, did_fingerprint(*args, 'heygen', 'voice-1'))
+        self.assertNotEqual(did_fingerprint(*args, 'heygen', 'voice-1'), did_fingerprint(*args, 'heygen', 'voice-2'))
+        self.assertNotEqual(did_fingerprint(*args, 'heygen', 'voice-1'), did_fingerprint(*args, 'auto', 'voice-1'))
+
+
+@override_settings(
+    PROVIDER_RATE_HEADROOM=1.0,
+    PROVIDER_RATE_LIMITS={'d-id': {'requests_per_minute': 60, 'burst': 2, 'concurrency': 1}},
+)
+class ProviderRateLimitTests(APITestBase):
+    def setUp(self):
+        super().setUp()
+        self.now = 1_000_000.0
+        clock = mock.patch('api.rate_limits.time', mock.Mock(time=lambda: self.now))
+        clock.start()
+        self.addCleanup(clock.stop)
+        self.name = quota_name('d-id', 'secret')
+
+    def acquire(self):
+        lease, wait = _try_acquire('d-id', self.name)
+        if lease:
+            _release(self.name, lease)
+        return lease is not None, wait
+
+    def test_burst_then_refill(self):
+        self.assertEqual(self.acquire(), (True, 0))
+        self.assertEqual(self.acquire(), (True, 0))
+        acquired, wait = self.acquire()
+        self.assertFalse(acquired)
+        self.assertAlmostEqual(wait, 1.0)
+        self.now += 1.0
+        self.assertEqual(self.acquire(), (True, 0))
+
+    def test_concurrency_slots(self):
+        with provider_slot('d-id', 'secret', max_wait=0):
+            with self.assertRaises(RateLimited):
+                with provider_slot('d-id', 'secret', max_wait=0):
+                    pass
+        with provider_slot('d-id', 'secret', max_wait=0):
+            pass
+
+    def test_429_blocks_until_retry_after(self):
+        self.acquire()
+        report_rate_limited('d-id', 'secret', mock.Mock(headers={'Retry-After': '30'}))
+        acquired, wait = self.acquire()
+        self.assertFalse(acquired)
+        self.assertAlmostEqual(wait, 30.0)
+        self.now += 30.0
+        self.assertEqual(self.acquire(), (True, 0))
+
+
+@override_settings(SCHEDULER_DISPATCH_IN_PROCESS=False, SCHEDULER_MAX_IN_FLIGHT=10, SCHEDULER_USER_MAX_IN_FLIGHT=10)
+class SchedulerTests(APITestBase):
+    def queue(self, user, count=1, priority='normal'):
+        videos = [
+            make_video(user, status='queued', talk_id=placeholder_talk_id(), result_url=None) for _ in range(count)
+        ]
+        payload = {'d-id': {'talk_payload': {'script': {'type': 'text', 'input': 'Hi'}}}}
+        return enqueue_many([(video, payload) for video in videos], 'd-id', ['d-id'], priority)
+
+    def claim_all(self):
+        claimed = []
+        while True:
+            job = _claim_next(set())
+            if job is None:
+                return claimed
+            claimed.append(job)
+
+    def test_light_user_is_not_stuck_behind_a_heavy_one(self):
+        self.queue(self.other, 4)
+        self.queue(self.user)
+        users = [job.user_id for job in self.claim_all()]
+        self.assertEqual(users, [self.other.id, self.user.id, self.other.id, self.other.id, self.other.id])
+
+    def test_higher_priority_gets_a_larger_share(self):
+        self.queue(self.other, 2, priority='low')
+        self.queue(self.user, 5, priority='high')
+        users = ['high' if job.user_id == self.user.id else 'low' for job in self.claim_all()]
+        # Weights 4:1, and low priority still gets its turn
+        self.assertEqual(users, ['high', 'high', 'high', 'low', 'high', 'high', 'low'])
+
+    @override_settings(SCHEDULER_USER_MAX_IN_FLIGHT=1)
+    def test_per_user_cap(self):
+        self.queue(self.other, 3)
+        self.queue(self.user, 2)
+        self.assertEqual(sorted(job.user_id for job in self.claim_all()), sorted([self.user.id, self.other.id]))
+
+    @override_settings(SCHEDULER_MAX_IN_FLIGHT=2)
+    def test_global_cap(self):
+        self.queue(self.user, 3)
+        self.assertEqual(len(self.claim_all()), 2)
+
+    def test_deferred_job_waits_for_not_before(self):
+        job = self.queue(self.user)[0]
+        GenerationJob.objects.filter(pk=job.pk).update(not_before=timezone.now() + timedelta(seconds=120))
+        self.assertIsNone(_claim_next(set()))
+        self.assertAlmostEqual(seconds_until_next_dispatch(), 120, delta=2)
+
+    def test_idle_dispatcher_stops(self):
+        self.assertIsNone(seconds_until_next_dispatch())
+
+    @override_settings(SCHEDULER_USER_MAX_IN_FLIGHT=1, SCHEDULER_POLL_SECONDS=15)
+    def test_dispatcher_refreshes_its_own_jobs_to_free_slots(self):
+        first, second = self.queue(self.user, 2)
+        with mock.patch('api.scheduler._start', return_value=('tlk_first', {})):
+            self.assertEqual(dispatch_jobs(), 1)
+        self.assertEqual(seconds_until_next_dispatch(), 15)
+
+        def finish(videos):
+            for video in videos:
+                VideoGeneration.objects.filter(pk=video.pk).update(status='done')
+
+        with mock.patch('api.scheduler.refresh_video_statuses', side_effect=finish) as refresh, \
+                mock.patch('api.scheduler._start', return_value=('tlk_second', {})):
+            self.assertEqual(dispatch_jobs(), 1)
+        self.assertEqual([video.id for video in refresh.call_args[0][0]], [first.video_id])
+        second.refresh_from_db()
+        self.assertEqual(second.state, 'submitted')
+        self.assertEqual(second.video.talk_id, 'tlk_second')
+
+
+class ManifestTests(SimpleTestCase):
+    def test_csv_manifest(self):
+        manifest = SimpleUploadedFile(
+            'batch.csv', '\ufeffName, Script_Input ,First_Name\nIntro, Hello! ,Ada\n,,Grace\n'.encode()
+        )
+        self.assertEqual(read_manifest(manifest), [
+            {'name': 'Intro', 'script': 'Hello!', 'first_name': 'Ada'},
+            {'name': '', 'script': '', 'first_name': 'Grace'},
+        ])
+
+    def test_json_manifest(self):
+        manifest = SimpleUploadedFile('batch.json', b'[{"script": "Hi", "voice_id": 3}]')
+        self.assertEqual(read_manifest(manifest), [{'script': 'Hi', 'voice_id': '3'}])
+
+    def test_unreadable_manifests(self):
+        for name, content in [('a.csv', b''), ('a.json', b'{"script": "Hi"}'), ('a.json', b'[1]'), ('a.csv', b'\xff')]:
+            with self.assertRaises(ManifestError):
+                read_manifest(SimpleUploadedFile(name, content))
+        with self.assertRaises(ManifestError):
+            read_manifest(items=[{'script': 'a'}, {'script': 'b'}], max_items=1)
+
+    def test_template_and_defaults(self):
+        rows = [{'first_name': 'Ada'}, {'script': 'Custom', 'name': 'Own', 'voice_id': 'v2'}]
+        specs = expand_rows(rows, 'Welcome', 'Hi {first_name}!', defaults={'voice_id': 'v1'})
+        self.assertEqual([spec['script'] for spec in specs], ['Hi Ada!', 'Custom'])
+        self.assertEqual([spec['name'] for spec in specs], ['Welcome #1', 'Own'])
+        self.assertEqual([spec['voice_id'] for spec in specs], ['v1', 'v2'])
+
+    def test_every_invalid_row_is_reported(self):
+        with self.assertRaises(ManifestError) as raised:
+            expand_rows([{'script': 'ok'}, {}, {'name': 'x'}], 'Batch', 'Hi {first_name}')
+        self.assertEqual([error['row'] for error in raised.exception.errors], [2, 3])
+
+
+class StreamingUploadTests(APITestBase):
+    def setUp(self):
+        super().setUp()
+        self.bucket = fake_gcs(self)
+        self.factory = APIRequestFactory()
+        self.seen = {}
+
+        @api_view(['POST'])
+        @permission_classes([IsAuthenticated])
+        @streaming_uploads(image_file='images/{user}')
+        def view(request):
+            image, audio = request.FILES.get('image_file'), request.FILES.get('audio_file')
+            self.seen.update(image=image, audio=audio)
+            if request.data.get('keep') == 'true':
+                store_upload(image, 'images')
+            return Response({}, status=int(request.data.get('status', 201)))
+
+        self.view = view
+
+    def post(self, **data):
+        request = self.factory.post('/api/videos/create/', {
+            'image_file': SimpleUploadedFile('face.png', b'\x89PNG image bytes', 'image/png'),
+            'audio_file': SimpleUploadedFile('voice.wav', b'RIFF audio', 'audio/wav'),
+            **data,
+        }, format='multipart')
+        force_authenticate(request, self.user)
+        return self.view(request)
+
+    def test_selected_field_is_streamed_to_gcs(self):
+        self.post(keep='true')
+        image = self.seen['image']
+        self.assertIsInstance(image, StreamedUploadedFile)
+        self.assertEqual(image.sha256, hashlib.sha256(b'\x89PNG image bytes').hexdigest())
+        self.assertTrue(image.blob.name.startswith(f'images/{self.user.id}/'))
+        self.assertEqual(self.bucket.objects[image.blob.name], (b'\x89PNG image bytes', 'image/png'))
+        # Other fields go to the default handlers
+        self.assertNotIsInstance(self.seen['audio'], StreamedUploadedFile)
+
+    def test_unused_upload_is_deleted(self):
+        self.post()
+        self.assertEqual(self.bucket.objects, {})
+
+    def test_failed_request_deletes_kept_upload(self):
+        self.post(keep='true', status='400')
+        self.assertEqual(self.bucket.objects, {})
+
+
+def md5_of(data):
+    return base64.b64encode(hashlib.md5(data).digest()).decode()
+
+
+class SniffFamilyTests(SimpleTestCase):
+    def test_known_signatures(self):
+        cases = {
+            b'\x89PNG\r\n\x1a\n': 'image',
+            b'\xff\xd8\xff\xe0': 'image',
+            b'RIFF\x00\x00\x00\x00WEBPVP8 ': 'image',
+            b'\x00\x00\x00\x18ftypmp42': 'video',
+            b'\x00\x00\x00\x18ftypM4A ': 'audio',
+            b'\x1aE\xdf\xa3': 'video',
+            b'ID3\x04\x00': 'audio',
+            b'\xff\xfb\x90\x00': 'audio',
+            b'RIFF\x00\x00\x00\x00WAVEfmt ': 'audio',
+            b'<html>': None,
+            b'': None,
+        }
+        for head, family in cases.items():
+            self.assertEqual(sniff_family(head), family, head)
+
+
+class DirectUploadTests(APITestBase):
+    def setUp(self):
+        super().setUp()
+        self.bucket = fake_gcs(self)
+
+    def declare(self, data, content_type='image/png', **fields):
+        return create_upload(self.user, 'image', 'face.png', content_type, len(data), md5_of(data), **fields)
+
+    def test_md5_is_required(self):
+        with self.assertRaises(AssetError):
+            create_upload(self.user, 'image', 'face.png', 'image/png', 10, '')
+        response = self.client.post('/api/uploads/', {
+            'kind': 'image', 'filename': 'face.png', 'content_type': 'image/png', 'size': 10,
+        })
+        self.assertEqual(response.status_code, 400)
+
+    def test_good_upload_is_ready(self):
+        data = b'\x89PNG\r\n\x1a\n image'
+        asset, upload = self.declare(data)
+        self.assertEqual(upload['headers']['Content-MD5'], md5_of(data))
+        self.bucket.objects[asset.blob_name] = (data, 'image/png')
+        self.assertEqual(finalize_upload(asset).status, 'ready')
+        self.assertEqual(get_asset(self.user, asset.id, 'image'), asset)
+
+    def test_resumable_upload_is_checked_against_the_declared_md5(self):
+        declared = b'\x89PNG\r\n\x1a\n image'
+        asset, _ = self.declare(declared, resumable=True)
+        self.bucket.objects[asset.blob_name] = (b'\x89PNG\r\n\x1a\n other', 'image/png')
+        with self.assertRaises(AssetError):
+            finalize_upload(asset)
+        self.assertEqual(asset.status, 'rejected')
+        self.assertNotIn(asset.blob_name, self.bucket.objects)
+
+    def test_content_must_match_the_kind(self):
+        data = b'<html>not an image'
+        asset, _ = self.declare(data)
+        self.bucket.objects[asset.blob_name] = (data, 'image/png')
+        with self.assertRaises(AssetError):
+            finalize_upload(asset)
+
+    def test_missing_object_keeps_the_asset_pending(self):
+        asset, _ = self.declare(b'\x89PNG\r\n\x1a\n image')
+        with self.assertRaises(AssetError):
+            finalize_upload(asset)
+        self.assertEqual(asset.status, 'pending')
+        with self.assertRaises(AssetError):
+            get_asset(self.user, asset.id, 'image')
+
+
+@override_settings(GCP_PARALLEL_PART_SIZE=10, GCP_PARALLEL_TRANSFER_WORKERS=4)
+class ParallelCopyTests(APITestBase):
+    data = bytes(range(256)) * 2
+
+    def setUp(self):
+        super().setUp()
+        self.bucket = fake_gcs(self)
+        for patcher in (
+            mock.patch('api.gcp_storage.MAX_COMPOSE_SOURCES', 4),
+            mock.patch('api.gcp_storage._transfer_part', side_effect=self.transfer_part),
+        ):
+            patcher.start()
+            self.addCleanup(patcher.stop)
+
+    def transfer_part(self, source_url, part_name, start, end):
+        self.bucket.objects[part_name] = (self.data[start:end + 1], None)
+
+    def copy(self):
+        return parallel_download_and_upload_to_gcp(
+            'https://example.com/v.mp4', 'videos/v.mp4', len(self.data), 'video/mp4'
+        )
+
+    def test_parts_are_composed_in_order(self):
+        self.copy()
+        # 52 parts need two levels of intermediate objects; none are left behind
+        self.assertEqual(self.bucket.objects, {'videos/v.mp4': (self.data, 'video/mp4')})
+
+    def test_failed_compose_cleans_up_intermediates(self):
+        self.bucket.failing.add('videos/v.mp4.compose/1-00001')
+        with self.assertRaises(IOError):
+            self.copy()
+        self.assertEqual(self.bucket.objects, {})
+
+
+@override_settings(REHOST_IN_PROCESS=False, REHOST_MAX_ATTEMPTS=3, REHOST_RETRY_SECONDS=30)
+class RehostTests(APITestBase):
+    provider_url = 'https://d-id.example.com/result.mp4'
+    mp4 = b'\x00\x00\x00\x18ftypmp42' + b'\x00' * 32
+
+    def setUp(self):
+        super().setUp()
+        self.bucket = fake_gcs(self)
+        self.video = make_video(self.user, status='done', result_url=self.provider_url)
+        patcher = mock.patch('api.rehosting.download_and_upload_to_gcp', side_effect=self.copy)
+        self.download = patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def copy(self, source_url, blob_name, content_type=None):
+        self.bucket.objects[blob_name] = (self.mp4, content_type)
+        return f'https://storage.googleapis.com/bucket/{blob_name}'
+
+    def run_next(self):
+        return run_task(claim_rehost_task())
+
+    def test_verified_copy_replaces_provider_url(self):
+        task = schedule_rehost(self.video, self.provider_url)
+        self.assertEqual(self.run_next(), 'done')
+        self.video.refresh_from_db()
+        self.assertEqual(self.video.result_url, f'https://storage.googleapis.com/bucket/{task.blob_name}')
+        self.assertEqual(RehostTask.objects.get().state, 'done')
+
+    def test_failed_copy_backs_off_then_gives_up(self):
+        self.download.side_effect = IOError('connection reset')
+        schedule_rehost(self.video, self.provider_url)
+        self.assertEqual(self.run_next(), 'retry')
+        task = RehostTask.objects.get()
+        self.assertEqual(task.state, 'queued')
+        self.assertAlmostEqual((task.not_before - timezone.now()).total_seconds(), 30, delta=5)
+        # Not due yet
+        self.assertIsNone(claim_rehost_task())
+
+        RehostTask.objects.update(not_before=timezone.now())
+        self.assertEqual(self.run_next(), 'retry')
+        task.refresh_from_db()
+        self.assertAlmostEqual((task.not_before - timezone.now()).total_seconds(), 60, delta=5)
+
+        RehostTask.objects.update(not_before=timezone.now())
+        self.assertEqual(self.run_next(), 'failed')
+        self.assertEqual(RehostTask.objects.get().state, 'failed')
+        self.video.refresh_from_db()
+        self.assertEqual(self.video.result_url, self.provider_url)
+
+    def test_copy_that_is_not_a_video_is_retried(self):
+        self.mp4 = b'<html>expired</html>'
+        schedule_rehost(self.video, self.provider_url)
+        self.assertEqual(self.run_next(), 'retry')
+        self.assertIn('not a video', RehostTask.objects.get().last_error)
+        self.video.refresh_from_db()
+        self.assertEqual(self.video.result_url, self.provider_url)
+
+    def test_copy_is_discarded_if_video_was_rehosted_meanwhile(self):
+        task = schedule_rehost(self.video, self.provider_url)
+        other = 'https://storage.googleapis.com/bucket/other.mp4'
+        VideoGeneration.objects.filter(pk=self.video.pk).update(result_url=other)
+        self.assertEqual(self.run_next(), 'done')
+        self.video.refresh_from_db()
+        self.assertEqual(self.video.result_url, other)
+        self.assertNotIn(task.blob_name, self.bucket.objects)
+
+    def test_new_provider_url_resets_attempts(self):
+        self.download.side_effect = IOError('connection reset')
+        schedule_rehost(self.video, self.provider_url)
+        self.run_next()
+        re_signed = 'https://d-id.example.com/re-signed.mp4'
+        schedule_rehost(self.video, re_signed)
+        task = RehostTask.objects.get()
+        self.assertEqual((task.state, task.attempts, task.source_url), ('queued', 0, re_signed))
+        self.assertIsNotNone(claim_rehost_task())
+
+
+class PipelineResumeTests(APITestBase):
+    def stage(self, name, calls, fail=False):
+        def run():
+            calls.append(name)
+            if fail:
+                raise IOError(f'{name} failed')
+            return {'url': f'https://storage.googleapis.com/bucket/{name}'}
+        return name, run
+
+    def test_resumed_run_skips_finished_stages(self):
+        pipeline = start_pipeline(self.user, 'f' * 64, {'project_name': 'demo'})
+        calls = []
+        with self.assertRaises(IOError):
+            run_stages(pipeline, [self.stage('avatar', calls), self.stage('talking_photo', calls, fail=True)])
+        pipeline.refresh_from_db()
+        self.assertEqual((pipeline.state, pipeline.failed_stage), ('failed', 'talking_photo'))
+        self.assertEqual(list(pipeline.checkpoints), ['avatar'])
+
+        # The same request again picks up the failed run, with its new params
+        resumed = start_pipeline(self.user, 'f' * 64, {'project_name': 'demo 2'})
+        self.assertEqual(resumed.pk, pipeline.pk)
+        self.assertEqual((resumed.state, resumed.runs, resumed.params), ('running', 2, {'project_name': 'demo 2'}))
+        calls = []
+        run_stages(resumed, [self.stage('avatar', calls), self.stage('talking_photo', calls)])
+        self.assertEqual(calls, ['talking_photo'])
+        self.assertEqual(resumed.state, 'completed')
+        self.assertEqual(resumed.failed_stage, '')
+
+    def test_only_a_recent_failed_run_of_the_same_inputs_is_resumed(self):
+        failed = GenerationPipeline.objects.create(user=self.user, fingerprint='f' * 64, state='failed')
+        self.assertNotEqual(start_pipeline(self.other, 'f' * 64, {}).pk, failed.pk)
+        self.assertNotEqual(start_pipeline(self.user, 'e' * 64, {}).pk, failed.pk)
+        # Requests without a fingerprint never resume
+        GenerationPipeline.objects.create(user=self.user, fingerprint='', state='failed')
+        self.assertEqual(start_pipeline(self.user, '', {}).state, 'running')
+        self.assertEqual(GenerationPipeline.objects.filter(fingerprint='').count(), 2)
+
+        GenerationPipeline.objects.filter(pk=failed.pk).update(updated_at=timezone.now() - timedelta(hours=25))
+        self.assertNotEqual(start_pipeline(self.user, 'f' * 64, {}).pk, failed.pk)
+
+    @override_settings(PIPELINE_LOCK_SECONDS=600)
+    def test_running_pipeline_is_claimed_only_once_its_lock_expires(self):
+        pipeline = GenerationPipeline.objects.create(user=self.user, state='failed')
+        self.assertTrue(claim_pipeline(pipeline))
+        self.assertFalse(claim_pipeline(pipeline))
+
+        GenerationPipeline.objects.filter(pk=pipeline.pk).update(updated_at=timezone.now() - timedelta(seconds=601))
+        self.assertTrue(claim_pipeline(pipeline))
+        self.assertEqual(pipeline.runs, 3)
+
+        GenerationPipeline.objects.filter(pk=pipeline.pk).update(state='completed')
+        self.assertFalse(claim_pipeline(pipeline))
+
+
+class DraftTests(APITestBase):
+    def test_draft_script_is_the_first_sentence(self):
+        self.assertEqual(draft_script('  Hello there, friend! This is the rest. '), 'Hello there, friend!')
+        self.assertEqual(draft_script('Is it ready? Yes.'), 'Is it ready?')
+        self.assertEqual(draft_script('你好。世界'), '你好。')
+        # A period after an abbreviation isn't the end of the draft
+        self.assertEqual(draft_script('Dr. Smith is here. Yes.'), 'Dr. Smith is here.')
+        self.assertEqual(draft_script('Mr. J. Smith\nwaves. Bye.'), 'Mr. J. Smith\nwaves.')
+        self.assertEqual(draft_script('Hi! Welcome to the show. More.'), 'Hi! Welcome to the show.')
+        # Decimal points and abbreviations without a following space don't end a sentence
+        self.assertEqual(draft_script('Version 2.5 is out'), 'Version 2.5 is out')
+
+    @override_settings(HEYGEN_DRAFT_MAX_CHARS=20)
+    def test_long_sentence_is_cut_at_a_word(self):
+        self.assertEqual(draft_script('A rather long first sentence without a break.'), 'A rather long first')
+        self.assertEqual(draft_script('A rather long firstly'), 'A rather long')
+        self.assertEqual(draft_script('x' * 50), 'x' * 20)
+        self.assertEqual(draft_script('Short one. ' + 'x' * 50), 'Short one.')
+
+    def test_reused_checkpoints_are_not_owned(self):
+        pipeline = GenerationPipeline.objects.create(user=self.user, state='completed', checkpoints={
+            'avatar': {'url': 'https://storage.googleapis.com/bucket/a.png', 'owned': True},
+            'talking_photo': {'talking_photo_id': 'tp1', 'talking_photo_url': 'https://heygen.example.com/tp1'},
+            'submit': {'video_id': 1},
+        })
+        checkpoints = reusable_checkpoints(pipeline)
+        self.assertEqual(set(checkpoints), {'avatar', 'talking_photo'})
+        self.assertFalse(checkpoints['avatar']['owned'])
+        # The original keeps ownership of its objects
+        self.assertTrue(pipeline.checkpoints['avatar']['owned'])
+
+
+@override_settings(SEGMENT_MAX_CHARS=100, SEGMENT_MAX_COUNT=3, SEGMENT_STITCH_IN_PROCESS=False)
+class SegmentTests(APITestBase):
+    def sentences(self, count, prefix='Sentence'):
+        return ' '.join(f'{prefix} number {index} says a few words.' for index in range(count))
+
+    def assertSameWords(self, pieces, text):
+        self.assertEqual(' '.join(pieces).split(), text.split())
+
+    def test_short_script_is_one_piece(self):
+        self.assertEqual(split_script('  Hello there.  '), ['Hello there.'])
+        self.assertEqual(split_script('\n\n'), [])
+
+    def test_paragraphs_become_pieces(self):
+        paragraphs = [self.sentences(2, prefix) for prefix in ('First', 'Second', 'Third')]
+        self.assertEqual(split_script('\n\n'.join(paragraphs)), paragraphs)
+
+    def test_long_paragraph_is_cut_at_sentences_into_even_pieces(self):
+        text = self.sentences(6)
+        pieces = split_script(text)
+        self.assertEqual(len(pieces), math.ceil(len(text) / 100))
+        self.assertSameWords(pieces, text)
+        for piece in pieces:
+            self.assertTrue(piece.endswith('.'))
+        self.assertLessEqual(max(map(len, pieces)) - min(map(len, pieces)), 40)
+
+    def test_piece_count_is_capped(self):
+        text = self.sentences(30)
+        pieces = split_script(text)
+        self.assertEqual(len(pieces), 3)
+        self.assertSameWords(pieces, text)
+
+    def create(self, text):
+        pieces = split_script(text)
+        fields = {
+            'user': self.user, 'name': 'long', 'source_url': 'https://example.com/avatar.png',
+            'platform': 'd-id', 'script_input': text, 'input_type': 'text',
+        }
+        payload = {'d-id': {'talk_payload': {'script': {'type': 'text', 'input': text}}}}
+        return create_segmented_video(fields, pieces, payload, 'd-id', ['d-id'])
+
+    def test_segments_are_queued_as_one_video(self):
+        parent = self.create(self.sentences(6))
+        segments = list(parent.segments.order_by('segment_index'))
+        self.assertEqual(parent.config['segments'], len(segments))
+        self.assertEqual([segment.segment_index for segment in segments], list(range(len(segments))))
+        jobs = GenerationJob.objects.filter(video__segment_of=parent)
+        self.assertEqual(jobs.count(), len(segments))
+        self.assertEqual(
+            [job.payload['d-id']['talk_payload']['script']['input'] for job in jobs.order_by('video__segment_index')],
+            [segment.script_input for segment in segments],
+        )
+
+    def test_statuses_roll_up_to_the_parent(self):
+        parent = self.create(self.sentences(6))
+        first, *rest = parent.segments.order_by('segment_index')
+        VideoGeneration.objects.filter(pk=first.pk).update(status='processing')
+        self.assertEqual(roll_up(parent.pk).status, 'processing')
+
+        parent.segments.update(status='done', result_url='https://d-id.example.com/clip.mp4')
+        parent = roll_up(parent.pk)
+        self.assertEqual(parent.status, 'stitching')
+        self.assertEqual(parent.config['segments_done'], len(rest) + 1)
+
+    def test_failed_segment_fails_the_parent_and_cancels_the_rest(self):
+        parent = self.create(self.sentences(6))
+        first, *rest = parent.segments.order_by('segment_index')
+        VideoGeneration.objects.filter(pk=first.pk).update(status='error')
+        self.assertEqual(roll_up(parent.pk).status, 'error')
+        self.assertEqual(
+            set(GenerationJob.objects.filter(video__in=rest).values_list('state', flat=True)), {'failed'}
+        )
+        statuses = VideoGeneration.objects.filter(pk__in=[segment.pk for segment in rest]).values_list('status')
+        self.assertEqual(set(statuses), {('error',)})
@@ -0,0 +1,122 @@
+"""
+Trending scores for the social feed.
+
+Scores use forward decay: an event of weight w at time t contributes
+w * exp(lambda * (t - epoch)) for a fixed epoch. Newer events count
+exponentially more, and since every score grows by the same factor as time
+passes, the relative order never needs recomputing just because time moved
+on. Only new events have to be folded in, which makes updates incremental.
+The sums are stored as natural logs so they don't overflow a float.
+"""
+import logging
+import math
+from collections import defaultdict
+from datetime import datetime, timezone as dt_timezone
+
+from django.conf import settings
+from django.db import transaction
+from django.utils import timezone
+
+from .models import JobCheckpoint, VideoGeneration, VideoLike, VideoTrendingScore, VideoView
+
+logger = logging.getLogger(__name__)
+
+# Fixed landmark for forward decay; changing it requires a --full recompute
+TRENDING_EPOCH = datetime(2025, 1, 1, tzinfo=dt_timezone.utc)
+
+
+def log_add(a, b):
+    """Return log(exp(a) + exp(b)) without overflowing."""
+    if a == -math.inf:
+        return b
+    if b == -math.inf:
+        return a
+    high, low = max(a, b), min(a, b)
+    return high + math.log1p(math.exp(low - high))
+
+
+def event_log_weight(weight, timestamp):
+    """Log of the forward-decayed weight of one event."""
+    decay_rate = math.log(2) / (settings.TRENDING_HALF_LIFE_HOURS * 3600)
+    return math.log(weight) + decay_rate * (timestamp - TRENDING_EPOCH).total_seconds()
+
+
+def _event_streams():
+    """(checkpoint name, model, weight) for every event type that feeds the score."""
+    return [
+        # Every video starts with a small score when it is created, so fresh
+        # uploads can surface before anyone has interacted with them
+        ('trending:videos', VideoGeneration, settings.TRENDING_CREATED_WEIGHT),
+        ('trending:likes', VideoLike, settings.TRENDING_LIKE_WEIGHT),
+        ('trending:views', VideoView, settings.TRENDING_VIEW_WEIGHT),
+    ]
+
+
+def update_trending_scores(full=False, batch_size=5000):
+    """
+    Fold new likes, views and videos into VideoTrendingScore.
+
+    Each event stream keeps a JobCheckpoint with the last processed row id,
+    so a run only reads events created since the previous run.
+
+    Args:
+        full: Discard all scores and checkpoints and rebuild from scratch. Needed
+              periodically because unlikes (deleted rows) can't be subtracted.
+        batch_size: Events read per query
+
+    Returns:
+        Number of events processed
+    """
+    processed = 0
+    with transaction.atomic():
+        if full:
+            VideoTrendingScore.objects.all().delete()
+            JobCheckpoint.objects.filter(name__startswith='trending:').delete()
+
+        for name, model, weight in _event_streams():
+            checkpoint, _ = JobCheckpoint.objects.select_for_update().get_or_create(name=name)
+            video_field = 'id' if model is VideoGeneration else 'video_id'
+
+            while True:
+                events = list(
+                    model.objects.filter(id__gt=checkpoint.position)
+                    .order_by('id')
+                    .values_list('id', video_field, 'created_at')[:batch_size]
+                )
+                if not events:
+                    break
+
+                deltas = defaultdict(lambda: -math.inf)
+                for _, video_id, created_at in events:
+                    deltas[video_id] = log_add(deltas[video_id], event_log_weight(weight, created_at))
+                _apply_deltas(deltas)
+
+                checkpoint.position = events[-1][0]
+                checkpoint.save(update_fields=['position', 'updated_at'])
+                processed += len(events)
+
+    logger.info('Trending scores updated from %s events (full=%s)', processed, full)
+    return processed
+
+
+def _apply_deltas(deltas):
+    existing = {
+        row.video_id: row
+        for row in VideoTrendingScore.objects.filter(video_id__in=list(deltas))
+    }
+    # Events of deleted videos may still be in flight
+    live_ids = set(VideoGeneration.objects.filter(id__in=list(deltas)).values_list('id', flat=True))
+
+    now = timezone.now()
+    to_create, to_update = [], []
+    for video_id, delta in deltas.items():
+        if video_id in existing:
+            row = existing[video_id]
+            row.score = log_add(row.score, delta)
+            row.updated_at = now
+            to_update.append(row)
+        elif video_id in live_ids:
+            to_create.append(VideoTrendingScore(video_id=video_id, score=delta))
+
+    VideoTrendingScore.objects.bulk_create(to_create)
+    VideoTrendingScore.objects.bulk_update(to_update, ['score', 'updated_at'])
@@ -0,0 +1,169 @@
+"""
+Streaming of uploaded files straight into GCP Storage.
+
+Django's default upload handlers keep small files in memory and spool large
+ones to a temp file, and the views then copied them to GCP. For fields
+listed in @streaming_uploads, GCSStreamingUploadHandler instead writes each
+multipart chunk into a resumable GCS upload session as it arrives, hashing
+as it goes. Memory stays at one GCP_UPLOAD_CHUNK_SIZE buffer whatever the
+file size, and no temp file is written.
+
+The view gets a StreamedUploadedFile: its sha256 and GCP URL are already
+known, and reading it streams the object back from GCS (e.g. as the body of
+a provider upload). Streamed objects that the view didn't keep() (failed
+validation, a reused render) are deleted when the view returns.
+"""
+import hashlib
+import logging
+from functools import wraps
+
+from django.conf import settings
+from django.core.files.uploadedfile import UploadedFile
+from django.core.files.uploadhandler import FileUploadHandler, StopFutureHandlers
+
+from .gcp_storage import gcp_public_url, generate_unique_blob_name, init_gcp_client, upload_file_object_to_gcp
+from .models import UploadedAsset
+
+logger = logging.getLogger(__name__)
+
+
+class StreamedUploadedFile(UploadedFile):
+    """An uploaded file whose content already lives in GCS; reads stream it back from there."""
+
+    def __init__(self, blob, name, content_type, size, charset, sha256):
+        reader = blob.open('rb', chunk_size=settings.GCP_UPLOAD_CHUNK_SIZE)
+        super().__init__(reader, name, content_type, size, charset)
+        self.blob = blob
+        self.sha256 = sha256
+        self.public_url = gcp_public_url(blob.name)
+        self.kept = False
+        self.persisted = False
+
+    def keep(self, persist=False):
+        """
+        Claim the stored object for good; returns its public URL.
+
+        A persisted object is kept even if the view then fails (it is
+        checkpointed for a retry, see pipelines.py).
+        """
+        self.kept = True
+        self.persisted = self.persisted or persist
+        return self.public_url
+
+
+class GCSStreamingUploadHandler(FileUploadHandler):
+    """
+    Upload handler that writes the files of selected fields directly to GCS.
+
+    Files of other fields (e.g. audio that still has to be converted) are
+    passed on to the default handlers.
+    """
+
+    def __init__(self, request, folders):
+        super().__init__(request)
+        self.folders = folders
+        self.bucket = None
+        self.writer = None
+        self.streamed = []
+
+    def new_file(self, field_name, file_name, content_type, content_length, charset=None, content_type_extra=None):
+        super().new_file(field_name, file_name, content_type, content_length, charset, content_type_extra)
+        self.writer = None
+        if field_name not in self.folders:
+            return
+        try:
+            if self.bucket is None:
+                self.bucket = init_gcp_client().bucket(settings.GCP_BUCKET_NAME)
+        except Exception as e:
+            # The default handlers take the file; store_upload() uploads it later
+            logger.warning('Not streaming %s to GCS: %s', field_name, e)
+            return
+        self.blob = self.bucket.blob(generate_unique_blob_name(self.folders[field_name], file_name))
+        self.writer = self.blob.open(
+            'wb', chunk_size=settings.GCP_UPLOAD_CHUNK_SIZE, ignore_flush=True,
+            content_type=content_type or 'application/octet-stream'
+        )
+        self.digest = hashlib.sha256()
+        raise StopFutureHandlers()
+
+    def receive_data_chunk(self, raw_data, start):
+        if self.writer is None:
+            return raw_data
+        self.writer.write(raw_data)
+        self.digest.update(raw_data)
+        return None
+
+    def file_complete(self, file_size):
+        if self.writer is None:
+            return None
+        self.writer.close()
+        self.writer = None
+        uploaded = StreamedUploadedFile(
+            self.blob, self.file_name, self.content_type, file_size, self.charset, self.digest.hexdigest()
+        )
+        self.streamed.append(uploaded)
+        return uploaded
+
+    def upload_interrupted(self):
+        # Never closed, so the resumable session is never finalized into an object
+        self.writer = None
+
+    def discard(self, keep_kept=True):
+        """Delete streamed objects the view didn't keep() (all but persisted ones if keep_kept is False)."""
+        for uploaded in self.streamed:
+            if uploaded.persisted or (keep_kept and uploaded.kept):
+                continue
+            try:
+                uploaded.blob.delete()
+            except Exception as e:
+                logger.warning('Could not delete unused upload %s: %s', uploaded.blob.name, e)
+
+
+def streaming_uploads(**folders):
+    """
+    Stream the named file fields of a view's request into GCS.
+
+    Args:
+        folders: field name -> bucket folder; "{user}" is replaced by the user id,
+            e.g. @streaming_uploads(avatar_file='heygen/avatars/{user}')
+
+    Goes below @permission_classes and above anything that reads
+    request.data (such as @idempotent): the handler has to be installed
+    before the body is parsed.
+    """
+    def decorator(view):
+        @wraps(view)
+        def wrapper(request, *args, **kwargs):
+            django_request = request._request
+            if hasattr(django_request, '_files'):
+                # Body already parsed; the default handlers have it
+                return view(request, *args, **kwargs)
+            handler = GCSStreamingUploadHandler(
+                django_request, {field: folder.format(user=request.user.id) for field, folder in folders.items()}
+            )
+            django_request.upload_handlers = [handler, *django_request.upload_handlers]
+            try:
+                response = view(request, *args, **kwargs)
+            except Exception:
+                handler.discard(keep_kept=False)
+                raise
+            handler.discard(keep_kept=response.status_code < 400)
+            return response
+        return wrapper
+    return decorator
+
+
+def store_upload(uploaded_file, folder, persist=False):
+    """
+    GCP public URL of an uploaded file.
+
+    Streamed files and finalized UploadedAssets (signed_uploads.py) are
+    already stored; others (any UploadedFile, in memory or spooled to disk)
+    are uploaded now. With persist, a streamed file survives a failing view
+    (see StreamedUploadedFile.keep).
+    """
+    if isinstance(uploaded_file, UploadedAsset):
+        return gcp_public_url(uploaded_file.blob_name)
+    if isinstance(uploaded_file, StreamedUploadedFile):
+        return uploaded_file.keep(persist)
+    return upload_file_object_to_gcp(uploaded_file, generate_unique_blob_name(folder, uploaded_file.name))
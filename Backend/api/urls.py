@@ -21,12 +21,25 @@ urlpatterns = [
     # Videos
     path('videos/', views.list_video_generations, name='list_videos'),
     path('videos/create/', views.create_video_generation, name='create_video'),
+    path('videos/stats/', views.video_generation_stats, name='video_stats'),
+    path('videos/search/', views.search_video_generations, name='search_videos'),
+    path('videos/status/', views.bulk_video_status, name='bulk_video_status'),
     path('videos/<int:pk>/', views.get_video_generation, name='get_video'),
     path('videos/<int:pk>/update/', views.update_video_status, name='update_video_status'),
     path('videos/<int:pk>/publish/', views.toggle_video_publish, name='toggle_video_publish'),
     
+    # Direct uploads to GCS
+    path('uploads/', views.create_upload_url, name='create_upload_url'),
+    path('uploads/<int:pk>/finalize/', views.finalize_upload_view, name='finalize_upload'),
+    
+    # Bulk generation
+    path('batches/', views.list_generation_batches, name='list_batches'),
+    path('batches/create/', views.create_generation_batch, name='create_batch'),
+    path('batches/<int:pk>/', views.get_generation_batch, name='get_batch'),
+    
     # Social Feed
     path('social/videos/', views.get_public_videos, name='get_public_videos'),
+    path('social/videos/search/', views.search_public_videos, name='search_public_videos'),
     path('social/videos/<int:pk>/like/', views.like_video, name='like_video'),
     path('social/videos/<int:pk>/view/', views.record_video_view, name='record_video_view'),
     
@@ -35,4 +48,7 @@ urlpatterns = [
     
     # HeyGen Style Video
     path('heygen/create/', views.create_heygen_video, name='create_heygen_video'),
+    path('heygen/pipelines/<int:pk>/', views.get_heygen_pipeline, name='get_heygen_pipeline'),
+    path('heygen/pipelines/<int:pk>/resume/', views.resume_heygen_pipeline, name='resume_heygen_pipeline'),
+    path('heygen/videos/<int:pk>/promote/', views.promote_heygen_draft, name='promote_heygen_draft'),
 ]
@@ -0,0 +1,259 @@
+"""
+Refreshing a video's render status from its provider (D-ID or HeyGen).
+
+Finished videos are served from the database without asking the provider.
+For videos still rendering, at most one refresh per talk_id runs at a time:
+concurrent pollers wait for it and read its result instead of each calling
+the provider themselves. Copying a finished MP4 into GCS is left to the
+re-host workers (rehosting.py). A successful refresh is
+then reused for VIDEO_STATUS_REFRESH_SECONDS.
+
+The coalescing goes through the Django cache, so it spans worker processes
+only when CACHE_URL points at a shared cache.
+"""
+import logging
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import connection
+from django.utils import timezone
+
+from .feed_cache import invalidate_feed
+from .providers import ProviderThrottled, api_key, request as provider_request
+
+logger = logging.getLogger(__name__)
+
+# Statuses a provider never moves a video out of
+TERMINAL_STATUSES = {'done', 'error', 'rejected'}
+
+# Statuses of a job still waiting in the provider's queue
+QUEUED_STATUSES = {'created', 'pending', 'waiting'}
+
+GCP_URL_PREFIX = 'https://storage.googleapis.com/'
+
+# talk_id of a video rendered as segments and stitched locally (segments.py)
+SEGMENTED_TALK_ID_PREFIX = 'segmented-'
+
+
+def is_terminal(video):
+    """True if the stored state is final and a provider call can't change it."""
+    if video.status not in TERMINAL_STATUSES:
+        return False
+    # A finished render without a result URL still needs one more fetch
+    return video.status != 'done' or bool(video.result_url)
+
+
+def is_segmented(video):
+    """True for the parent of a segmented render, which has no provider job of its own."""
+    return video.talk_id.startswith(SEGMENTED_TALK_ID_PREFIX)
+
+
+def fetch_provider_status(video):
+    """
+    Ask the video's provider for its current status.
+
+    Returns:
+        The provider's JSON payload, or None if the request failed
+    """
+    # Polls never wait long for quota: the stored state is good enough until the next one
+    max_wait = settings.VIDEO_STATUS_QUOTA_WAIT_SECONDS
+    try:
+        if video.platform == 'heygen':
+            response = provider_request(
+                'heygen', 'GET', f'https://api.heygen.com/v1/video_status.get?video_id={video.talk_id}',
+                max_wait=max_wait, headers={'X-Api-Key': api_key('heygen')}
+            )
+        else:
+            response = provider_request(
+                'd-id', 'GET', f'https://api.d-id.com/talks/{video.talk_id}',
+                max_wait=max_wait,
+                headers={'Accept': 'application/json', 'Authorization': f"Basic {api_key('d-id')}"}
+            )
+    except ProviderThrottled:
+        logger.info('Skipping %s status refresh of %s: rate limit', video.platform, video.talk_id)
+        return None
+
+    logger.info('%s status for %s: %s', video.platform, video.talk_id, response.status_code)
+    if not response.ok:
+        return None
+    return response.json()
+
+
+def use_provider_url(video, provider_url):
+    """
+    Serve a finished video from the provider until our copy is ready.
+
+    Returns:
+        The URL to copy into GCS, or None if the video is already re-hosted
+    """
+    if video.result_url and video.result_url.startswith(GCP_URL_PREFIX):
+        return None
+    video.result_url = provider_url
+    return provider_url
+
+
+def apply_provider_status(video, data):
+    """
+    Update and save a video from a provider status payload.
+
+    HeyGen statuses are normalized to the D-ID convention (done/error).
+    """
+    old_status = video.status
+    rehost_from = None
+
+    if video.platform == 'heygen':
+        if data.get('code') != 100:
+            return video
+        video_data = data['data']
+        heygen_status = video_data.get('status', video.status)
+        if heygen_status == 'completed':
+            video.status = 'done'
+        elif heygen_status == 'failed':
+            video.status = 'error'
+        else:
+            video.status = heygen_status  # processing, pending, etc.
+
+        if heygen_status == 'completed' and video_data.get('video_url'):
+            rehost_from = use_provider_url(video, video_data['video_url'])
+
+        if video_data.get('thumbnail_url'):
+            if not video.metadata:
+                video.metadata = {}
+            video.metadata['thumbnail_url'] = video_data['thumbnail_url']
+            video.metadata['gif_url'] = video_data.get('gif_url')
+            video.metadata['duration'] = video_data.get('duration')
+    else:
+        video.status = data.get('status', video.status)
+        if data.get('result_url'):
+            rehost_from = use_provider_url(video, data['result_url'])
+        if 'audio_url' in data:
+            video.audio_url = data['audio_url']
+        if 'metadata' in data:
+            video.metadata = data['metadata']
+
+    _record_timings(video, old_status)
+    video.save()
+    logger.info('Video %s status: %s -> %s', video.pk, old_status, video.status)
+    if video.segment_of_id:
+        # Segments are stitched straight from the provider URLs, never re-hosted
+        rehost_from = None
+        if video.status != old_status:
+            from .segments import roll_up
+            roll_up(video.segment_of_id)
+    if rehost_from:
+        # Only once the video row points at the provider URL: the swap to our copy replaces exactly that
+        from .rehosting import schedule_rehost
+        schedule_rehost(video, rehost_from)
+    if video.is_public and old_status != 'done' and video.status == 'done':
+        invalidate_feed()
+    if old_status not in TERMINAL_STATUSES and video.status in TERMINAL_STATUSES and settings.SCHEDULER_DISPATCH_IN_PROCESS:
+        # A render slot just freed up
+        from .scheduler import dispatch_soon
+        dispatch_soon()
+    return video
+
+
+def _record_timings(video, old_status):
+    """Note when the provider started and finished rendering; routing.py learns from these."""
+    if video.status == old_status:
+        return
+    now = timezone.now().isoformat()
+    config = dict(video.config or {})
+    if video.status in TERMINAL_STATUSES:
+        config.setdefault('finished_at', now)
+    elif video.status not in QUEUED_STATUSES:
+        config.setdefault('started_at', now)
+    video.config = config
+
+
+def needs_refresh(video):
+    """
+    Whether refresh_video_status() would call out for this video.
+
+    False for terminal and queued videos and for ones refreshed within the
+    last VIDEO_STATUS_REFRESH_SECONDS, whose stored state is current.
+    """
+    if is_terminal(video):
+        return False
+    if is_segmented(video):
+        return True
+    if video.status == 'queued':
+        return False
+    return not cache.get(f'video-status:fresh:{video.talk_id}')
+
+
+def refresh_video_status(video):
+    """
+    Bring a video's status up to date, calling the provider only when needed.
+
+    Returns:
+        The video, reloaded if another request refreshed it meanwhile
+    """
+    if is_terminal(video):
+        return video
+    if is_segmented(video):
+        from .segments import refresh_segmented
+        return refresh_segmented(video)
+    if video.status == 'queued':
+        # Not at a provider yet (see scheduler.py); nothing to ask
+        return video
+
+    fresh_key = f'video-status:fresh:{video.talk_id}'
+    lock_key = f'video-status:lock:{video.talk_id}'
+
+    if cache.get(fresh_key):
+        return video
+
+    # The lock outlives a slow provider call so a second one can't start meanwhile
+    if cache.add(lock_key, 1, settings.VIDEO_STATUS_LOCK_SECONDS):
+        try:
+            # Whoever held the lock before us may have just finished the job
+            video.refresh_from_db()
+            if is_terminal(video):
+                return video
+            data = fetch_provider_status(video)
+            if data is not None:
+                apply_provider_status(video, data)
+                cache.set(fresh_key, 1, settings.VIDEO_STATUS_REFRESH_SECONDS)
+            return video
+        finally:
+            cache.delete(lock_key)
+
+    # Another request is refreshing this video: wait for it, then read its result.
+    # If it takes longer return what's stored; the client polls again anyway.
+    deadline = time.time() + settings.VIDEO_STATUS_WAIT_SECONDS
+    while time.time() < deadline and cache.get(lock_key):
+        time.sleep(0.1)
+    video.refresh_from_db()
+    return video
+
+
+def _refresh_in_thread(video):
+    try:
+        refresh_video_status(video)
+    except Exception as e:
+        # One failing provider call shouldn't fail the whole batch; the stored state is returned
+        logger.exception('Error refreshing status of video %s: %s', video.pk, e)
+    finally:
+        # Worker threads get their own connection; don't leave it open
+        connection.close()
+
+
+def refresh_video_statuses(videos):
+    """
+    Refresh several videos concurrently, at most VIDEO_STATUS_MAX_CONCURRENCY at a time.
+
+    Videos in a terminal state are skipped without a provider call. The
+    instances are updated in place.
+    """
+    pending = [
+        video for video in videos
+        if not is_terminal(video) and (video.status != 'queued' or is_segmented(video))
+    ]
+    if not pending:
+        return
+    workers = min(settings.VIDEO_STATUS_MAX_CONCURRENCY, len(pending))
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        list(executor.map(_refresh_in_thread, pending))
@@ -8,23 +8,75 @@ import requests
 import logging
 from django.conf import settings
 import base64
-from django.core.files.uploadedfile import InMemoryUploadedFile
-from .serializers import RegisterSerializer, UserSerializer, VideoGenerationSerializer, ProfileSerializer
-from .models import VideoGeneration, Profile
+from .serializers import (
+    RegisterSerializer,
+    UserSerializer,
+    VideoGenerationSerializer,
+    VideoGenerationListSerializer,
+    GenerationBatchSerializer,
+    GenerationPipelineSerializer,
+    ProfileSerializer,
+    VIDEO_LIST_ONLY_FIELDS,
+    select_fields,
+)
+from .models import GenerationBatch, GenerationPipeline, UploadedAsset, VideoGeneration, Profile
 from agno.agent import Agent
 from agno.models.cerebras import CerebrasOpenAI
 from backend.settings import CEREBRUS_API_KEY
 import os
 import tempfile
+from api.batches import ManifestError, expand_rows, read_manifest, with_progress
+from api.conditional import is_not_modified, make_etag, not_modified, set_validators
+from api.feed_cache import invalidate_feed
+from api.idempotency import idempotent
+from api.pipelines import (
+    PipelineInputMissing,
+    claim_pipeline,
+    draft_script,
+    pipeline_of,
+    reusable_checkpoints,
+    run_heygen_pipeline,
+    start_pipeline
+)
+from api.render_cache import (
+    clone_render,
+    did_fingerprint,
+    find_cached_render,
+    heygen_fingerprint,
+    reuse_requested
+)
+from api.providers import (
+    ProviderError,
+    ProviderNotConfigured,
+    ProviderThrottled,
+    heygen_audio_voice,
+    heygen_text_voice
+)
+from api.routing import is_available, record_failure
+from api.scheduler import enqueue, enqueue_many, job_priority, placeholder_talk_id
+from api.segments import create_segmented_video, split_script
+from api.signed_uploads import AssetError, create_upload, finalize_upload, get_asset
+from api.uploads import store_upload, streaming_uploads
+from api.video_status import TERMINAL_STATUSES, needs_refresh, refresh_video_status, refresh_video_statuses
 from api.gcp_storage import (
     ensure_bucket_exists,
+    gcp_public_url,
     upload_file_object_to_gcp,
-    download_and_upload_to_gcp,
     generate_unique_blob_name
 )
 from pydub import AudioSegment
 from django.core.files.base import ContentFile
 
+# D-ID driver settings of every talk we create
+DID_DRIVER_CONFIG = {
+    "driver_url": "bank://lively/",
+    "motion_factor": 1.0,
+    "stitch": True,
+}
+
+# Output size of full HeyGen renders (drafts use HEYGEN_DRAFT_DIMENSION)
+HEYGEN_DIMENSION = {"width": 1280, "height": 720}
+
 
 def convert_audio_to_mp3(audio_file):
     """
@@ -71,6 +123,17 @@ def convert_audio_to_mp3(audio_file):
         raise
 
 
+def get_page_size(request, default=10, maximum=50):
+    """Read ?page_size= from the request, clamped to [1, maximum]."""
+    try:
+        page_size = int(request.GET.get('page_size', default))
+    except ValueError:
+        return default
+    if page_size < 1:
+        return default
+    return min(page_size, maximum)  # Limit max page size
+
+
 def get_tokens_for_user(user):
     refresh = RefreshToken.for_user(user)
     return {
@@ -141,8 +204,81 @@ def logout_view(request):
         return Response({"detail": "Logged out."}, status=status.HTTP_200_OK)
 
 
+def request_asset(request, field, kind):
+    """The finalized UploadedAsset referenced by a request field, or None if the field is absent."""
+    asset_id = request.data.get(field)
+    if not asset_id:
+        return None
+    return get_asset(request.user, asset_id, kind)
+
+
+@api_view(['POST'])
+@permission_classes([IsAuthenticated])
+def create_upload_url(request):
+    """
+    Authorize a direct upload of an asset to GCS (see signed_uploads.py).
+
+    Body: kind ('image', 'background' or 'audio'), filename, content_type,
+    size, md5 (base64 MD5 digest) and optionally resumable (true for a
+    resumable session URI instead of a signed PUT URL). Upload the bytes with
+    the returned method and headers, then call the finalize endpoint.
+    """
+    filename = request.data.get('filename') or 'upload'
+    content_type = (request.data.get('content_type') or '').lower()
+    try:
+        size = int(request.data.get('size'))
+    except (TypeError, ValueError):
+        return Response({"detail": "size must be an integer"}, status=status.HTTP_400_BAD_REQUEST)
+    resumable = str(request.data.get('resumable', 'false')).lower() == 'true'
+
+    try:
+        asset, upload = create_upload(
+            request.user, request.data.get('kind'), filename, content_type, size,
+            md5=request.data.get('md5') or '', resumable=resumable, origin=request.headers.get('Origin')
+        )
+    except AssetError as e:
+        return Response({"detail": str(e)}, status=status.HTTP_400_BAD_REQUEST)
+    except Exception as e:
+        logging.exception('Error creating upload URL: %s', e)
+        return Response({"detail": "Failed to create upload URL"}, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
+
+    return Response({
+        'id': asset.id,
+        'kind': asset.kind,
+        'blob_name': asset.blob_name,
+        'status': asset.status,
+        **upload,
+    }, status=status.HTTP_201_CREATED)
+
+
 @api_view(['POST'])
 @permission_classes([IsAuthenticated])
+def finalize_upload_view(request, pk):
+    """Verify a direct upload; once 'ready', pass its id to the create endpoints."""
+    try:
+        asset = UploadedAsset.objects.get(pk=pk, user=request.user)
+    except UploadedAsset.DoesNotExist:
+        return Response({"detail": "Not found"}, status=status.HTTP_404_NOT_FOUND)
+
+    try:
+        asset = finalize_upload(asset)
+    except AssetError as e:
+        return Response({"detail": str(e), "status": asset.status}, status=status.HTTP_400_BAD_REQUEST)
+
+    return Response({
+        'id': asset.id,
+        'kind': asset.kind,
+        'status': asset.status,
+        'size': asset.size,
+        'md5': asset.md5,
+        'url': gcp_public_url(asset.blob_name),
+    })
+
+
+@api_view(['POST'])
+@permission_classes([IsAuthenticated])
+@streaming_uploads(image_file='images')
+@idempotent
 def create_video_generation(request):
     name = request.data.get('name')
     input_type = request.data.get('input_type', 'text')  # 'text' or 'voice'
@@ -151,32 +287,73 @@ def create_video_generation(request):
     voice_id = request.data.get('voice_id')  # e.g., 'en-US-JennyNeural'
     voice_language = request.data.get('voice_language')  # e.g., 'English (United States)'
 
-    # Accept either an uploaded file (multipart/form-data) as 'image_file'
-    # or a direct source_url (for backward compatibility)
-    uploaded_file = request.FILES.get('image_file') if hasattr(request, 'FILES') else None
+    # Accept either an uploaded file (multipart/form-data) as 'image_file', a
+    # finalized direct upload as 'image_asset', or a direct source_url (for
+    # backward compatibility)
+    try:
+        image_asset = request_asset(request, 'image_asset', 'image')
+        audio_asset = request_asset(request, 'audio_asset', 'audio')
+    except AssetError as e:
+        return Response({"detail": str(e)}, status=status.HTTP_400_BAD_REQUEST)
+    uploaded_file = (request.FILES.get('image_file') if hasattr(request, 'FILES') else None) or image_asset
     source_url = request.data.get('source_url') if not uploaded_file else None
     
-    # Accept audio file for voice input type
-    audio_file = request.FILES.get('audio_file') if hasattr(request, 'FILES') else None
+    # Accept audio file (or an MP3 asset) for voice input type
+    audio_file = (request.FILES.get('audio_file') if hasattr(request, 'FILES') else None) or audio_asset
 
     # Validation based on input type
     if not name:
         return Response({"detail": "name is required"}, status=status.HTTP_400_BAD_REQUEST)
     
     if not uploaded_file and not source_url:
-        return Response({"detail": "image_file or source_url is required"}, status=status.HTTP_400_BAD_REQUEST)
+        return Response({"detail": "image_file, image_asset or source_url is required"}, status=status.HTTP_400_BAD_REQUEST)
     
     if input_type == 'text' and not script_input:
         return Response({"detail": "script_input is required for text input type"}, status=status.HTTP_400_BAD_REQUEST)
     
     if input_type == 'voice' and not audio_file:
-        return Response({"detail": "audio_file is required for voice input type"}, status=status.HTTP_400_BAD_REQUEST)
-
-    did_api_key = getattr(settings, 'DDI_API_KEY', None)
-    if not did_api_key:
+        return Response({"detail": "audio_file or audio_asset is required for voice input type"}, status=status.HTTP_400_BAD_REQUEST)
+
+    # Split a long script into segments that render in parallel (text input only)
+    segmented = str(request.data.get('segmented', 'false')).lower() == 'true'
+    if segmented and input_type != 'text':
+        return Response({"detail": "segmented is only supported for text input type"}, status=status.HTTP_400_BAD_REQUEST)
+
+    # 'auto' lets routing.py pick D-ID or HeyGen; D-ID voices don't exist at
+    # HeyGen, so text requests can only go there with a heygen_voice_id
+    provider = request.data.get('provider', 'd-id')
+    heygen_voice_id = request.data.get('heygen_voice_id')
+    if provider not in ('d-id', 'heygen', 'auto'):
+        return Response({"detail": "provider must be one of: d-id, heygen, auto"}, status=status.HTTP_400_BAD_REQUEST)
+    portable = input_type == 'voice' or bool(heygen_voice_id)
+    if provider == 'heygen' and not portable:
+        return Response({"detail": "heygen_voice_id is required for text input with provider heygen"}, status=status.HTTP_400_BAD_REQUEST)
+
+    driver_config = dict(DID_DRIVER_CONFIG)
+
+    # Identical inputs render an identical video: reuse a finished one if we have it
+    video_fingerprint = did_fingerprint(
+        uploaded_file, source_url, input_type, script_input, voice_provider, voice_id,
+        voice_language, audio_file, driver_config, provider, heygen_voice_id
+    )
+    if reuse_requested(request):
+        cached = find_cached_render(request.user, video_fingerprint)
+        if cached:
+            video_gen = clone_render(cached, request.user, name, script_input if script_input else "")
+            print(f"Reused render of video {cached.id} for VideoGeneration {video_gen.id}")
+            serializer = VideoGenerationSerializer(video_gen)
+            return Response(serializer.data, status=status.HTTP_201_CREATED)
+
+    if provider == 'd-id' and not getattr(settings, 'DDI_API_KEY', None):
         logging.error('DDI_API_KEY not set in settings')
         return Response({"detail": "D-ID API key not configured on server"}, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
 
+    # Which providers may serve the job; the scheduler picks one when dispatching it
+    if provider == 'auto' and portable:
+        candidates = ['d-id', 'heygen']
+    else:
+        candidates = ['heygen' if provider == 'heygen' else 'd-id']
+
     # Ensure GCP bucket exists
     try:
         ensure_bucket_exists()
@@ -186,13 +363,10 @@ def create_video_generation(request):
 
     # If an image file was uploaded, upload it to GCP first
     gcp_image_url = None
-    if uploaded_file and isinstance(uploaded_file, InMemoryUploadedFile):
+    if uploaded_file:
         try:
-            # Generate unique blob name for the image
-            blob_name = generate_unique_blob_name('images', uploaded_file.name)
-            
-            # Upload to GCP and get public URL
-            gcp_image_url = upload_file_object_to_gcp(uploaded_file, blob_name)
+            # Already in GCP if it was streamed there while the request was read
+            gcp_image_url = store_upload(uploaded_file, 'images')
             
             # Use GCP URL as source_url for D-ID
             source_url = gcp_image_url
@@ -204,17 +378,16 @@ def create_video_generation(request):
     # Build the request payload based on input type
     talk_payload = {
         'source_url': source_url,
-        "config": {
-            "driver_url": "bank://lively/",
-            "motion_factor": 1.0,
-            "stitch": True,
-        }
+        "config": dict(driver_config),
     }
 
     if input_type == 'voice':
         # Upload audio file to GCP (convert to MP3 first)
         gcp_audio_url = None
-        if audio_file and isinstance(audio_file, InMemoryUploadedFile):
+        if isinstance(audio_file, UploadedAsset):
+            # Already an MP3 in GCP
+            gcp_audio_url = store_upload(audio_file, 'audio')
+        elif audio_file:
             try:
                 # Convert audio to MP3 format
                 logging.info(f'Converting audio file {audio_file.name} to MP3...')
@@ -291,63 +464,62 @@ def create_video_generation(request):
                 provider_data['language'] = voice_language
             talk_payload['script']['provider'] = provider_data
 
-    print("=== D-ID API Request ===")
-    print(f"Payload: {talk_payload}")
-
     try:
-        response = requests.post(
-            'https://api.d-id.com/talks',
-            headers={
-                'Accept': 'application/json',
-                'Content-Type': 'application/json',
-                'Authorization': f'Basic {did_api_key}',
+        # What each candidate provider gets sent, and the fields it sets on the video
+        job_payload = {
+            'd-id': {
+                'talk_payload': talk_payload,
+                'fields': {'status': 'created'},
             },
-            json=talk_payload
-        )
-
-        print(f"D-ID Response Status: {response.status_code}")
-        print(f"D-ID Response Body: {response.text}")
-
-        if not response.ok:
-            logging.error(f"D-ID API error: {response.status_code} - {response.text}")
-            return Response({
-                "detail": "Failed to start video generation",
-                "error": response.text,
-                "status_code": response.status_code
-            }, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
-
-        data = response.json()
-        talk_id = data.get('id')
-        if not talk_id:
-            logging.error(f"No talk ID in D-ID response: {data}")
-            return Response({"detail": "No talk ID from D-ID", "response": data}, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
-
-        print(f"D-ID Talk ID: {talk_id}")
+        }
+        if 'heygen' in candidates:
+            job_payload['heygen'] = {
+                'image_url': gcp_image_url or source_url,
+                'title': name,
+                'voice': heygen_audio_voice(gcp_audio_url) if input_type == 'voice' else heygen_text_voice(enhanced_script, heygen_voice_id),
+                'fields': {
+                    'status': 'processing',
+                    'audio_url': gcp_audio_url if input_type == 'voice' else None,
+                    'voice_provider': 'heygen' if input_type == 'text' else 'Custom',
+                    'voice_id': heygen_voice_id if input_type == 'text' else 'Custom_voice_id',
+                },
+            }
 
-        # Save to DB with GCP image URL
+        # Save to DB with GCP image URL; the provider job starts when the scheduler dispatches it
         print("=== Creating VideoGeneration record ===")
-        video_gen = VideoGeneration.objects.create(
+        video_fields = dict(
             user=request.user,
             name=name,
-            platform='d-id',  # Set platform to d-id
+            platform=candidates[0],
             source_url=gcp_image_url or source_url,  # Store GCP URL
             script_input=script_input if script_input else "",
-            talk_id=talk_id,
-            status='created',
             input_type=input_type,  # Store input type
             voice_provider=voice_provider or 'Custom',
             voice_id=voice_id or 'Custom_voice_id',
             config={'fluent': False, 'pad_audio': 0.0},
+            fingerprint=video_fingerprint,
         )
-        print(f"VideoGeneration created: ID={video_gen.id}")
+        # Long scripts may render as parallel segments, stitched into one video (segments.py)
+        pieces = split_script(enhanced_script) if segmented else []
+        if len(pieces) > 1:
+            video_gen = create_segmented_video(
+                video_fields, pieces, job_payload, provider, candidates, priority=job_priority(request)
+            )
+            print(f"VideoGeneration created: ID={video_gen.id}, {len(pieces)} segments queued for {candidates}")
+        else:
+            video_gen = VideoGeneration.objects.create(
+                **video_fields, talk_id=placeholder_talk_id(), status='queued'
+            )
+            enqueue(video_gen, job_payload, provider, candidates, priority=job_priority(request))
+            print(f"VideoGeneration created: ID={video_gen.id}, queued for {candidates}")
 
         serializer = VideoGenerationSerializer(video_gen)
         return Response(serializer.data, status=status.HTTP_201_CREATED)
         
     except requests.exceptions.RequestException as e:
-        logging.error(f"Request exception calling D-ID API: {str(e)}", exc_info=True)
+        logging.error(f"Request exception calling provider API: {str(e)}", exc_info=True)
         return Response({
-            "detail": "Network error calling D-ID API",
+            "detail": "Network error calling provider API",
             "error": str(e)
         }, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
     except Exception as e:
@@ -361,21 +533,114 @@ def create_video_generation(request):
 @api_view(['GET'])
 @permission_classes([IsAuthenticated])
 def list_video_generations(request):
-    videos = VideoGeneration.objects.filter(user=request.user).order_by('-created_at')
-    serializer = VideoGenerationSerializer(videos, many=True)
-    return Response(serializer.data)
+    """
+    List the user's videos in the compact list representation (supports ?fields=).
+
+    By default the list is cursor-paginated on (created_at, id). With
+    ?stream=true the whole list is instead streamed as one JSON array, read
+    from the database in chunks, so memory stays flat however many videos
+    the account has.
+    """
+    import json
+    from django.http import StreamingHttpResponse
+    from rest_framework.utils.encoders import JSONEncoder
+    from .pagination import keyset_paginate, InvalidCursor
+    
+    # Segments of a segmented render are part of their parent video
+    videos = VideoGeneration.objects.filter(user=request.user, segment_of__isnull=True).select_related('user').only(
+        *VIDEO_LIST_ONLY_FIELDS
+    )
+    if request.GET.get('batch'):
+        try:
+            videos = videos.filter(batch_id=int(request.GET['batch']))
+        except ValueError:
+            return Response({"detail": "batch must be an integer"}, status=status.HTTP_400_BAD_REQUEST)
+    
+    if request.GET.get('draft') in ('true', 'false'):
+        videos = videos.filter(is_draft=request.GET['draft'] == 'true')
+    
+    if request.GET.get('stream', '').lower() == 'true':
+        serializer = VideoGenerationListSerializer(context={'request': request})
+        
+        def stream_rows():
+            yield '['
+            rows = videos.order_by('-created_at', '-id').iterator(chunk_size=settings.VIDEO_LIST_STREAM_CHUNK_SIZE)
+            for index, video in enumerate(rows):
+                item = json.dumps(serializer.to_representation(video), cls=JSONEncoder)
+                yield item if index == 0 else ',' + item
+            yield ']'
+        
+        return StreamingHttpResponse(stream_rows(), content_type='application/json')
+    
+    try:
+        page = keyset_paginate(
+            videos,
+            ('created_at', 'id'),
+            cursor=request.GET.get('cursor'),
+            page_size=get_page_size(request, default=20, maximum=100),
+        )
+    except InvalidCursor:
+        return Response({"detail": "Invalid cursor."}, status=status.HTTP_400_BAD_REQUEST)
+    
+    serializer = VideoGenerationListSerializer(page['results'], many=True, context={'request': request})
+    return Response({
+        'results': serializer.data,
+        'next_cursor': page['next_cursor'],
+        'has_next': page['has_next'],
+    })
+
+
+@api_view(['GET'])
+@permission_classes([IsAuthenticated])
+def video_generation_stats(request):
+    """Totals over the user's videos, for pages that need counts rather than the list itself."""
+    from django.db.models import Count, Sum
+    
+    totals = VideoGeneration.objects.filter(user=request.user, segment_of__isnull=True).aggregate(
+        videos_count=Count('id'), views_count=Sum('views_count'), likes_count=Sum('likes_count')
+    )
+    return Response({
+        'videos_count': totals['videos_count'],
+        'views_count': totals['views_count'] or 0,
+        'likes_count': totals['likes_count'] or 0,
+    })
+
+
+def video_etag(request, kind, video_id, modified_at, likes_count, views_count):
+    """
+    ETag for a single-video response.
+
+    modified_at covers every save(); the counters are included because they
+    are updated with F() expressions that don't touch modified_at.
+    """
+    return make_etag(
+        kind, request.user.id, video_id, modified_at.isoformat(),
+        likes_count, views_count, request.GET.get('fields', '')
+    )
 
 
 @api_view(['GET'])
 @permission_classes([IsAuthenticated])
 def get_video_generation(request, pk):
+    # Validate the client's copy from a handful of columns before loading the full row
+    validators = VideoGeneration.objects.filter(pk=pk, user=request.user).values_list(
+        'modified_at', 'likes_count', 'views_count'
+    ).first()
+    if validators is None:
+        return Response({"detail": "Not found"}, status=status.HTTP_404_NOT_FOUND)
+
+    modified_at, likes_count, views_count = validators
+    etag = video_etag(request, 'detail', pk, modified_at, likes_count, views_count)
+    if is_not_modified(request, etag, modified_at):
+        return not_modified(etag, modified_at)
+
     try:
         video = VideoGeneration.objects.get(pk=pk, user=request.user)
     except VideoGeneration.DoesNotExist:
         return Response({"detail": "Not found"}, status=status.HTTP_404_NOT_FOUND)
 
-    serializer = VideoGenerationSerializer(video)
-    return Response(serializer.data)
+    serializer = VideoGenerationSerializer(video, context={'request': request})
+    return set_validators(Response(serializer.data), etag, video.modified_at)
 
 
 @api_view(['POST'])
@@ -386,102 +651,218 @@ def update_video_status(request, pk):
     except VideoGeneration.DoesNotExist:
         return Response({"detail": "Not found"}, status=status.HTTP_404_NOT_FOUND)
 
-    # Handle based on platform
-    print(f"=== Checking video status for platform: {video.platform} ===")
-    
-    if video.platform == 'heygen':
-        # Fetch status from HeyGen
-        print(f"Fetching HeyGen video status for video_id: {video.talk_id}")
-        heygen_api_key = getattr(settings, 'HEYGEN_API_KEY', None)
-        if not heygen_api_key:
-            print("ERROR: HeyGen API key not configured")
-            return Response({"detail": "HeyGen API key not configured"}, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
+    # Nothing to refresh: answer the conditional request before touching the provider
+    if not needs_refresh(video):
+        etag = video_etag(request, 'status', video.id, video.modified_at, video.likes_count, video.views_count)
+        if is_not_modified(request, etag, video.modified_at):
+            return not_modified(etag, video.modified_at)
 
-        response = requests.get(
-            f'https://api.heygen.com/v1/video_status.get?video_id={video.talk_id}',
-            headers={'X-Api-Key': heygen_api_key}
+    try:
+        video = refresh_video_status(video)
+    except ProviderNotConfigured as e:
+        return Response({"detail": str(e)}, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
+
+    etag = video_etag(request, 'status', video.id, video.modified_at, video.likes_count, video.views_count)
+    if is_not_modified(request, etag, video.modified_at):
+        return not_modified(etag, video.modified_at)
+
+    serializer = VideoGenerationSerializer(video)
+    return set_validators(Response(serializer.data), etag, video.modified_at)
+
+
+@api_view(['POST'])
+@permission_classes([IsAuthenticated])
+def bulk_video_status(request):
+    """
+    Current status of several of the user's videos in one request.
+
+    Body: {"ids": [1, 2, 3]}. Videos still rendering are refreshed from their
+    provider concurrently (see refresh_video_statuses); finished ones come
+    straight from the database.
+    """
+    ids = request.data.get('ids')
+    if not isinstance(ids, list) or not ids:
+        return Response({"detail": "ids must be a non-empty list"}, status=status.HTTP_400_BAD_REQUEST)
+    try:
+        ids = list(dict.fromkeys(int(video_id) for video_id in ids))
+    except (TypeError, ValueError):
+        return Response({"detail": "ids must be integers"}, status=status.HTTP_400_BAD_REQUEST)
+    if len(ids) > settings.VIDEO_STATUS_BATCH_MAX:
+        return Response(
+            {"detail": f"At most {settings.VIDEO_STATUS_BATCH_MAX} ids per request"},
+            status=status.HTTP_400_BAD_REQUEST
         )
 
-        print(f"HeyGen Status Response: {response.status_code}")
-        print(f"HeyGen Status Data: {response.text}")
-
-        if response.ok:
-            data = response.json()
-            if data.get('code') == 100:
-                video_data = data['data']
-                old_status = video.status
-                heygen_status = video_data.get('status', video.status)
-                # Normalize HeyGen status to match D-ID convention
-                if heygen_status == 'completed':
-                    video.status = 'done'
-                elif heygen_status == 'failed':
-                    video.status = 'error'
-                else:
-                    video.status = heygen_status  # processing, pending, etc.
-                print(f"Status updated: {old_status} -> {video.status} (HeyGen: {heygen_status})")
-                
-                # If completed, upload to GCP
-                if video_data.get('status') == 'completed' and video_data.get('video_url'):
-                    heygen_video_url = video_data['video_url']
-                    print(f"Video completed! URL: {heygen_video_url}")
-                    
-                    if not video.result_url or not video.result_url.startswith('https://storage.googleapis.com/'):
-                        try:
-                            print("Downloading and uploading to GCP...")
-                            blob_name = generate_unique_blob_name('videos', f"{video.name}_{video.talk_id}.mp4")
-                            gcp_video_url = download_and_upload_to_gcp(heygen_video_url, blob_name)
-                            video.result_url = gcp_video_url
-                            print(f"Video uploaded to GCP: {gcp_video_url}")
-                        except Exception as e:
-                            logging.exception('Error uploading HeyGen video to GCP: %s', e)
-                            print(f"ERROR uploading to GCP, using HeyGen URL: {str(e)}")
-                            video.result_url = heygen_video_url
-                
-                if video_data.get('thumbnail_url'):
-                    if not video.metadata:
-                        video.metadata = {}
-                    video.metadata['thumbnail_url'] = video_data['thumbnail_url']
-                    video.metadata['gif_url'] = video_data.get('gif_url')
-                    video.metadata['duration'] = video_data.get('duration')
-                    print(f"Metadata updated with thumbnail and duration")
-                
-                video.save()
-                print("Video record saved successfully")
-    else:
-        # Fetch status from D-ID
-        did_api_key = getattr(settings, 'DDI_API_KEY', None)
-        if not did_api_key:
-            return Response({"detail": "D-ID API key not configured"}, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
-
-        response = requests.get(
-            f'https://api.d-id.com/talks/{video.talk_id}',
-            headers={'Accept': 'application/json', 'Authorization': f'Basic {did_api_key}'}
+    # Full rows: refreshed videos are saved back
+    videos = list(VideoGeneration.objects.filter(user=request.user, id__in=ids).select_related('user'))
+    refresh_video_statuses(videos)
+
+    found = {video.id for video in videos}
+    serializer = VideoGenerationListSerializer(videos, many=True, context={'request': request})
+    return Response({
+        'results': serializer.data,
+        'not_found': [video_id for video_id in ids if video_id not in found],
+    })
+
+
+@api_view(['POST'])
+@permission_classes([IsAuthenticated])
+@streaming_uploads(image_file='images')
+@idempotent
+def create_generation_batch(request):
+    """
+    Create one D-ID video per manifest row, all with the same avatar.
+
+    The manifest is an uploaded CSV/JSON file ('manifest') or, in a JSON
+    body, an 'items' array (format in batches.py). The avatar ('image_file',
+    'image_asset' or 'source_url') is uploaded once; the videos are queued at 'low'
+    priority by default and dispatched by the scheduler. Scripts are sent as
+    written: unlike create_video_generation there is no per-video LLM pass.
+    """
+    import json
+    from django.db import transaction
+
+    name = request.data.get('name')
+    try:
+        uploaded_file = request.FILES.get('image_file') or request_asset(request, 'image_asset', 'image')
+    except AssetError as e:
+        return Response({"detail": str(e)}, status=status.HTTP_400_BAD_REQUEST)
+    source_url = request.data.get('source_url') if not uploaded_file else None
+    manifest_file = request.FILES.get('manifest')
+    items = request.data.get('items') if manifest_file is None else None
+    script_template = request.data.get('script_template') or ''
+    defaults = {
+        'voice_provider': request.data.get('voice_provider'),
+        'voice_id': request.data.get('voice_id'),
+        'voice_language': request.data.get('voice_language'),
+    }
+
+    if not name:
+        return Response({"detail": "name is required"}, status=status.HTTP_400_BAD_REQUEST)
+    if not uploaded_file and not source_url:
+        return Response({"detail": "image_file, image_asset or source_url is required"}, status=status.HTTP_400_BAD_REQUEST)
+    if manifest_file is None and items is None:
+        return Response({"detail": "manifest file or items is required"}, status=status.HTTP_400_BAD_REQUEST)
+    if isinstance(items, str):
+        # items sent as a form field
+        try:
+            items = json.loads(items)
+        except ValueError:
+            return Response({"detail": "items must be a JSON array"}, status=status.HTTP_400_BAD_REQUEST)
+
+    try:
+        rows = read_manifest(manifest_file, items, max_items=settings.BATCH_MAX_ITEMS)
+        specs = expand_rows(rows, name, script_template, defaults)
+    except ManifestError as e:
+        return Response({"detail": e.message, "errors": e.errors}, status=status.HTTP_400_BAD_REQUEST)
+
+    if not getattr(settings, 'DDI_API_KEY', None):
+        logging.error('DDI_API_KEY not set in settings')
+        return Response({"detail": "D-ID API key not configured on server"}, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
+
+    # The shared avatar is uploaded once; every talk points at the same URL
+    if uploaded_file:
+        try:
+            ensure_bucket_exists()
+            source_url = store_upload(uploaded_file, 'images')
+        except Exception as e:
+            logging.exception('Error uploading batch image to GCP: %s', e)
+            return Response({"detail": "Failed to upload image to GCP"}, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
+
+    priority = job_priority(request, default='low')
+    with transaction.atomic():
+        batch = GenerationBatch.objects.create(
+            user=request.user,
+            name=name,
+            source_url=source_url,
+            priority=priority,
+            total=len(specs),
+            config={'script_template': script_template, **{k: v for k, v in defaults.items() if v}},
         )
+        videos = VideoGeneration.objects.bulk_create([
+            VideoGeneration(
+                user=request.user,
+                batch=batch,
+                name=spec['name'],
+                platform='d-id',
+                source_url=source_url,
+                script_input=spec['script'],
+                talk_id=placeholder_talk_id(),
+                status='queued',
+                input_type='text',
+                voice_provider=spec['voice_provider'] or 'Custom',
+                voice_id=spec['voice_id'] or 'Custom_voice_id',
+                config={'fluent': False, 'pad_audio': 0.0, 'batch_row': number},
+            )
+            for number, spec in enumerate(specs, start=1)
+        ], batch_size=500)
+
+        jobs = []
+        for video, spec in zip(videos, specs):
+            talk_payload = {
+                'source_url': source_url,
+                'config': dict(DID_DRIVER_CONFIG),
+                'script': {'type': 'text', 'input': spec['script']},
+            }
+            if spec['voice_provider'] and spec['voice_id']:
+                talk_payload['script']['provider'] = {'type': spec['voice_provider'], 'voice_id': spec['voice_id']}
+                if spec['voice_language']:
+                    talk_payload['script']['provider']['language'] = spec['voice_language']
+            jobs.append((video, {'d-id': {'talk_payload': talk_payload, 'fields': {'status': 'created'}}}))
+        enqueue_many(jobs, 'd-id', ['d-id'], priority)
+    print(f"GenerationBatch created: ID={batch.id}, {len(videos)} videos queued")
 
-        if response.ok:
-            data = response.json()
-            video.status = data.get('status', video.status)
-            
-            if 'result_url' in data and data['result_url']:
-                did_video_url = data['result_url']
-                
-                if not video.result_url or not video.result_url.startswith('https://storage.googleapis.com/'):
-                    try:
-                        blob_name = generate_unique_blob_name('videos', f"{video.name}_{video.talk_id}.mp4")
-                        gcp_video_url = download_and_upload_to_gcp(did_video_url, blob_name)
-                        video.result_url = gcp_video_url
-                    except Exception as e:
-                        logging.exception('Error uploading D-ID video to GCP: %s', e)
-                        video.result_url = did_video_url
-                
-            if 'audio_url' in data:
-                video.audio_url = data['audio_url']
-            if 'metadata' in data:
-                video.metadata = data['metadata']
-            video.save()
+    batch = with_progress(GenerationBatch.objects.filter(pk=batch.pk)).get()
+    data = GenerationBatchSerializer(batch).data
+    data['video_ids'] = [video.id for video in videos]
+    return Response(data, status=status.HTTP_201_CREATED)
 
-    serializer = VideoGenerationSerializer(video)
-    return Response(serializer.data)
+
+@api_view(['GET'])
+@permission_classes([IsAuthenticated])
+def list_generation_batches(request):
+    """The user's batches with their progress, newest first (cursor-paginated)."""
+    from .pagination import keyset_paginate, InvalidCursor
+
+    try:
+        page = keyset_paginate(
+            with_progress(GenerationBatch.objects.filter(user=request.user)),
+            ('created_at', 'id'),
+            cursor=request.GET.get('cursor'),
+            page_size=get_page_size(request, default=20, maximum=100),
+        )
+    except InvalidCursor:
+        return Response({"detail": "Invalid cursor."}, status=status.HTTP_400_BAD_REQUEST)
+
+    return Response({
+        'results': GenerationBatchSerializer(page['results'], many=True).data,
+        'next_cursor': page['next_cursor'],
+        'has_next': page['has_next'],
+    })
+
+
+@api_view(['GET'])
+@permission_classes([IsAuthenticated])
+def get_generation_batch(request, pk):
+    """
+    Aggregate progress of a batch.
+
+    The batch's renders in flight at the provider are refreshed first, so
+    polling this one resource is enough to follow (and advance) the whole
+    batch. Its videos are listed by GET /api/videos/?batch=<id>.
+    """
+    if not GenerationBatch.objects.filter(pk=pk, user=request.user).exists():
+        return Response({"detail": "Not found"}, status=status.HTTP_404_NOT_FOUND)
+
+    in_flight = list(
+        VideoGeneration.objects.filter(batch_id=pk)
+        .exclude(status__in=TERMINAL_STATUSES | {'queued'})
+        .select_related('user')[:settings.VIDEO_STATUS_BATCH_MAX]
+    )
+    refresh_video_statuses(in_flight)
+
+    batch = with_progress(GenerationBatch.objects.filter(pk=pk)).get()
+    return Response(GenerationBatchSerializer(batch).data)
 
 
 @api_view(['GET', 'PUT', 'PATCH'])
@@ -643,47 +1024,161 @@ def verify_otp_and_reset_password(request):
 @api_view(['GET'])
 @permission_classes([IsAuthenticated])
 def get_public_videos(request):
-    """Get paginated list of public videos for social feed"""
-    from django.core.paginator import Paginator, EmptyPage, PageNotAnInteger
+    """
+    Get a cursor-paginated list of public videos for the social feed.
+
+    Pages are fetched by seeking past the (created_at, id) of the last row
+    of the previous page, so page 500 costs the same as page 1. Pass
+    ?sort=popular to order by likes_count or ?sort=trending to order by the
+    precomputed time-decayed score (see trending.py) instead of recency, and
+    ?include_count=true to also get an approximate, cached total count.
+
+    The user-independent part of each page is cached (see feed_cache) and
+    only the viewer's is_liked flags are computed per request.
+    """
+    from django.core.cache import cache
+    from django.db.models import F
+    from .feed_cache import get_feed_page, get_feed_version
+    from .models import VideoLike
+    from .pagination import keyset_paginate, InvalidCursor
     
-    page = request.GET.get('page', 1)
-    page_size = request.GET.get('page_size', 10)
+    feed_orderings = {
+        'recent': ('created_at', 'id'),
+        'popular': ('likes_count', 'id'),
+        'trending': ('trending_score', 'id'),
+    }
     
-    try:
-        page_size = int(page_size)
-        if page_size > 50:  # Limit max page size
-            page_size = 50
-    except ValueError:
-        page_size = 10
+    sort = request.GET.get('sort', 'recent')
+    if sort not in feed_orderings:
+        return Response({"detail": f"sort must be one of: {', '.join(feed_orderings)}"}, status=status.HTTP_400_BAD_REQUEST)
     
-    # Get public videos with completed status
-    videos = VideoGeneration.objects.filter(
-        is_public=True,
-        status='done'
-    ).select_related('user').prefetch_related('likes')
+    cursor = request.GET.get('cursor')
+    page_size = get_page_size(request)
     
-    paginator = Paginator(videos, page_size)
+    # Every change that can alter a feed page bumps the feed version, so it
+    # validates the client's copy without touching the database
+    etag = make_etag(
+        'feed', get_feed_version(), request.user.id, sort, cursor or '', page_size,
+        request.GET.get('fields', ''), request.GET.get('include_count', '')
+    )
+    if is_not_modified(request, etag):
+        return not_modified(etag)
+    
+    def build_page():
+        # Get public videos with completed status
+        videos = VideoGeneration.objects.filter(
+            is_public=True,
+            status='done'
+        ).select_related('user').only(*VIDEO_LIST_ONLY_FIELDS)
+        if sort == 'trending':
+            # Scores are precomputed by compute_trending; no aggregation per request
+            videos = videos.filter(trending__isnull=False).annotate(trending_score=F('trending__score'))
+        
+        page = keyset_paginate(videos, feed_orderings[sort], cursor=cursor, page_size=page_size)
+        
+        # Serialized without a request: the per-user is_liked flag and
+        # ?fields= are applied below, on top of the shared cached page
+        results = [dict(item) for item in VideoGenerationListSerializer(page['results'], many=True).data]
+        
+        return {
+            'results': results,
+            'next_cursor': page['next_cursor'],
+            'has_next': page['has_next'],
+        }
     
     try:
-        videos_page = paginator.page(page)
-    except PageNotAnInteger:
-        videos_page = paginator.page(1)
-    except EmptyPage:
-        videos_page = paginator.page(paginator.num_pages)
-    
-    serializer = VideoGenerationSerializer(
-        videos_page.object_list,
-        many=True,
-        context={'request': request}
+        page = get_feed_page((sort, cursor or '', page_size), build_page)
+    except InvalidCursor:
+        return Response({"detail": "Invalid cursor."}, status=status.HTTP_400_BAD_REQUEST)
+    
+    # One query for the viewer's likes on this page
+    video_ids = [item['id'] for item in page['results']]
+    liked_ids = set(
+        VideoLike.objects.filter(user=request.user, video_id__in=video_ids).values_list('video_id', flat=True)
     )
     
+    data = {
+        'results': select_fields(
+            [dict(item, is_liked=item['id'] in liked_ids) for item in page['results']], request
+        ),
+        'next_cursor': page['next_cursor'],
+        'has_next': page['has_next'],
+        'page_size': page_size,
+    }
+    
+    if request.GET.get('include_count', '').lower() == 'true':
+        # Approximate: shared across users and refreshed at most once per TTL
+        count = cache.get_or_set(
+            'social_feed:count',
+            lambda: VideoGeneration.objects.filter(is_public=True, status='done').count(),
+            settings.SOCIAL_FEED_COUNT_CACHE_SECONDS
+        )
+        data['count'] = count
+        data['total_pages'] = (count + page_size - 1) // page_size
+    
+    return set_validators(Response(data), etag)
+
+
+@api_view(['GET'])
+@permission_classes([IsAuthenticated])
+def search_video_generations(request):
+    """Full-text search over the current user's own projects (name and script)"""
+    from .pagination import InvalidCursor
+    from .search import get_search_backend
+    
+    query = request.GET.get('q', '')
+    try:
+        page = get_search_backend().search(
+            query,
+            user=request.user,
+            cursor=request.GET.get('cursor'),
+            page_size=get_page_size(request, default=20),
+            queryset=VideoGeneration.objects.select_related('user').only(*VIDEO_LIST_ONLY_FIELDS),
+        )
+    except InvalidCursor:
+        return Response({"detail": "Invalid cursor."}, status=status.HTTP_400_BAD_REQUEST)
+    
+    serializer = VideoGenerationListSerializer(page['results'], many=True, context={'request': request})
     return Response({
         'results': serializer.data,
-        'count': paginator.count,
-        'total_pages': paginator.num_pages,
-        'current_page': videos_page.number,
-        'has_next': videos_page.has_next(),
-        'has_previous': videos_page.has_previous()
+        'next_cursor': page['next_cursor'],
+        'has_next': page['has_next'],
+    })
+
+
+@api_view(['GET'])
+@permission_classes([IsAuthenticated])
+def search_public_videos(request):
+    """Full-text search over the public social feed"""
+    from .models import VideoLike
+    from .pagination import InvalidCursor
+    from .search import get_search_backend
+    
+    query = request.GET.get('q', '')
+    try:
+        page = get_search_backend().search(
+            query,
+            public_only=True,
+            cursor=request.GET.get('cursor'),
+            page_size=get_page_size(request, default=20),
+            queryset=VideoGeneration.objects.select_related('user').only(*VIDEO_LIST_ONLY_FIELDS),
+        )
+    except InvalidCursor:
+        return Response({"detail": "Invalid cursor."}, status=status.HTTP_400_BAD_REQUEST)
+    
+    results = VideoGenerationListSerializer(page['results'], many=True).data
+    
+    # One query for the viewer's likes on this page
+    liked_ids = set(
+        VideoLike.objects.filter(
+            user=request.user, video_id__in=[item['id'] for item in results]
+        ).values_list('video_id', flat=True)
+    )
+    
+    return Response({
+        'results': select_fields([dict(item, is_liked=item['id'] in liked_ids) for item in results], request),
+        'next_cursor': page['next_cursor'],
+        'has_next': page['has_next'],
     })
 
 
@@ -696,8 +1191,14 @@ def toggle_video_publish(request, pk):
     except VideoGeneration.DoesNotExist:
         return Response({"detail": "Video not found."}, status=status.HTTP_404_NOT_FOUND)
     
+    if video.is_draft and not video.is_public:
+        return Response({"detail": "Drafts can't be published; promote the draft first."}, status=status.HTTP_400_BAD_REQUEST)
+    if video.segment_of_id and not video.is_public:
+        return Response({"detail": "Segments can't be published; publish the stitched video."}, status=status.HTTP_400_BAD_REQUEST)
+    
     video.is_public = not video.is_public
     video.save()
+    invalidate_feed()
     
     serializer = VideoGenerationSerializer(video, context={'request': request})
     return Response(serializer.data)
@@ -707,19 +1208,34 @@ def toggle_video_publish(request, pk):
 @permission_classes([IsAuthenticated])
 def like_video(request, pk):
     """Like or unlike a video"""
+    from django.db import transaction
+    from django.db.models import F
     from .models import VideoLike
     
     try:
-        video = VideoGeneration.objects.get(pk=pk, is_public=True)
+        video = VideoGeneration.objects.only('id').get(pk=pk, is_public=True)
     except VideoGeneration.DoesNotExist:
         return Response({"detail": "Video not found."}, status=status.HTTP_404_NOT_FOUND)
     
-    # Check if already liked
-    like, created = VideoLike.objects.get_or_create(user=request.user, video=video)
+    # The like row and the denormalized likes_count change together
+    with transaction.atomic():
+        # Check if already liked
+        like, created = VideoLike.objects.get_or_create(user=request.user, video=video)
+        
+        if created:
+            delta = 1
+        else:
+            # Unlike; a concurrent unlike may already have removed the row
+            deleted, _ = like.delete()
+            delta = -1 if deleted else 0
+        
+        if delta:
+            VideoGeneration.objects.filter(pk=video.pk).update(likes_count=F('likes_count') + delta)
+    
+    # Like counts are part of the cached feed pages
+    invalidate_feed(counts_only=True)
     
     if not created:
-        # Unlike
-        like.delete()
         return Response({"detail": "Video unliked.", "is_liked": False})
     else:
         # Liked
@@ -729,12 +1245,18 @@ def like_video(request, pk):
 @api_view(['POST'])
 @permission_classes([IsAuthenticated])
 def record_video_view(request, pk):
-    """Record a view on a video - only counts unique views per user"""
+    """
+    Record a view on a video - only counts unique views per user.
+
+    The VideoView insert is the only write in the request path; views_count is
+    updated write-behind by the view counter buffer (see counters.py).
+    """
+    from django.db import IntegrityError, transaction
+    from .counters import view_counts
     from .models import VideoView
     
-    try:
-        video = VideoGeneration.objects.get(pk=pk, is_public=True)
-    except VideoGeneration.DoesNotExist:
+    views_count = VideoGeneration.objects.filter(pk=pk, is_public=True).values_list('views_count', flat=True).first()
+    if views_count is None:
         return Response({"detail": "Video not found."}, status=status.HTTP_404_NOT_FOUND)
     
     # Get client IP
@@ -744,24 +1266,71 @@ def record_video_view(request, pk):
     else:
         ip_address = request.META.get('REMOTE_ADDR')
     
-    # Use get_or_create to ensure only one view per user per video
-    view, created = VideoView.objects.get_or_create(
-        user=request.user,
-        video=video,
-        defaults={'ip_address': ip_address}
-    )
+    # The (user, video) unique constraint ensures only one view per user per video
+    try:
+        with transaction.atomic():
+            VideoView.objects.create(user=request.user, video_id=pk, ip_address=ip_address)
+        created = True
+    except IntegrityError:
+        created = False
+    
+    if created:
+        view_counts.record(pk)
+    
+    # Includes views buffered in this process that haven't been flushed yet
+    views_count += view_counts.pending(pk)
     
     if created:
-        # Update view count only if it's a new view
-        video.views_count = video.views.count()
-        video.save()
-        return Response({"detail": "View recorded.", "views_count": video.views_count, "is_new_view": True})
+        return Response({"detail": "View recorded.", "views_count": views_count, "is_new_view": True})
     else:
-        return Response({"detail": "View already recorded.", "views_count": video.views_count, "is_new_view": False})
+        return Response({"detail": "View already recorded.", "views_count": views_count, "is_new_view": False})
+
+
+def heygen_pipeline_response(pipeline, **files):
+    """Run a HeyGen pipeline; the new video, or the error with the pipeline to resume."""
+    try:
+        video_gen = run_heygen_pipeline(pipeline, **files)
+    except PipelineInputMissing as e:
+        return Response(
+            {"detail": str(e), "pipeline": GenerationPipelineSerializer(pipeline).data},
+            status=status.HTTP_400_BAD_REQUEST
+        )
+    except ProviderThrottled as e:
+        print(f"HeyGen rate limit reached, retry in {e.retry_after:.0f}s")
+        response = Response(
+            {"detail": e.message, "pipeline": GenerationPipelineSerializer(pipeline).data},
+            status=status.HTTP_503_SERVICE_UNAVAILABLE
+        )
+        response['Retry-After'] = str(max(int(e.retry_after), 1))
+        return response
+    except ProviderError as e:
+        print(f"ERROR: {e.message}: {e.status_code} {e.response_text}")
+        if e.outage:
+            record_failure('heygen')
+        return Response({
+            "detail": e.message,
+            "error": e.response_text,
+            "status_code": e.status_code,
+            "pipeline": GenerationPipelineSerializer(pipeline).data
+        }, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
+    except Exception as e:
+        logging.error(f"Pipeline {pipeline.id} failed at {pipeline.failed_stage}: {str(e)}", exc_info=True)
+        return Response({
+            "status": "error",
+            "message": str(e),
+            "type": type(e).__name__,
+            "pipeline": GenerationPipelineSerializer(pipeline).data
+        }, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
+
+    print(f"VideoGeneration created: ID={video_gen.id} (pipeline {pipeline.id}, run {pipeline.runs})")
+    serializer = VideoGenerationSerializer(video_gen)
+    return Response(serializer.data, status=status.HTTP_201_CREATED)
 
 
 @api_view(['POST'])
 @permission_classes([IsAuthenticated])
+@streaming_uploads(avatar_file='heygen/avatars/{user}', background_file='heygen/backgrounds/{user}')
+@idempotent
 def create_heygen_video(request):
     """
     Create HeyGen-style video endpoint with complete API integration.
@@ -769,31 +1338,86 @@ def create_heygen_video(request):
     try:
         print("=== HeyGen Video Creation Started ===")
         
+        # Draft mode: a quick low-resolution preview of the script's first sentence
+        draft = str(request.data.get('draft', 'false')).lower() == 'true'
+        
+        # Iterating on an earlier video: its stored uploads, talking photo and
+        # settings are reused for anything this request leaves out
+        parent = None
+        parent_params = {}
+        reused = {}
+        if request.data.get('parent_id'):
+            parent = VideoGeneration.objects.filter(pk=request.data['parent_id'], user=request.user).first()
+            parent_pipeline = pipeline_of(parent) if parent else None
+            if parent_pipeline is None or parent_pipeline.state != 'completed':
+                return Response(
+                    {"detail": "parent_id must be one of your HeyGen videos"},
+                    status=status.HTTP_400_BAD_REQUEST
+                )
+            parent_params = parent_pipeline.params
+        
+        def field(name, default):
+            return request.data.get(name, parent_params.get(name, default))
+        
         # Extract form data
-        project_name = request.data.get('project_name')
-        input_type = request.data.get('input_type')
-        script = request.data.get('script', '')
-        avatar_shape = request.data.get('avatar_shape', 'square')
-        background_type = request.data.get('background_type', 'image')
-        need_subtitles = request.data.get('need_subtitles', 'false').lower() == 'true'
-        avatar_scale = float(request.data.get('avatar_scale', 1.0))
-        avatar_x = float(request.data.get('avatar_x', 0.0))
-        avatar_y = float(request.data.get('avatar_y', 0.0))
-        voice_id = request.data.get('voice_id', '')
-        voice_name = request.data.get('voice_name', '')
-        
-        avatar_file = request.FILES.get('avatar_file')
-        background_file = request.FILES.get('background_file')
-        audio_file = request.FILES.get('audio_file')
-        
-        print(f"Project: {project_name}, Input Type: {input_type}")
-        print(f"Files - Avatar: {avatar_file.name if avatar_file else None}, BG: {background_file.name if background_file else None}")
+        project_name = field('project_name', None)
+        input_type = field('input_type', None)
+        script = field('script', '')
+        avatar_shape = field('avatar_shape', 'square')
+        background_type = field('background_type', 'image')
+        need_subtitles = str(field('need_subtitles', 'false')).lower() == 'true'
+        avatar_scale = float(field('avatar_scale', 1.0))
+        avatar_x = float(field('avatar_x', 0.0))
+        avatar_y = float(field('avatar_y', 0.0))
+        voice_id = field('voice_id', '')
+        voice_name = field('voice_name', '')
+        
+        # Files, or finalized direct uploads (signed_uploads.py) in their place
+        try:
+            avatar_file = request.FILES.get('avatar_file') or request_asset(request, 'avatar_asset', 'image')
+            background_file = request.FILES.get('background_file') or request_asset(request, 'background_asset', 'background')
+            audio_file = request.FILES.get('audio_file') or request_asset(request, 'audio_asset', 'audio')
+        except AssetError as e:
+            return Response({"detail": str(e)}, status=status.HTTP_400_BAD_REQUEST)
+        
+        if parent is not None:
+            reuse = []
+            if not avatar_file:
+                reuse += ['avatar', 'talking_photo']
+            if not background_file:
+                reuse.append('background')
+            if not audio_file:
+                reuse += ['audio', 'draft_audio']
+            reused = reusable_checkpoints(parent_pipeline, reuse)
+        
+        print(f"Project: {project_name}, Input Type: {input_type}, Draft: {draft}, Parent: {parent.id if parent else None}")
+        print(f"Files - Avatar: {avatar_file.name if avatar_file else None}, BG: {background_file.name if background_file else None}, reused: {list(reused)}")
         
         # Validation
-        if not project_name or not avatar_file or not background_file:
+        if not project_name or not (avatar_file or 'avatar' in reused) or not (background_file or 'background' in reused):
             print("ERROR: Missing required fields")
             return Response({"detail": "Missing required fields"}, status=status.HTTP_400_BAD_REQUEST)
         
+        dimension = settings.HEYGEN_DRAFT_DIMENSION if draft else HEYGEN_DIMENSION
+        
+        # Identical inputs render an identical video: reuse a finished one if we have it.
+        # Requests reusing a parent's stored files have no content hashes to compare.
+        video_fingerprint = ''
+        if avatar_file and background_file:
+            video_fingerprint = heygen_fingerprint(
+                avatar_file, background_file, background_type, avatar_shape, avatar_scale,
+                avatar_x, avatar_y, need_subtitles, input_type, script, voice_id, audio_file, dimension,
+                draft=draft
+            )
+        if video_fingerprint and reuse_requested(request):
+            cached = find_cached_render(request.user, video_fingerprint)
+            if cached:
+                spoken = draft_script(script) if draft else script
+                video_gen = clone_render(cached, request.user, project_name, spoken if input_type == 'text' else '')
+                print(f"Reused render of video {cached.id} for VideoGeneration {video_gen.id}")
+                serializer = VideoGenerationSerializer(video_gen)
+                return Response(serializer.data, status=status.HTTP_201_CREATED)
+        
         try:
             heygen_api_key = settings.HEYGEN_API_KEY
             print(f"HeyGen API Key loaded: {heygen_api_key[:20] if heygen_api_key else 'None'}...")
@@ -806,165 +1430,56 @@ def create_heygen_video(request):
             print("ERROR: HeyGen API key is empty")
             return Response({"detail": "HeyGen API key is empty"}, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
         
+        if not is_available('heygen'):
+            response = Response(
+                {"detail": "HeyGen is temporarily unavailable, please retry shortly"},
+                status=status.HTTP_503_SERVICE_UNAVAILABLE
+            )
+            response['Retry-After'] = str(settings.PROVIDER_BREAKER_COOLDOWN_SECONDS)
+            return response
+        
         print("Step 1: Ensuring GCP bucket exists...")
         ensure_bucket_exists()
         
-        # Upload avatar to GCP
-        print("Step 2: Uploading avatar to GCP...")
-        avatar_blob_name = generate_unique_blob_name(f"heygen/avatars/{request.user.id}", avatar_file.name)
-        avatar_gcp_url = upload_file_object_to_gcp(avatar_file, avatar_blob_name)
-        print(f"Avatar uploaded to GCP: {avatar_gcp_url}")
-        
-        # Upload to HeyGen talking photo API
-        print("Step 3: Uploading avatar to HeyGen...")
-        avatar_file.seek(0)
-        talking_photo_response = requests.post(
-            'https://upload.heygen.com/v1/talking_photo',
-            headers={'x-api-key': heygen_api_key, 'Content-Type': avatar_file.content_type},
-            data=avatar_file.read()
+        # The remaining steps are checkpointed stages (pipelines.py): a retry of
+        # this request within PIPELINE_RESUME_HOURS picks up where it failed
+        pipeline = start_pipeline(request.user, video_fingerprint, {
+            'project_name': project_name,
+            'input_type': input_type,
+            'script': script,
+            'avatar_shape': avatar_shape,
+            'background_type': background_type,
+            'need_subtitles': need_subtitles,
+            'avatar_scale': avatar_scale,
+            'avatar_x': avatar_x,
+            'avatar_y': avatar_y,
+            'voice_id': voice_id,
+            'voice_name': voice_name,
+            'dimension': dimension,
+            'priority': job_priority(request),
+            'has_audio': audio_file is not None or 'audio' in reused,
+            'draft': draft,
+            'parent_id': parent.id if parent else None,
+        }, checkpoints=reused)
+        print(f"Pipeline {pipeline.id}: run {pipeline.runs}, stages done: {list(pipeline.checkpoints) or 'none'}")
+        return heygen_pipeline_response(
+            pipeline, avatar_file=avatar_file, background_file=background_file, audio_file=audio_file
         )
         
-        print(f"HeyGen Talking Photo Response Status: {talking_photo_response.status_code}")
-        print(f"HeyGen Talking Photo Response: {talking_photo_response.text}")
-        
-        if not talking_photo_response.ok:
-            print(f"ERROR: HeyGen talking photo upload failed")
-            return Response({
-                "detail": "Failed to upload avatar to HeyGen",
-                "error": talking_photo_response.text,
-                "status_code": talking_photo_response.status_code
-            }, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
-        
-        talking_photo_data = talking_photo_response.json()
-        if talking_photo_data.get('code') != 100:
-            print(f"ERROR: HeyGen returned error code: {talking_photo_data}")
-            return Response({
-                "detail": "HeyGen talking photo upload failed",
-                "response": talking_photo_data
-            }, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
-        
-        talking_photo_id = talking_photo_data['data']['talking_photo_id']
-        talking_photo_url = talking_photo_data['data']['talking_photo_url']
-        print(f"Talking Photo ID: {talking_photo_id}")
-        
-        # Upload background to GCP
-        print("Step 4: Uploading background to GCP...")
-        bg_blob_name = generate_unique_blob_name(f"heygen/backgrounds/{request.user.id}", background_file.name)
-        bg_gcp_url = upload_file_object_to_gcp(background_file, bg_blob_name)
-        print(f"Background uploaded to GCP: {bg_gcp_url}")
-        
-        # Handle audio if needed
-        audio_gcp_url = None
-        if input_type == 'audio' and audio_file:
-            print("Step 5: Processing audio file...")
-            converted_audio = convert_audio_to_mp3(audio_file)
-            audio_blob_name = generate_unique_blob_name(f"heygen/audio/{request.user.id}", "audio.mp3")
-            audio_gcp_url = upload_file_object_to_gcp(converted_audio, audio_blob_name)
-            print(f"Audio uploaded to GCP: {audio_gcp_url}")
-        
-        # Prepare HeyGen request
-        video_input = {
-            "character": {
-                "type": "talking_photo",
-                "talking_photo_id": talking_photo_id,
-                "scale": avatar_scale,
-                "talking_photo_style": avatar_shape,  # "circle" or "square"
-                "offset": {"x": avatar_x, "y": avatar_y},
-                "talking_style": "stable",
-                "expression": "default",
-                "engine_id": "avatar_iv"
-            },
-            "background": {
-                "type": background_type,
-                "url": bg_gcp_url,
-                "play_style": "loop" if background_type == "video" else "static"
-            }
-        }
-        
-        if input_type == 'text':
-            video_input["voice"] = {
-                "type": "text",
-                "input_text": script,
-                "voice_id": voice_id,
-                "speed": 1.0,
-                "pitch": 0
-            }
-        else:
-            video_input["voice"] = {
-                "type": "audio",
-                "audio_url": audio_gcp_url  # HeyGen uses "audio_url" not "input_audio_url"
-            }
-        
-        heygen_payload = {
-            "title": project_name,
-            "caption": need_subtitles,
-            "dimension": {"width": 1280, "height": 720},
-            "video_inputs": [video_input]
-        }
-        
-        print(f"HeyGen Payload: {heygen_payload}")
-        
-        # Call HeyGen video generation API
-        print("Step 7: Calling HeyGen video generation API...")
-        heygen_response = requests.post(
-            'https://api.heygen.com/v2/video/generate',
-            headers={'X-Api-Key': heygen_api_key, 'Content-Type': 'application/json'},
-            json=heygen_payload
-        )
-        
-        print(f"HeyGen Video Gen Response Status: {heygen_response.status_code}")
-        print(f"HeyGen Video Gen Response: {heygen_response.text}")
-        
-        if not heygen_response.ok:
-            print(f"ERROR: HeyGen video generation failed")
-            return Response({
-                "detail": "Failed to generate video with HeyGen",
-                "error": heygen_response.text,
-                "status_code": heygen_response.status_code
-            }, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
-        
-        heygen_video_data = heygen_response.json()
-        if heygen_video_data.get('error'):
-            print(f"ERROR: HeyGen returned error: {heygen_video_data}")
-            return Response({
-                "detail": "HeyGen video generation error",
-                "response": heygen_video_data
-            }, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
-        
-        video_id = heygen_video_data['data']['video_id']
-        print(f"HeyGen Video ID: {video_id}")
-        
-        # Save to database
-        print("Step 8: Saving to database...")
-        video_gen = VideoGeneration.objects.create(
-            user=request.user,
-            name=project_name,
-            platform='heygen',
-            source_url=avatar_gcp_url,
-            script_input=script if input_type == 'text' else '',
-            talk_id=video_id,
-            status='processing',
-            talking_photo_id=talking_photo_id,
-            talking_photo_url=talking_photo_url,
-            background_url=bg_gcp_url,
-            background_type=background_type,
-            avatar_shape=avatar_shape,
-            avatar_scale=avatar_scale,
-            avatar_x=avatar_x,
-            avatar_y=avatar_y,
-            need_subtitles=need_subtitles,
-            input_type=input_type,
-            audio_url=audio_gcp_url,
-            voice_id=voice_id if input_type == 'text' else None,
-            voice_name=voice_name if input_type == 'text' else None,
-            config={'heygen_payload': heygen_payload}
-        )
-        print(f"VideoGeneration created: ID={video_gen.id}")
-        
-        serializer = VideoGenerationSerializer(video_gen)
-        print("=== HeyGen Video Creation Completed Successfully ===")
-        return Response(serializer.data, status=status.HTTP_201_CREATED)
-        
+    except ProviderThrottled as e:
+        print(f"HeyGen rate limit reached, retry in {e.retry_after:.0f}s")
+        response = Response({"detail": e.message}, status=status.HTTP_503_SERVICE_UNAVAILABLE)
+        response['Retry-After'] = str(max(int(e.retry_after), 1))
+        return response
+    except ProviderError as e:
+        print(f"ERROR: {e.message}: {e.status_code} {e.response_text}")
+        if e.outage:
+            record_failure('heygen')
+        return Response({
+            "detail": e.message,
+            "error": e.response_text,
+            "status_code": e.status_code
+        }, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
     except requests.exceptions.RequestException as e:
         print(f"ERROR: Request exception: {str(e)}")
         logging.error(f"Request exception in create_heygen_video: {str(e)}", exc_info=True)
@@ -982,3 +1497,83 @@ def create_heygen_video(request):
             "message": str(e),
             "type": type(e).__name__
         }, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
+
+
+@api_view(['GET'])
+@permission_classes([IsAuthenticated])
+def get_heygen_pipeline(request, pk):
+    """Stages of a HeyGen video creation: which are done and where it failed."""
+    pipeline = GenerationPipeline.objects.filter(pk=pk, user=request.user).first()
+    if pipeline is None:
+        return Response({"detail": "Not found"}, status=status.HTTP_404_NOT_FOUND)
+    return Response(GenerationPipelineSerializer(pipeline).data)
+
+
+@api_view(['POST'])
+@permission_classes([IsAuthenticated])
+@streaming_uploads(avatar_file='heygen/avatars/{user}', background_file='heygen/backgrounds/{user}')
+def resume_heygen_pipeline(request, pk):
+    """
+    Resume a failed HeyGen video creation from its first unfinished stage.
+
+    No files are needed once the inputs are stored; otherwise send the
+    missing avatar_file, background_file or audio_file again.
+    """
+    pipeline = GenerationPipeline.objects.filter(pk=pk, user=request.user).first()
+    if pipeline is None:
+        return Response({"detail": "Not found"}, status=status.HTTP_404_NOT_FOUND)
+    if pipeline.state == 'completed' and pipeline.video is not None:
+        return Response(VideoGenerationSerializer(pipeline.video).data)
+
+    if not is_available('heygen'):
+        response = Response(
+            {"detail": "HeyGen is temporarily unavailable, please retry shortly"},
+            status=status.HTTP_503_SERVICE_UNAVAILABLE
+        )
+        response['Retry-After'] = str(settings.PROVIDER_BREAKER_COOLDOWN_SECONDS)
+        return response
+
+    if not claim_pipeline(pipeline):
+        response = Response(
+            {"detail": "This video is being created right now", "pipeline": GenerationPipelineSerializer(pipeline).data},
+            status=status.HTTP_409_CONFLICT
+        )
+        response['Retry-After'] = '5'
+        return response
+
+    print(f"Resuming pipeline {pipeline.id} (run {pipeline.runs}) at stage {pipeline.failed_stage or 'start'}")
+    return heygen_pipeline_response(
+        pipeline,
+        avatar_file=request.FILES.get('avatar_file'),
+        background_file=request.FILES.get('background_file'),
+        audio_file=request.FILES.get('audio_file'),
+    )
+
+
+@api_view(['POST'])
+@permission_classes([IsAuthenticated])
+@idempotent
+def promote_heygen_draft(request, pk):
+    """
+    Render a draft in full: the whole script at full resolution, same layout.
+
+    The draft's stored uploads and talking photo are reused, so this only
+    queues the render. The new video's parent is the draft.
+    """
+    draft = VideoGeneration.objects.filter(pk=pk, user=request.user).first()
+    if draft is None:
+        return Response({"detail": "Not found"}, status=status.HTTP_404_NOT_FOUND)
+    pipeline = pipeline_of(draft)
+    if not draft.is_draft or pipeline is None or pipeline.state != 'completed':
+        return Response({"detail": "Only HeyGen drafts can be promoted"}, status=status.HTTP_400_BAD_REQUEST)
+    
+    promoted = start_pipeline(request.user, '', {
+        **pipeline.params,
+        'project_name': request.data.get('project_name') or draft.name,
+        'dimension': HEYGEN_DIMENSION,
+        'priority': job_priority(request),
+        'draft': False,
+        'parent_id': draft.id,
+    }, checkpoints=reusable_checkpoints(pipeline, ('avatar', 'background', 'audio', 'talking_photo')))
+    print(f"Promoting draft {draft.id} with pipeline {promoted.id}")
+    return heygen_pipeline_response(promoted)
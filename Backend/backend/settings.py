@@ -12,6 +12,7 @@ https://docs.djangoproject.com/en/5.2/ref/settings/
 
 from pathlib import Path
 import environ
+from corsheaders.defaults import default_headers
 import os
 
 
@@ -99,6 +100,10 @@ else:
             "default": {
                 "ENGINE": "django.db.backends.sqlite3",
                 "NAME": BASE_DIR / "db.sqlite3",
+                # Take the write lock when a transaction starts, so concurrent
+                # select_for_update() sections (e.g. rate_limits.py) queue up
+                # instead of failing with "database is locked"
+                "OPTIONS": {"transaction_mode": "IMMEDIATE"},
             }
         }
 
@@ -171,6 +176,7 @@ CORS_ALLOWED_ORIGINS = [
 
 # During development, allow credentials so browser can send cookies if needed
 CORS_ALLOW_CREDENTIALS = True
+CORS_ALLOW_HEADERS = (*default_headers, "idempotency-key")
 
 # External API keys (D-ID)
 DDI_API_KEY = env("DDI_API_KEY")
@@ -184,6 +190,154 @@ GCP_BUCKET_NAME = env("GCP_BUCKET_NAME")
 BREVO_API_KEY = env("Brevo_API_Key",default='')
 BREVO_API_EMAIL = env("Brevo_API_Email",default='')
 
+# Cache — per-process memory by default; point CACHE_URL at Redis/Memcached so
+# feed pages and their invalidation are shared by all workers
+CACHES = {
+    "default": env.cache("CACHE_URL", default="locmemcache://"),
+}
+
+# Social feed: the optional total count is approximate and cached for this long
+SOCIAL_FEED_COUNT_CACHE_SECONDS = env.int("SOCIAL_FEED_COUNT_CACHE_SECONDS", default=300)
+# Feed pages are rebuilt after FRESH seconds (serving the stale copy meanwhile)
+# and dropped after CACHE seconds. View and like count changes invalidate them
+# at most once per FRESH seconds.
+SOCIAL_FEED_CACHE_SECONDS = env.int("SOCIAL_FEED_CACHE_SECONDS", default=60)
+SOCIAL_FEED_CACHE_FRESH_SECONDS = env.int("SOCIAL_FEED_CACHE_FRESH_SECONDS", default=10)
+SOCIAL_FEED_CACHE_LOCK_SECONDS = env.int("SOCIAL_FEED_CACHE_LOCK_SECONDS", default=5)
+
+# Rows fetched per database round trip when streaming a user's video list
+VIDEO_LIST_STREAM_CHUNK_SIZE = env.int("VIDEO_LIST_STREAM_CHUNK_SIZE", default=500)
+
+# Video views are counted in memory and flushed to views_count every
+# VIEW_COUNT_FLUSH_SECONDS or once VIEW_COUNT_FLUSH_THRESHOLD views are pending
+VIEW_COUNT_FLUSH_SECONDS = env.int("VIEW_COUNT_FLUSH_SECONDS", default=5)
+VIEW_COUNT_FLUSH_THRESHOLD = env.int("VIEW_COUNT_FLUSH_THRESHOLD", default=1000)
+
+# Trending feed: event weights and how fast their influence halves
+TRENDING_HALF_LIFE_HOURS = env.float("TRENDING_HALF_LIFE_HOURS", default=24.0)
+TRENDING_LIKE_WEIGHT = env.float("TRENDING_LIKE_WEIGHT", default=3.0)
+TRENDING_VIEW_WEIGHT = env.float("TRENDING_VIEW_WEIGHT", default=1.0)
+TRENDING_CREATED_WEIGHT = env.float("TRENDING_CREATED_WEIGHT", default=1.0)
+
+# Provider status polling: a refreshed status is reused for VIDEO_STATUS_REFRESH_SECONDS,
+# concurrent refreshes of one video wait up to VIDEO_STATUS_WAIT_SECONDS for the
+# one in progress, which holds its lock for at most VIDEO_STATUS_LOCK_SECONDS
+VIDEO_STATUS_REFRESH_SECONDS = env.int("VIDEO_STATUS_REFRESH_SECONDS", default=5)
+VIDEO_STATUS_WAIT_SECONDS = env.int("VIDEO_STATUS_WAIT_SECONDS", default=10)
+VIDEO_STATUS_LOCK_SECONDS = env.int("VIDEO_STATUS_LOCK_SECONDS", default=300)
+# Bulk status endpoint: ids per request and provider calls in flight per request
+VIDEO_STATUS_BATCH_MAX = env.int("VIDEO_STATUS_BATCH_MAX", default=100)
+VIDEO_STATUS_MAX_CONCURRENCY = env.int("VIDEO_STATUS_MAX_CONCURRENCY", default=4)
+
+# Idempotency-Key: how long a key is remembered, how long a retry waits for the
+# original request, and after how long an unfinished request is considered dead
+IDEMPOTENCY_KEY_TTL_HOURS = env.int("IDEMPOTENCY_KEY_TTL_HOURS", default=24)
+IDEMPOTENCY_WAIT_SECONDS = env.int("IDEMPOTENCY_WAIT_SECONDS", default=30)
+IDEMPOTENCY_LOCK_SECONDS = env.int("IDEMPOTENCY_LOCK_SECONDS", default=600)
+
+# Finished renders older than this are not reused for identical requests
+RENDER_CACHE_MAX_AGE_HOURS = env.int("RENDER_CACHE_MAX_AGE_HOURS", default=720)
+
+# Provider routing (provider=auto): stats come from the last ROUTING_STATS_WINDOW
+# jobs of the past ROUTING_STATS_HOURS. A provider's circuit opens after
+# PROVIDER_BREAKER_FAILURES failed calls within PROVIDER_BREAKER_WINDOW_SECONDS
+ROUTING_STATS_HOURS = env.int("ROUTING_STATS_HOURS", default=24)
+ROUTING_STATS_WINDOW = env.int("ROUTING_STATS_WINDOW", default=200)
+ROUTING_STATS_CACHE_SECONDS = env.int("ROUTING_STATS_CACHE_SECONDS", default=60)
+ROUTING_MIN_SUCCESS_RATE = env.float("ROUTING_MIN_SUCCESS_RATE", default=0.5)
+PROVIDER_BREAKER_FAILURES = env.int("PROVIDER_BREAKER_FAILURES", default=5)
+PROVIDER_BREAKER_WINDOW_SECONDS = env.int("PROVIDER_BREAKER_WINDOW_SECONDS", default=60)
+PROVIDER_BREAKER_COOLDOWN_SECONDS = env.int("PROVIDER_BREAKER_COOLDOWN_SECONDS", default=30)
+
+# Provider API key limits, as granted by D-ID/HeyGen. Calls are paced to
+# PROVIDER_RATE_HEADROOM of requests_per_minute, with at most `concurrency` in flight
+PROVIDER_RATE_LIMITS = env.json("PROVIDER_RATE_LIMITS", default={
+    "d-id": {"requests_per_minute": 60, "burst": 5, "concurrency": 10},
+    "heygen": {"requests_per_minute": 60, "burst": 5, "concurrency": 10},
+})
+PROVIDER_RATE_HEADROOM = env.float("PROVIDER_RATE_HEADROOM", default=0.9)
+# How long video creation waits for quota, and the pause after a 429 without Retry-After
+PROVIDER_RATE_LIMIT_MAX_WAIT_SECONDS = env.int("PROVIDER_RATE_LIMIT_MAX_WAIT_SECONDS", default=20)
+PROVIDER_RATE_LIMIT_BACKOFF_SECONDS = env.int("PROVIDER_RATE_LIMIT_BACKOFF_SECONDS", default=10)
+# Status polls give up on quota quickly and serve the stored state
+VIDEO_STATUS_QUOTA_WAIT_SECONDS = env.int("VIDEO_STATUS_QUOTA_WAIT_SECONDS", default=1)
+
+# Render job scheduler: renders in flight at the providers overall and per user,
+# fair-share weights of the priority tiers, and retry policy for failed dispatches
+SCHEDULER_MAX_IN_FLIGHT = env.int("SCHEDULER_MAX_IN_FLIGHT", default=20)
+SCHEDULER_USER_MAX_IN_FLIGHT = env.int("SCHEDULER_USER_MAX_IN_FLIGHT", default=3)
+SCHEDULER_PRIORITY_WEIGHTS = env.json("SCHEDULER_PRIORITY_WEIGHTS", default={"high": 4.0, "normal": 2.0, "low": 1.0})
+SCHEDULER_MAX_ATTEMPTS = env.int("SCHEDULER_MAX_ATTEMPTS", default=5)
+SCHEDULER_RETRY_SECONDS = env.int("SCHEDULER_RETRY_SECONDS", default=15)
+SCHEDULER_DISPATCH_TIMEOUT_SECONDS = env.int("SCHEDULER_DISPATCH_TIMEOUT_SECONDS", default=600)
+SCHEDULER_IN_FLIGHT_TIMEOUT_SECONDS = env.int("SCHEDULER_IN_FLIGHT_TIMEOUT_SECONDS", default=7200)
+# How often the dispatcher checks the status of renders in flight to free their slots
+SCHEDULER_POLL_SECONDS = env.int("SCHEDULER_POLL_SECONDS", default=15)
+# Dispatch from web processes as jobs are queued/finish; set to False when
+# running `manage.py dispatch_jobs --loop` as a dedicated worker instead
+SCHEDULER_DISPATCH_IN_PROCESS = env.bool("SCHEDULER_DISPATCH_IN_PROCESS", default=True)
+
+# Rows accepted in one bulk generation manifest
+BATCH_MAX_ITEMS = env.int("BATCH_MAX_ITEMS", default=1000)
+
+# Buffer of a streamed upload to GCS (uploads.py); must be a multiple of 256 KiB
+GCP_UPLOAD_CHUNK_SIZE = env.int("GCP_UPLOAD_CHUNK_SIZE", default=8 * 1024 * 1024)
+
+# Direct uploads (signed URLs): lifetime of a signed URL, how long an upload
+# may stay unfinalized before purge_uploads removes it, and size caps per kind
+UPLOAD_URL_EXPIRY_SECONDS = env.int("UPLOAD_URL_EXPIRY_SECONDS", default=900)
+UPLOAD_PENDING_TTL_HOURS = env.int("UPLOAD_PENDING_TTL_HOURS", default=24)
+UPLOAD_MAX_BYTES = env.json("UPLOAD_MAX_BYTES", default={
+    "image": 20 * 1024 * 1024,
+    "background": 500 * 1024 * 1024,
+    "audio": 50 * 1024 * 1024,
+})
+
+# Re-hosting of finished videos: files from this size up are copied as parallel
+# ranged downloads into GCS parts that are then composed into one object
+GCP_PARALLEL_TRANSFER_THRESHOLD = env.int("GCP_PARALLEL_TRANSFER_THRESHOLD", default=64 * 1024 * 1024)
+GCP_PARALLEL_PART_SIZE = env.int("GCP_PARALLEL_PART_SIZE", default=32 * 1024 * 1024)
+GCP_PARALLEL_TRANSFER_WORKERS = env.int("GCP_PARALLEL_TRANSFER_WORKERS", default=8)
+GCP_PARALLEL_PART_RETRIES = env.int("GCP_PARALLEL_PART_RETRIES", default=3)
+
+# Re-host workers (rehosting.py): copies per worker pool and running overall,
+# retry policy with exponential backoff, and when a running copy counts as dead
+REHOST_WORKERS = env.int("REHOST_WORKERS", default=4)
+REHOST_MAX_RUNNING = env.int("REHOST_MAX_RUNNING", default=8)
+REHOST_MAX_ATTEMPTS = env.int("REHOST_MAX_ATTEMPTS", default=6)
+REHOST_RETRY_SECONDS = env.int("REHOST_RETRY_SECONDS", default=30)
+REHOST_RETRY_MAX_SECONDS = env.int("REHOST_RETRY_MAX_SECONDS", default=1800)
+REHOST_TIMEOUT_SECONDS = env.int("REHOST_TIMEOUT_SECONDS", default=1800)
+# Run the pool in web processes as videos finish; set to False when running
+# `manage.py rehost_videos --loop` as a dedicated worker instead
+REHOST_IN_PROCESS = env.bool("REHOST_IN_PROCESS", default=True)
+
+# HeyGen creation pipelines (pipelines.py): how long a failed run can be resumed
+# (purge_uploads then deletes its stored files), and when a run counts as dead
+PIPELINE_RESUME_HOURS = env.int("PIPELINE_RESUME_HOURS", default=24)
+PIPELINE_LOCK_SECONDS = env.int("PIPELINE_LOCK_SECONDS", default=600)
+
+# HeyGen drafts: output size, and how much of the script (first sentence, at
+# most this many characters) or of the audio they render
+HEYGEN_DRAFT_DIMENSION = env.json("HEYGEN_DRAFT_DIMENSION", default={"width": 640, "height": 360})
+HEYGEN_DRAFT_MAX_CHARS = env.int("HEYGEN_DRAFT_MAX_CHARS", default=160)
+HEYGEN_DRAFT_AUDIO_SECONDS = env.int("HEYGEN_DRAFT_AUDIO_SECONDS", default=5)
+
+# Segmented rendering (segments.py): long scripts are split into segments of
+# about SEGMENT_MAX_CHARS (at most SEGMENT_MAX_COUNT of them) that render in
+# parallel and are stitched with ffmpeg. A stitch that hasn't finished after
+# SEGMENT_STITCH_TIMEOUT_SECONDS is retried, up to SEGMENT_STITCH_MAX_ATTEMPTS
+# times, SEGMENT_STITCH_RETRY_SECONDS apart.
+SEGMENT_MAX_CHARS = env.int("SEGMENT_MAX_CHARS", default=600)
+SEGMENT_MAX_COUNT = env.int("SEGMENT_MAX_COUNT", default=10)
+SEGMENT_STITCH_TIMEOUT_SECONDS = env.int("SEGMENT_STITCH_TIMEOUT_SECONDS", default=900)
+SEGMENT_STITCH_MAX_ATTEMPTS = env.int("SEGMENT_STITCH_MAX_ATTEMPTS", default=3)
+SEGMENT_STITCH_RETRY_SECONDS = env.int("SEGMENT_STITCH_RETRY_SECONDS", default=30)
+# Stitch in web processes as the last segment finishes; set to False when
+# running `manage.py stitch_segments --loop` as a dedicated worker instead
+SEGMENT_STITCH_IN_PROCESS = env.bool("SEGMENT_STITCH_IN_PROCESS", default=True)
+FFMPEG_BINARY = env("FFMPEG_BINARY", default="ffmpeg")
+
 # Initialize GCP Storage on startup
 if GCP_SERVICE_ACCOUNT_FILE:
     try:
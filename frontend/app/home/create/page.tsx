@@ -69,6 +69,8 @@ export default function CreateProjectPage() {
   const router = useRouter()
   const [currentStep, setCurrentStep] = useState(1)
   const [isLoading, setIsLoading] = useState(false)
+  // Reused when a submit is retried after a network failure, so the server doesn't start a second render
+  const idempotencyKeyRef = useRef<string | null>(null)
   const [isEnhancing, setIsEnhancing] = useState(false)
   const [voices, setVoices] = useState<Record<string, VoiceOption[]>>({})
   const [selectedProvider, setSelectedProvider] = useState<string>('microsoft')
@@ -401,6 +403,8 @@ export default function CreateProjectPage() {
       const form = new FormData()
       form.append('name', formData.name)
       form.append('input_type', formData.inputType)
+      // Let the server pick the healthiest provider when the request allows it
+      form.append('provider', 'auto')
       
       if (formData.inputType === 'text') {
         form.append('script_input', formData.script)
@@ -417,14 +421,21 @@ export default function CreateProjectPage() {
         form.append('image_file', formData.imageFile)
       }
 
+      if (!idempotencyKeyRef.current) {
+        idempotencyKeyRef.current = crypto.randomUUID()
+      }
       const response = await fetch(`${API_URL}/api/videos/create/`, {
         method: 'POST',
         headers: {
           'Authorization': `Bearer ${tokens.access}`,
+          'Idempotency-Key': idempotencyKeyRef.current,
         },
         body: form,
       })
 
+      // The server answered, so the next submit is a new request
+      idempotencyKeyRef.current = null
+
       if (!response.ok) {
         throw new Error('Failed to create video')
       }
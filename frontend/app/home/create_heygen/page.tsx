@@ -52,6 +52,8 @@ interface FormData {
 
 export default function CreateHeyGenPage() {
   const router = useRouter()
+  // Reused when a submit is retried after a network failure, so the server doesn't start a second render
+  const idempotencyKeyRef = useRef<string | null>(null)
   const [voices, setVoices] = useState<Voice[]>([])
   const [filteredVoices, setFilteredVoices] = useState<Voice[]>([])
   const [searchVoice, setSearchVoice] = useState('')
@@ -464,14 +466,21 @@ export default function CreateHeyGenPage() {
         formDataToSend.append('background_file', formData.backgroundFile)
       }
 
+      if (!idempotencyKeyRef.current) {
+        idempotencyKeyRef.current = crypto.randomUUID()
+      }
       const response = await fetch(`${API_URL}/api/heygen/create/`, {
         method: 'POST',
         headers: {
           'Authorization': `Bearer ${tokens.access}`,
+          'Idempotency-Key': idempotencyKeyRef.current,
         },
         body: formDataToSend,
       })
 
+      // The server answered, so the next submit is a new request
+      idempotencyKeyRef.current = null
+
       if (!response.ok) {
         throw new Error('Failed to create video')
       }
@@ -69,7 +69,9 @@ export default function HomePage() {
     try {
       const API_URL = (process.env.NEXT_PUBLIC_API_URL as string) || 'http://127.0.0.1:8000'
       const tokens = JSON.parse(localStorage.getItem('voxvid_tokens') || '{}')
-      const response = await fetch(`${API_URL}/api/videos/`, {
+      // Streamed as one array with only the columns the dashboard needs
+      const fields = 'id,name,status,script_input,source_url,talk_id,result_url,created_at'
+      const response = await fetch(`${API_URL}/api/videos/?stream=true&fields=${fields}`, {
         headers: {
           'Authorization': `Bearer ${tokens.access}`,
         },
@@ -81,10 +83,10 @@ export default function HomePage() {
           id: v.id.toString(),
           name: v.name,
           step: v.status === 'done' || v.status === 'completed' ? 4 : 
-                v.status === 'processing' || v.status === 'created' ? 3 : 1,
+                v.status === 'processing' || v.status === 'created' || v.status === 'queued' || v.status === 'stitching' ? 3 : 1,
           prompt: v.script_input,
             imageUrl: v.source_url,
-            imageBase64: v.original_image_base64 || null,
+            imageBase64: null,
           talkId: v.talk_id,
           status: v.status,
           resultUrl: v.result_url,
@@ -137,33 +139,44 @@ export default function HomePage() {
 
   useEffect(() => {
     const interval = setInterval(() => {
-      projects.forEach(project => {
-        if (project.step === 3 && project.talkId) {
-          checkStatus(project.id)
-        }
-      })
+      const pendingIds = projects
+        .filter(project => project.step === 3 && project.talkId)
+        .map(project => project.id)
+      if (pendingIds.length > 0) {
+        checkStatuses(pendingIds)
+      }
     }, 5000)
 
     return () => clearInterval(interval)
   }, [projects])
 
-  const checkStatus = async (projectId: string) => {
+  // One request per poll cycle, however many projects are rendering
+  const checkStatuses = async (projectIds: string[]) => {
     try {
       const API_URL = (process.env.NEXT_PUBLIC_API_URL as string) || 'http://127.0.0.1:8000'
       const tokens = JSON.parse(localStorage.getItem('voxvid_tokens') || '{}')
-      const response = await fetch(`${API_URL}/api/videos/${projectId}/update/`, {
+      const response = await fetch(`${API_URL}/api/videos/status/?fields=id,status,result_url`, {
         method: 'POST',
         headers: {
           'Authorization': `Bearer ${tokens.access}`,
+          'Content-Type': 'application/json',
         },
+        body: JSON.stringify({ ids: projectIds.map(Number) }),
       })
       if (response.ok) {
         const data = await response.json()
-        if (data.status === 'done' || data.status === 'completed') {
-          setProjects(prev => prev.map(p => p.id === projectId ? { ...p, step: 4, status: 'done', resultUrl: data.result_url } : p))
-        } else if (data.status === 'processing') {
-          setProjects(prev => prev.map(p => p.id === projectId ? { ...p, step: 3, status: 'processing' } : p))
-        }
+        const byId = new Map<string, any>(data.results.map((v: any) => [v.id.toString(), v]))
+        setProjects(prev => prev.map(p => {
+          const v = byId.get(p.id)
+          if (!v) return p
+          if (v.status === 'done' || v.status === 'completed') {
+            return { ...p, step: 4, status: 'done', resultUrl: v.result_url }
+          }
+          if (v.status === 'processing' || v.status === 'created' || v.status === 'queued' || v.status === 'stitching') {
+            return { ...p, step: 3, status: v.status }
+          }
+          return p
+        }))
       }
     } catch (error) {
       console.error('Error checking status:', error)
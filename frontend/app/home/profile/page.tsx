@@ -120,24 +120,19 @@ export default function ProfilePage() {
         }))
       }
 
-      // Fetch video count
-      const videosResponse = await fetch(`${API_URL}/api/videos/`, {
+      // Fetch video totals (the video list itself is paginated)
+      const statsResponse = await fetch(`${API_URL}/api/videos/stats/`, {
         headers: {
           'Authorization': `Bearer ${tokens.access}`,
         },
       })
 
-      if (videosResponse.ok) {
-        const videosData = await videosResponse.json()
-        const videoCount = Array.isArray(videosData) ? videosData.length : videosData.count || 0
-        const totalViews = Array.isArray(videosData) 
-          ? videosData.reduce((sum: number, video: any) => sum + (video.view_count || 0), 0)
-          : 0
-
+      if (statsResponse.ok) {
+        const statsData = await statsResponse.json()
         setUserStats(prev => ({
           ...prev,
-          videosCreated: videoCount,
-          totalViews: totalViews
+          videosCreated: statsData.videos_count || 0,
+          totalViews: statsData.views_count || 0
         }))
       }
     } catch (error) {
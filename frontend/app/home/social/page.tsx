@@ -35,6 +35,7 @@ export default function SocialPage() {
   const [selectedVideo, setSelectedVideo] = useState<Video | null>(null);
   const [page, setPage] = useState(1);
   const [hasMore, setHasMore] = useState(true);
+  const nextCursorRef = useRef<string | null>(null);
   const [isMuted, setIsMuted] = useState(false);
   const containerRef = useRef<HTMLDivElement>(null);
   const videoRefs = useRef<Map<number, HTMLVideoElement>>(new Map());
@@ -64,8 +65,11 @@ export default function SocialPage() {
     try {
       const API_URL = (process.env.NEXT_PUBLIC_API_URL as string) || 'http://127.0.0.1:8000';
       const tokens = JSON.parse(localStorage.getItem('voxvid_tokens') || '{}');
+      const cursorParam = page > 1 && nextCursorRef.current
+        ? `&cursor=${encodeURIComponent(nextCursorRef.current)}`
+        : "";
       const response = await fetch(
-        `${API_URL}/api/social/videos/?page=${page}&page_size=12`,
+        `${API_URL}/api/social/videos/?page_size=12${cursorParam}`,
         {
           headers: {
             Authorization: `Bearer ${tokens.access}`,
@@ -80,7 +84,8 @@ export default function SocialPage() {
         } else {
           setVideos((prev) => [...prev, ...data.results]);
         }
-        setHasMore(data.next !== null);
+        nextCursorRef.current = data.next_cursor;
+        setHasMore(data.has_next);
       }
     } catch (error) {
       console.error("Error fetching videos:", error);